@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -83,6 +84,40 @@ DATABASES = {
     }
 }
 
+# Saved reports (and the other per-customer tables) are sharded by customer_id across REPORT_SHARD_COUNT
+# SQLite databases (reports_0.sqlite3, reports_1.sqlite3, ...), a single shard keeps them in the default database.
+# Databases of the shards no longer used (REPORT_RETIRED_SHARDS, comma separated aliases) stay configured
+# until their reports are moved with 'manage.py reshard_reports'.
+# Migrate all the databases (including the admission database below) with 'manage.py migrate_shards'
+
+REPORT_SHARD_COUNT = int(os.environ.get('REPORT_SHARD_COUNT', 1))
+
+REPORT_SHARDS = ['default'] if REPORT_SHARD_COUNT == 1 else [f'reports_{i}' for i in range(REPORT_SHARD_COUNT)]
+
+REPORT_RETIRED_SHARDS = [alias for alias in os.environ.get('REPORT_RETIRED_SHARDS', '').split(',') if alias]
+
+DATABASES.update({
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+    }
+    for alias in REPORT_SHARDS + REPORT_RETIRED_SHARDS if alias != 'default'
+})
+
+# Requests in flight of the admission control (see REPORT_ADMISSION_* below) are tracked in a small database
+# of their own, so the admission of every report request does not take the write lock of the default database.
+# Its writes wait at most 'timeout' seconds for the lock (the request is rejected with 503 then)
+
+REPORT_ADMISSION_DATABASE = 'admission'
+
+DATABASES[REPORT_ADMISSION_DATABASE] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'admission.sqlite3',
+    'OPTIONS': {'timeout': 1},
+}
+
+DATABASE_ROUTERS = ['report_api.routers.ReportShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -122,6 +157,127 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Exchange rates fetched from the api.nbp.pl are kept in a rate store shared by all workers
+# and refreshed after NBP_RATES_MAX_AGE seconds. The NBP_API_URL can be pointed at a local stand-in
+# of the api.nbp.pl (see benchmarks/nbp_stub.py) with the NBP_API_URL environment variable.
+# Requests to the api.nbp.pl taking longer than NBP_API_TIMEOUT seconds fail with 503
+
+NBP_API_URL = os.environ.get('NBP_API_URL', 'https://api.nbp.pl/api')
+
+NBP_API_TIMEOUT = 5
+
+NBP_RATES_MAX_AGE = 60 * 60
+
+# Outdated rates (not older than NBP_RATES_MAX_STALENESS seconds) are served while they are refreshed in the background
+
+NBP_RATES_MAX_STALENESS = 24 * 60 * 60
+
+
+# Admission control of the report requests (of all the worker processes):
+# max number of requests in flight per client, max total number of payment rows in flight,
+# how long (in seconds) a request may wait for the rows budget, expected size of a payment row
+# in the request body (in bytes) and 'Retry-After' sent with the rejected requests (in seconds).
+# Requests in flight are tracked in the admission database, and expire after REPORT_ADMISSION_TICKET_TTL seconds
+# (e.g. of the killed workers). REPORT_ADMISSION_SHARED = False tracks them in memory, per worker process
+# (only useful with threaded workers, a sync worker handles a single request at a time)
+
+REPORT_ADMISSION_MAX_CLIENT_REQUESTS = 4
+
+REPORT_ADMISSION_MAX_INFLIGHT_ROWS = 200000
+
+REPORT_ADMISSION_QUEUE_TIMEOUT = 5
+
+REPORT_ADMISSION_BYTES_PER_ROW = 150
+
+REPORT_ADMISSION_RETRY_AFTER = 5
+
+REPORT_ADMISSION_TICKET_TTL = 10 * 60
+
+REPORT_ADMISSION_SHARED = True
+
+
+# Max total size (in bytes) of the rendered reports cached for repeated identical submissions (per worker process)
+
+REPORT_CACHE_MAX_SIZE = 64 * 2 ** 20
+
+
+# Reports with at least REPORT_PARALLEL_VALIDATION_THRESHOLD payments are validated in chunks
+# of REPORT_PARALLEL_VALIDATION_CHUNK_SIZE payments in a pool of REPORT_PARALLEL_VALIDATION_WORKERS processes
+# (None means one per CPU, 0 threshold disables the parallel validation)
+
+REPORT_PARALLEL_VALIDATION_THRESHOLD = 100000
+
+REPORT_PARALLEL_VALIDATION_CHUNK_SIZE = 20000
+
+REPORT_PARALLEL_VALIDATION_WORKERS = None
+
+
+# Report responses of at least REPORT_COMPRESSION_MIN_SIZE bytes are compressed with brotli (if the Brotli package
+# is installed) or gzip, negotiated with the Accept-Encoding header. Compression levels trade CPU for bytes:
+# REPORT_GZIP_LEVEL 1 (fastest) - 9 (smallest), REPORT_BROTLI_QUALITY 0 (fastest) - 11 (smallest)
+
+REPORT_COMPRESSION_MIN_SIZE = 16 * 1024
+
+REPORT_GZIP_LEVEL = 6
+
+REPORT_BROTLI_QUALITY = 4
+
+
+# Caches, 'saved-reports' is the read-through cache of the saved reports (GET /customer-report/<pk>),
+# with at most MAX_ENTRIES / 2 reports (each with its version) of at most SAVED_REPORT_CACHE_MAX_ITEM_SIZE bytes.
+# It is shared by all the worker processes (files in the SAVED_REPORT_CACHE_DIR directory), so a report saved
+# by one worker is never served stale by the others (a process local backend, e.g. locmem, would serve it until
+# it expires).
+# Hit and miss counts of every worker are logged (by the report_api.cache logger) every
+# SAVED_REPORT_CACHE_STATS_INTERVAL lookups
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+SAVED_REPORT_CACHE_DIR = os.environ.get('SAVED_REPORT_CACHE_DIR', str(BASE_DIR / 'saved_report_cache'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'saved-reports': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SAVED_REPORT_CACHE_DIR,
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+SAVED_REPORT_CACHE = 'saved-reports'
+
+SAVED_REPORT_CACHE_MAX_ITEM_SIZE = 2 ** 20
+
+SAVED_REPORT_CACHE_STATS_INTERVAL = 1000
+
+
+# Retention of the saved reports ('manage.py prune_reports'): reports not accessed for REPORT_RETENTION_MAX_AGE_DAYS,
+# and the least recently accessed ones while the saved reports exceed REPORT_STORAGE_BUDGET bytes, are deleted
+# (None disables the limit). Last access times are recorded at most once per REPORT_ACCESS_TRACKING_RESOLUTION seconds
+
+REPORT_RETENTION_MAX_AGE_DAYS = None
+
+REPORT_STORAGE_BUDGET = None
+
+REPORT_ACCESS_TRACKING_RESOLUTION = 60 * 60
+
+# Upload sessions (of reports uploaded in chunks) not committed within UPLOAD_SESSION_MAX_AGE_DAYS are deleted
+# by 'manage.py prune_reports'
+
+UPLOAD_SESSION_MAX_AGE_DAYS = 7
+
+
+# Memory budget tests: sizes (in rows) of the synthetic reports the peak memory per row is measured for
+# (comma separated, e.g. REPORT_MEMORY_BUDGET_ROWS=10000,100000), and per-row budgets (in bytes) overriding
+# the defaults of benchmarks.memory_budget.MEMORY_BUDGETS
+
+REPORT_MEMORY_BUDGET_ROWS = [int(rows) for rows in os.environ.get('REPORT_MEMORY_BUDGET_ROWS', '1000').split(',')]
+
+REPORT_MEMORY_BUDGETS = {}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
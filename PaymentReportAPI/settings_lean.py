@@ -0,0 +1,45 @@
+"""
+Lean deployment profile of the PaymentReportAPI: serves only the report_api endpoints, without the admin,
+auth, sessions, messages and staticfiles apps and their middleware, so workers boot faster and every request
+passes through a minimal middleware chain. Everything else is the same as in the default settings.
+
+Use it with DJANGO_SETTINGS_MODULE=PaymentReportAPI.settings_lean (e.g. for the WSGI workers).
+There are no users in this profile, so the admin-only analytics endpoint always denies access.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'rest_framework',
+    'report_api.apps.ReportApiConfig'
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+]
+
+ROOT_URLCONF = 'PaymentReportAPI.urls_lean'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+            ],
+        },
+    },
+]
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# Requests are not authenticated (without the auth app there is no AnonymousUser either)
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'UNAUTHENTICATED_USER': None,
+}
@@ -0,0 +1,6 @@
+"""PaymentReportAPI URL Configuration of the lean deployment profile (see settings_lean), without the admin."""
+from django.urls import path, include
+
+urlpatterns = [
+    path('', include('report_api.urls'))
+]
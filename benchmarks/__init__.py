@@ -0,0 +1,13 @@
+"""
+Benchmarks of the report generation. Run them from the root directory of the project, e.g.:
+
+    python -m benchmarks.bench_json --rows 100000
+"""
+import os
+
+
+def setup_django(settings_module='PaymentReportAPI.settings'):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
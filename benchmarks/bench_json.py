@@ -0,0 +1,81 @@
+"""
+Compare the DRF's JSONParser and JSONRenderer with the FastJSONParser and FastJSONRenderer
+on a synthetic report payload.
+
+    python -m benchmarks.bench_json --rows 100000
+"""
+import argparse
+import io
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from benchmarks import setup_django
+from benchmarks.payloads import make_payload
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_report_rows(payload):
+    """Build rows shaped like the validated data of the PaymentInfoSerializer."""
+    rows = []
+    for payment_type, payments in payload.items():
+        for payment in payments:
+            payment_mean = payment.get('bank') or payment.get('iban') or payment.get('card_number')
+            rows.append(OrderedDict(date=datetime.fromisoformat(payment['created_at']).astimezone(timezone.utc),
+                                    type=payment_type,
+                                    payment_mean=payment_mean,
+                                    description=payment['description'],
+                                    amount=payment['amount'],
+                                    currency=payment['currency'],
+                                    amount_in_pln=payment['amount']))
+    rows.sort(key=lambda row: row['date'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from report_api.parsers import FastJSONParser, orjson
+    from report_api.renderers import FastJSONRenderer
+
+    if orjson is None:
+        print("orjson is not installed, the fast parser and renderer fall back to the stdlib json")
+
+    payload = make_payload(args.rows)
+    request_body = JSONRenderer().render(payload)
+    report_rows = make_report_rows(payload)
+
+    assert JSONRenderer().render(report_rows) == FastJSONRenderer().render(report_rows)
+
+    cases = [
+        ("parse request", JSONParser(), FastJSONParser(),
+         lambda parser: parser.parse(io.BytesIO(request_body))),
+        ("render report", JSONRenderer(), FastJSONRenderer(),
+         lambda renderer: renderer.render(report_rows)),
+    ]
+
+    print(f"{args.rows} rows, {len(request_body) / 2 ** 20:.1f} MiB request body, best of {args.repeat}")
+    for name, default, fast, run in cases:
+        default_time = best_of(args.repeat, lambda: run(default))
+        fast_time = best_of(args.repeat, lambda: run(fast))
+        print(f"{name:15} DRF: {default_time * 1000:9.1f} ms   fast: {fast_time * 1000:9.1f} ms   "
+              f"speedup: {default_time / fast_time:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
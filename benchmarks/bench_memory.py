@@ -0,0 +1,90 @@
+"""
+Compare the memory used by generate_report (payment records) with the memory used by the previous
+representation of report rows ((payment_type, OrderedDict) tuples, payment_info dicts and the validated data
+of the PaymentInfoSerializer), measured with tracemalloc on a synthetic report payload.
+
+    python -m benchmarks.bench_memory --rows 20000
+"""
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks import setup_django
+from benchmarks.payloads import make_payload
+
+RATES = {"EUR": 4.6, "USD": 4.4, "GBP": 5.3}
+
+
+def generate_legacy_report(data):
+    """Report generation as it was implemented before the payment records were introduced."""
+    import pytz
+    from report_api.serializers import SERIALIZERS_DICT, PaymentInfoSerializer
+    from report_api.validation import get_payment_mean
+
+    validated_data_list = []
+    for payment_type in data:
+        for obj in data[payment_type]:
+            s = SERIALIZERS_DICT[payment_type](data=obj)
+            s.is_valid(raise_exception=True)
+            validated_data = s.validated_data
+            validated_data['created_at'] = validated_data['created_at'].astimezone(pytz.utc)
+            validated_data_list.append((payment_type, validated_data))
+
+    validated_data_list.sort(key=lambda x: x[1]['created_at'])
+
+    payment_info_list = []
+    for payment_type, validated_data in validated_data_list:
+        currency = validated_data['currency']
+        payment_info_list.append({'date': validated_data['created_at'],
+                                  'type': payment_type,
+                                  'payment_mean': get_payment_mean(payment_type, validated_data),
+                                  'description': validated_data['description'],
+                                  'currency': currency,
+                                  'amount': validated_data['amount'],
+                                  'amount_in_pln': int(validated_data['amount'] * RATES.get(currency, 1))})
+
+    report = PaymentInfoSerializer(data=payment_info_list, many=True)
+    report.is_valid()
+    return validated_data_list, payment_info_list, report.validated_data
+
+
+def measure(func, data):
+    """:return: tuple (peak allocated bytes, bytes retained by the result)"""
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = func(data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak - before, retained - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from report_api.views import generate_report
+
+    data = make_payload(args.rows)
+    cases = [
+        ("previous", generate_legacy_report),
+        ("records", lambda payload: generate_report(payload, rates=dict(RATES))),
+    ]
+
+    print(f"{args.rows} rows")
+    results = {}
+    for name, func in cases:
+        peak, retained = measure(func, data)
+        results[name] = retained
+        print(f"{name:9} peak: {peak / args.rows:7.0f} B/row   retained: {retained / args.rows:7.0f} B/row")
+
+    print(f"retained memory reduced {results['previous'] / results['records']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
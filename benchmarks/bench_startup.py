@@ -0,0 +1,90 @@
+"""
+Compare the cold start of the default and the lean (PaymentReportAPI.settings_lean) deployment profiles:
+the boot time of a worker (importing and setting up django, loading the WSGI application and its middleware),
+the latency of its first report request (which also imports the URL configuration and the views)
+and the median latency of the following requests. Every run boots a fresh interpreter.
+
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = {
+    'default': 'PaymentReportAPI.settings',
+    'lean': 'PaymentReportAPI.settings_lean',
+}
+
+
+def run_worker(requests_count, rows):
+    """Boot a worker in this process and measure it. :return: dict of the timings (in seconds)"""
+    start = time.perf_counter()
+
+    from benchmarks import setup_django
+    setup_django(os.environ['DJANGO_SETTINGS_MODULE'])
+
+    from django.core.wsgi import get_wsgi_application
+    get_wsgi_application()
+    boot = time.perf_counter() - start
+
+    # the database and the rates are prepared outside of the measured time
+    from django.db import connections
+    from django.test import Client
+    from django.test.utils import setup_databases, setup_test_environment
+    from benchmarks.bench_memory import RATES
+    from benchmarks.payloads import make_payload
+    from report_api.rates import store_rates
+    from report_api.renderers import render_json
+
+    setup_test_environment()
+    setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+    store_rates(RATES)
+
+    client = Client()
+    body = render_json(make_payload(rows))
+    timings = []
+    for _ in range(requests_count + 1):
+        start = time.perf_counter()
+        response = client.post('/report', data=body, content_type='application/json')
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+
+    return {'boot': boot, 'first_request': timings[0], 'request': statistics.median(timings[1:])}
+
+
+def measure_profile(settings_module, requests_count, rows):
+    """Run the worker in a fresh interpreter. :return: dict of the timings (in seconds)"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--worker',
+                             '--requests', str(requests_count), '--rows', str(rows)],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.requests, args.rows)))
+        return
+
+    print(f"median of {args.repeat} runs, requests of {args.rows} rows")
+    for name, settings_module in PROFILES.items():
+        runs = [measure_profile(settings_module, args.requests, args.rows) for _ in range(args.repeat)]
+        boot, first_request, request = (statistics.median(run[key] for run in runs)
+                                        for key in ('boot', 'first_request', 'request'))
+        print(f"{name:8} boot: {boot * 1000:7.1f} ms   first request: {first_request * 1000:6.1f} ms"
+              f"   request: {request * 1000:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
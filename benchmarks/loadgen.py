@@ -0,0 +1,197 @@
+"""
+Open-loop load generator for the report endpoints.
+
+Sends requests at a target rate (regardless of how fast the server answers, so the latencies are measured
+from the moment each request was due), with a configurable mix of endpoints and payload sizes,
+and reports p50/p95/p99 latency and throughput. Run it against a server using the local api.nbp.pl
+stand-in, e.g.:
+
+    python -m benchmarks.nbp_stub --port 8001 --latency 0.05
+    NBP_API_URL=http://127.0.0.1:8001/api python manage.py runserver 8000
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --rps 50 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+from benchmarks.payloads import make_payload
+
+ENDPOINTS = ('report', 'customer-post', 'customer-get')
+
+
+def parse_mix(value):
+    """Parse mix given as 'name=weight,name=weight'."""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return float('nan')
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def http_request(host, port, method, path, body=b'', timeout=60.0):
+    """Send single HTTP/1.1 request (on a new connection) and return its status code."""
+
+    async def send():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            head = (f"{method} {path} HTTP/1.1\r\n"
+                    f"Host: {host}:{port}\r\n"
+                    f"Connection: close\r\n"
+                    f"Accept: application/json\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n")
+            writer.write(head.encode() + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            await reader.read()  # the response is read until the server closes the connection
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
+
+    return await asyncio.wait_for(send(), timeout)
+
+
+class LoadGenerator:
+
+    def __init__(self, url, rps, duration, endpoint_mix, size_mix, sizes, customers, variants, timeout, seed):
+        split_url = urlsplit(url)
+        self.host = split_url.hostname
+        self.port = split_url.port or 80
+        self.base_path = split_url.path.rstrip('/')
+        self.rps = rps
+        self.duration = duration
+        self.endpoint_mix = endpoint_mix
+        self.size_mix = size_mix
+        self.customers = customers
+        self.timeout = timeout
+        self.random = random.Random(seed)
+
+        # a few distinct payloads of every size, so that not every request is served from the report cache
+        self.payloads = {
+            size_name: [json.dumps(make_payload(sizes[size_name], seed=seed + variant)).encode()
+                        for variant in range(variants)]
+            for size_name in size_mix
+        }
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def choose(self, mix):
+        return self.random.choices(list(mix), weights=list(mix.values()))[0]
+
+    def make_request(self):
+        endpoint = self.choose(self.endpoint_mix)
+        size_name = self.choose(self.size_mix)
+        body = self.random.choice(self.payloads[size_name])
+        customer_path = f"{self.base_path}/customer-report/{self.random.randrange(1, self.customers + 1)}"
+
+        if endpoint == 'report':
+            return f"report/{size_name}", 'POST', f"{self.base_path}/report", body
+        if endpoint == 'customer-post':
+            return f"customer-post/{size_name}", 'POST', customer_path, body
+        return "customer-get", 'GET', customer_path, b''
+
+    async def send(self, due, name, method, path, body):
+        try:
+            status = await http_request(self.host, self.port, method, path, body, self.timeout)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+        except OSError as e:
+            status = type(e).__name__
+
+        self.latencies[name].append(time.monotonic() - due)
+        self.statuses[name][status] += 1
+
+    async def prepare(self):
+        """Save a small report for every customer, so that the GET requests find one."""
+        body = self.payloads[min(self.payloads, key=lambda size_name: len(self.payloads[size_name][0]))][0]
+        for customer_id in range(1, self.customers + 1):
+            await http_request(self.host, self.port, 'POST', f"{self.base_path}/customer-report/{customer_id}",
+                               body, self.timeout)
+
+    async def run(self):
+        await self.prepare()
+
+        tasks = []
+        start = time.monotonic()
+        for i in range(int(self.rps * self.duration)):
+            due = start + i / self.rps
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.send(due, *self.make_request())))
+
+        await asyncio.gather(*tasks)
+        return time.monotonic() - start
+
+    def report(self, elapsed):
+        all_latencies = []
+        print(f"{'request':24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+        for name in sorted(self.latencies):
+            latencies = sorted(self.latencies[name])
+            all_latencies.extend(latencies)
+            self.print_row(name, latencies, self.statuses[name])
+
+        all_statuses = sum(self.statuses.values(), Counter())
+        self.print_row("all", sorted(all_latencies), all_statuses)
+
+        ok_count = sum(count for status, count in all_statuses.items() if isinstance(status, int) and status < 400)
+        print(f"\nsent {len(all_latencies)} requests in {elapsed:.1f}s, "
+              f"throughput: {len(all_latencies) / elapsed:.1f} req/s ({ok_count / elapsed:.1f} successful req/s)")
+
+    @staticmethod
+    def print_row(name, latencies, statuses):
+        print(f"{name:24} {len(latencies):7} "
+              f"{percentile(latencies, 0.50) * 1000:9.1f} "
+              f"{percentile(latencies, 0.95) * 1000:9.1f} "
+              f"{percentile(latencies, 0.99) * 1000:9.1f}  "
+              + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base url of the service.")
+    parser.add_argument('--rps', type=float, default=20, help="Target number of requests per second.")
+    parser.add_argument('--duration', type=float, default=30, help="Duration of the test in seconds.")
+    parser.add_argument('--endpoints', type=parse_mix, default='report=60,customer-post=20,customer-get=20',
+                        help="Weights of the endpoints (%s)." % ', '.join(ENDPOINTS))
+    parser.add_argument('--sizes', type=parse_mix, default='small=80,medium=18,large=2',
+                        help="Weights of the payload sizes.")
+    parser.add_argument('--small', type=int, default=10, help="Number of payments in a small payload.")
+    parser.add_argument('--medium', type=int, default=1000, help="Number of payments in a medium payload.")
+    parser.add_argument('--large', type=int, default=10000, help="Number of payments in a large payload.")
+    parser.add_argument('--customers', type=int, default=100, help="Number of distinct customers.")
+    parser.add_argument('--variants', type=int, default=5, help="Number of distinct payloads of every size.")
+    parser.add_argument('--timeout', type=float, default=60, help="Timeout of a single request in seconds.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    unknown_endpoints = set(args.endpoints) - set(ENDPOINTS)
+    if unknown_endpoints:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown_endpoints))}")
+
+    sizes = {'small': args.small, 'medium': args.medium, 'large': args.large}
+    unknown_sizes = set(args.sizes) - set(sizes)
+    if unknown_sizes:
+        parser.error(f"unknown payload sizes: {', '.join(sorted(unknown_sizes))}")
+
+    generator = LoadGenerator(args.url, args.rps, args.duration, args.endpoints, args.sizes, sizes,
+                              args.customers, args.variants, args.timeout, args.seed)
+    elapsed = asyncio.run(generator.run())
+    generator.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Memory budget of the report paths: the peak memory allocated (measured with tracemalloc) per report row
+while generating, serializing, saving and retrieving reports of synthetic payloads, checked against the per-row
+budgets of the paths (MEMORY_BUDGETS, overridden with settings.REPORT_MEMORY_BUDGETS). Used by the memory budget tests
+(report_api.tests.MemoryBudgetTests), and can be run for larger reports on its own (exits with 1 if over budget),
+e.g. for 10k, 100k and 1M rows (the 1M rows take a long time, tracemalloc slows the validation down a few times):
+
+    python -m benchmarks.memory_budget --rows 10000 100000 1000000
+"""
+import argparse
+import sys
+
+from benchmarks import setup_django
+from benchmarks.bench_memory import RATES, measure
+from benchmarks.payloads import make_payload
+
+# peak bytes allocated per report row (a rendered report takes about 200 bytes per row)
+MEMORY_BUDGETS = {
+    'generate_report': 1000,
+    'payment_info_serializer': 2500,
+    'report_view': 2500,
+    'customer_report_save': 4000,
+    'customer_report_get': 1000,
+}
+BENCHMARK_CUSTOMER_ID = 999999999
+WARM_UP_ROWS = 100
+
+
+def get_memory_budgets():
+    from django.conf import settings
+
+    return {**MEMORY_BUDGETS, **getattr(settings, 'REPORT_MEMORY_BUDGETS', {})}
+
+
+def get_paths(payload, client):
+    """:return: dict mapping path name to a function running the path for the 'payload'"""
+    from django.urls import reverse
+    from report_api.cache import report_cache, saved_report_cache
+    from report_api.renderers import render_json
+    from report_api.views import RenderedReportResponse, generate_report
+
+    body = render_json(payload)
+    rendered_report = render_json(generate_report(payload))
+    customer_url = reverse('report_api:customer-report', kwargs={'pk': BENCHMARK_CUSTOMER_ID})
+
+    def post(url):
+        report_cache.clear()
+        response = client.post(url, data=body, content_type='application/json')
+        assert response.status_code in (200, 201), response.status_code
+        return response
+
+    def get(url):
+        saved_report_cache.clear()
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+        return response
+
+    return {
+        'generate_report': lambda: generate_report(payload),
+        'payment_info_serializer': lambda: RenderedReportResponse(rendered_report).data,
+        'report_view': lambda: post(reverse('report_api:report')),
+        'customer_report_save': lambda: post(customer_url),
+        'customer_report_get': lambda: get(customer_url),
+    }
+
+
+def measure_paths(rows, client):
+    """
+    Measure the peak memory allocated per row on every path, for a report of 'rows' payments.
+    Foreign currency rates are stored in the rate store first, so no path contacts the api.nbp.pl.
+    :param client: django test client the views are requested with
+    :return: dict mapping path name to peak bytes allocated per row
+    """
+    from django.test import override_settings
+    from report_api.rates import store_rates
+
+    store_rates(RATES)
+
+    # validated in this process, so that all the memory is traced
+    with override_settings(REPORT_PARALLEL_VALIDATION_THRESHOLD=0):
+        # memory allocated once (e.g. on the first request) does not count towards the rows
+        for path in get_paths(make_payload(WARM_UP_ROWS), client).values():
+            path()
+
+        paths = get_paths(make_payload(rows), client)
+        return {name: measure(lambda _: path(), None)[0] / rows for name, path in paths.items()}
+
+
+def over_budget(measured):
+    """:return: dict mapping path name to (peak bytes per row, budget) of the paths over their budget"""
+    budgets = get_memory_budgets()
+    return {name: (per_row, budgets[name]) for name, per_row in measured.items() if per_row > budgets[name]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connections
+    from django.test import Client
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+    budgets = get_memory_budgets()
+    failed = False
+
+    try:
+        for rows in args.rows:
+            measured = measure_paths(rows, Client())
+            exceeded = over_budget(measured)
+            failed = failed or bool(exceeded)
+
+            print(f"{rows} rows")
+            for name, per_row in measured.items():
+                print(f"{name:24} peak: {per_row:7.0f} B/row   budget: {budgets[name]:7} B/row"
+                      f"{'   OVER BUDGET' if name in exceeded else ''}")
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
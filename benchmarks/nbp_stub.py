@@ -0,0 +1,103 @@
+"""
+Local stand-in of the api.nbp.pl exchange rates endpoints, for load testing the service offline.
+Serves table A (/api/exchangerates/tables/a) and single rates (/api/exchangerates/rates/a/<code>)
+with injectable latency and error rate.
+
+    python -m benchmarks.nbp_stub --port 8001 --latency 0.05 --error-rate 0.01
+    NBP_API_URL=http://127.0.0.1:8001/api python manage.py runserver 8000
+"""
+import argparse
+import json
+import random
+import re
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+DEFAULT_RATES = {"EUR": 4.6642, "USD": 4.4455, "GBP": 5.3700, "CHF": 4.5512}
+
+TABLE_PATH = re.compile(r'^/api/exchangerates/tables/a/?$', re.IGNORECASE)
+RATE_PATH = re.compile(r'^/api/exchangerates/rates/a/(?P<code>[a-z]{3})/?$', re.IGNORECASE)
+
+
+class NBPStubHandler(BaseHTTPRequestHandler):
+    """Handler of the api.nbp.pl stand-in, configured through the attributes of its server."""
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self.send_json(503, {"error": "Injected error"})
+
+        path = urlsplit(self.path).path
+        effective_date = date.today().isoformat()
+
+        if TABLE_PATH.match(path):
+            return self.send_json(200, [{
+                "table": "A",
+                "no": "001/A/NBP/STUB",
+                "effectiveDate": effective_date,
+                "rates": [{"currency": code, "code": code, "mid": mid} for code, mid in server.rates.items()],
+            }])
+
+        match = RATE_PATH.match(path)
+        if match and match.group('code').upper() in server.rates:
+            code = match.group('code').upper()
+            return self.send_json(200, {
+                "table": "A",
+                "currency": code,
+                "code": code,
+                "rates": [{"no": "001/A/NBP/STUB", "effectiveDate": effective_date, "mid": server.rates[code]}],
+            })
+
+        self.send_json(404, {"error": "Not Found"})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8001, latency=0.0, error_rate=0.0, rates=None, seed=None, verbose=False):
+    """Create (not yet started) api.nbp.pl stand-in server, port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), NBPStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.rates = dict(DEFAULT_RATES if rates is None else rates)
+    server.random = random.Random(seed)
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help="Delay of every response in seconds.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument('--verbose', action='store_true', help="Log every request.")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.error_rate, verbose=args.verbose)
+    print(f"Serving api.nbp.pl stand-in at http://{args.host}:{server.server_port}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Synthetic report payloads used by the benchmarks.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+CURRENCIES = ("PLN", "EUR", "USD", "GBP")
+BANKS = ("mbank", "idea_bank", "pko", "ing")
+START_DATE = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def _common_fields(rnd):
+    created_at = START_DATE + timedelta(seconds=rnd.randrange(365 * 24 * 60 * 60))
+    offset = timezone(timedelta(hours=rnd.randrange(-11, 12)))
+    return {
+        "created_at": created_at.astimezone(offset).isoformat(),
+        "currency": rnd.choice(CURRENCIES),
+        "amount": rnd.randrange(1, 1000000),
+        "description": rnd.choice(("Car", "Restaurant", "Clothing store", "Toy Store", "Ice cream shop")),
+    }
+
+
+def pay_by_link(rnd):
+    return dict(_common_fields(rnd), bank=rnd.choice(BANKS))
+
+
+def direct_payment(rnd):
+    return dict(_common_fields(rnd), iban=f"PL{rnd.randrange(10 ** 25, 10 ** 26)}")
+
+
+def card(rnd):
+    return dict(_common_fields(rnd),
+                cardholder_name=rnd.choice(("Jan", "Anna", "Steven")),
+                cardholder_surname=rnd.choice(("Kowalski", "Nowak", "Gerrard")),
+                card_number=str(rnd.randrange(10 ** 15, 10 ** 16)))
+
+
+def make_payload(rows, seed=0):
+    """Build report payload with 'rows' payments spread evenly over all payment types."""
+    rnd = random.Random(seed)
+    return {
+        "pay_by_link": [pay_by_link(rnd) for _ in range(rows // 3)],
+        "dp": [direct_payment(rnd) for _ in range(rows // 3)],
+        "card": [card(rnd) for _ in range(rows - 2 * (rows // 3))],
+    }
+
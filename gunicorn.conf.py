@@ -0,0 +1,14 @@
+"""
+Gunicorn configuration of the PaymentReportAPI workers, e.g.:
+
+    gunicorn PaymentReportAPI.wsgi -c gunicorn.conf.py --workers 4
+"""
+
+
+def post_worker_init(worker):
+    """
+    Preload exchange rates into the shared rate store when a worker has loaded the application,
+    before it accepts requests, so that no user request has to wait for the first api.nbp.pl round trip.
+    """
+    from report_api.rates import warm_rates_on_startup
+    warm_rates_on_startup()
@@ -0,0 +1,269 @@
+"""
+Admission control for the report views.
+
+Each report request costs roughly proportionally to its number of payment rows. Before a request is processed
+it has to be admitted: its cost is estimated from the Content-Length (and corrected once the body is parsed),
+and the request is rejected if the client already has too many requests in flight (429),
+or queued for a while and then rejected if the total number of rows in flight exceeds the budget (503).
+
+The requests in flight are tracked in the InflightRequest table of a small database of its own, shared by all
+the worker processes (e.g. gunicorn sync workers, each handling a single request at a time), so the limits apply
+to the whole server. Tickets of workers killed while processing a request expire after
+settings.REPORT_ADMISSION_TICKET_TTL seconds. With settings.REPORT_ADMISSION_SHARED disabled the requests in flight
+are tracked in memory instead, which only limits the requests of a single (threaded) worker process.
+The limits are configured with the REPORT_ADMISSION_* settings.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from .exceptions import Overloaded
+from .models import InflightRequest
+from .routers import get_admission_database
+
+DEFAULT_MAX_CLIENT_REQUESTS = 4
+DEFAULT_MAX_INFLIGHT_ROWS = 200000
+DEFAULT_QUEUE_TIMEOUT = 5  # in seconds
+DEFAULT_BYTES_PER_ROW = 150
+DEFAULT_RETRY_AFTER = 5  # in seconds
+DEFAULT_TICKET_TTL = 10 * 60  # in seconds
+SHARED_QUEUE_POLL_INTERVAL = 0.05  # in seconds
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default):
+    return getattr(settings, f'REPORT_ADMISSION_{name}', default)
+
+
+def count_rows(data):
+    """Count payment rows in the parsed report request data."""
+    if not isinstance(data, dict):
+        return 1
+    return max(1, sum(len(rows) for rows in data.values() if isinstance(rows, list)))
+
+
+def estimate_rows(content_length):
+    """Estimate number of payment rows in the report request body of the given size."""
+    return max(1, content_length // get_setting('BYTES_PER_ROW', DEFAULT_BYTES_PER_ROW))
+
+
+def fits_budget(others, rows):
+    """
+    Check whether 'rows' more rows fit in the budget besides the 'others' rows in flight. A request larger than
+    the whole budget is admitted only if nothing else is in flight, so that it can be processed at all.
+    """
+    return others == 0 or others + rows <= get_setting('MAX_INFLIGHT_ROWS', DEFAULT_MAX_INFLIGHT_ROWS)
+
+
+class AdmissionTicket:
+    """Work admitted by the AdmissionController, has to be released when done."""
+    __slots__ = ('client', 'rows', 'released', 'id')
+
+    def __init__(self, client, rows, id=None):
+        self.client = client
+        self.rows = rows
+        self.released = False
+        self.id = id  # of the InflightRequest (SharedAdmissionController)
+
+
+class AdmissionController:
+    """
+    Keeps track of the requests in flight (per client) and of the total number of rows in flight
+    of a single worker process.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._client_requests = Counter()
+        self._inflight_rows = 0
+
+    @property
+    def inflight_rows(self):
+        return self._inflight_rows
+
+    def _fits(self, rows, already_admitted=0):
+        return fits_budget(self._inflight_rows - already_admitted, rows)
+
+    def _overloaded(self):
+        return Overloaded(wait=get_setting('RETRY_AFTER', DEFAULT_RETRY_AFTER))
+
+    def admit(self, client, rows):
+        """
+        Admit request of 'client' with 'rows' payment rows, waiting up to REPORT_ADMISSION_QUEUE_TIMEOUT seconds
+        for the rows budget to be freed.
+        :raise Throttled: if 'client' has too many requests in flight
+        :raise Overloaded: if the rows budget has not been freed in time
+        """
+        with self._condition:
+            if self._client_requests[client] >= get_setting('MAX_CLIENT_REQUESTS', DEFAULT_MAX_CLIENT_REQUESTS):
+                raise Throttled(wait=get_setting('RETRY_AFTER', DEFAULT_RETRY_AFTER))
+
+            deadline = time.monotonic() + get_setting('QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT)
+            while not self._fits(rows):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._overloaded()
+                self._condition.wait(remaining)
+
+            self._client_requests[client] += 1
+            self._inflight_rows += rows
+            return AdmissionTicket(client, rows)
+
+    def resize(self, ticket, rows):
+        """
+        Correct the number of rows of the admitted request (e.g. once its body is parsed).
+        :raise Overloaded: if the request no longer fits in the rows budget (the ticket is released then)
+        """
+        with self._condition:
+            if rows > ticket.rows and not self._fits(rows, already_admitted=ticket.rows):
+                self._release(ticket)
+                raise self._overloaded()
+
+            self._inflight_rows += rows - ticket.rows
+            ticket.rows = rows
+            self._condition.notify_all()
+
+    def release(self, ticket):
+        with self._condition:
+            self._release(ticket)
+
+    def _release(self, ticket):
+        if ticket.released:
+            return
+
+        ticket.released = True
+        self._inflight_rows -= ticket.rows
+        ticket.rows = 0
+        self._client_requests[ticket.client] -= 1
+        if self._client_requests[ticket.client] <= 0:
+            del self._client_requests[ticket.client]
+        self._condition.notify_all()
+
+
+class SharedAdmissionController(AdmissionController):
+    """
+    Keeps track of the requests in flight of all the worker processes, in the InflightRequest table
+    of the admission database (settings.REPORT_ADMISSION_DATABASE).
+    Queued requests poll the table with reads only. Once the request fits, it is admitted by a short transaction
+    that writes the request first (taking the database write lock, so the checks of the workers do not race,
+    and a SQLite read lock is never upgraded), and is rolled back if the request does not fit after all.
+    Requests are rejected with 503 if the admission database stays locked longer than its busy timeout.
+    """
+
+    @property
+    def inflight_rows(self):
+        return self._live_tickets().aggregate(rows=Sum('rows'))['rows'] or 0
+
+    @staticmethod
+    def _live_tickets():
+        return InflightRequest.objects.using(get_admission_database()).filter(expires_at__gt=timezone.now())
+
+    @classmethod
+    def _other_rows(cls, ticket_id):
+        return cls._live_tickets().exclude(id=ticket_id).aggregate(rows=Sum('rows'))['rows'] or 0
+
+    def _throttled(self):
+        return Throttled(wait=get_setting('RETRY_AFTER', DEFAULT_RETRY_AFTER))
+
+    def _may_fit(self, client, rows):
+        """
+        Check (with a read only) whether the request may be admitted now.
+        :raise Throttled: if 'client' has too many requests in flight
+        """
+        inflight = self._live_tickets().aggregate(rows=Sum('rows'),
+                                                  client_requests=Count('id', filter=Q(client=client)))
+        if inflight['client_requests'] >= get_setting('MAX_CLIENT_REQUESTS', DEFAULT_MAX_CLIENT_REQUESTS):
+            raise self._throttled()
+        return fits_budget(inflight['rows'] or 0, rows)
+
+    def _try_admit(self, client, rows):
+        """:return: the ticket, or None if the rows do not fit in the budget"""
+        if not self._may_fit(client, rows):
+            return None
+
+        database = get_admission_database()
+        inflight_requests = InflightRequest.objects.using(database)
+        expires_at = timezone.now() + timedelta(seconds=get_setting('TICKET_TTL', DEFAULT_TICKET_TTL))
+        with transaction.atomic(using=database):
+            inflight_requests.filter(expires_at__lte=timezone.now()).delete()
+            inflight = inflight_requests.create(client=client, rows=rows, expires_at=expires_at)
+
+            # requests of the other workers may have been admitted since the read
+            max_client_requests = get_setting('MAX_CLIENT_REQUESTS', DEFAULT_MAX_CLIENT_REQUESTS)
+            if self._live_tickets().filter(client=client).count() > max_client_requests:
+                raise self._throttled()
+
+            if not fits_budget(self._other_rows(inflight.id), rows):
+                transaction.set_rollback(True, using=database)
+                return None
+
+        return AdmissionTicket(client, rows, id=inflight.id)
+
+    def admit(self, client, rows):
+        deadline = time.monotonic() + get_setting('QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT)
+        while True:
+            try:
+                ticket = self._try_admit(client, rows)
+            except OperationalError:
+                # e.g. the admission database stayed locked for longer than its busy timeout
+                raise self._overloaded()
+            if ticket is not None:
+                return ticket
+
+            # released tickets of the other workers are noticed by polling
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._overloaded()
+            time.sleep(min(SHARED_QUEUE_POLL_INTERVAL, remaining))
+
+    def resize(self, ticket, rows):
+        if rows == ticket.rows:
+            return
+
+        database = get_admission_database()
+        try:
+            with transaction.atomic(using=database):
+                InflightRequest.objects.using(database).filter(id=ticket.id).update(rows=rows)
+                fits = rows <= ticket.rows or fits_budget(self._other_rows(ticket.id), rows)
+                if not fits:
+                    transaction.set_rollback(True, using=database)
+        except OperationalError:
+            fits = False
+
+        if not fits:
+            self.release(ticket)
+            raise self._overloaded()
+        ticket.rows = rows
+
+    def release(self, ticket):
+        if ticket.released:
+            return
+
+        ticket.released = True
+        try:
+            InflightRequest.objects.using(get_admission_database()).filter(id=ticket.id).delete()
+        except OperationalError:
+            logger.warning("Admitted request %s was not released, it expires in %d seconds",
+                           ticket.id, get_setting('TICKET_TTL', DEFAULT_TICKET_TTL))
+        ticket.rows = 0
+
+
+admission_controller = AdmissionController()
+
+shared_admission_controller = SharedAdmissionController()
+
+
+def get_admission_controller():
+    """Get the admission controller of the requests of all the workers, or of this worker process only."""
+    if getattr(settings, 'REPORT_ADMISSION_SHARED', True):
+        return shared_admission_controller
+    return admission_controller
@@ -0,0 +1,68 @@
+"""
+Analytics across the saved reports of all the customers.
+
+Rows of every saved report are also stored in the ReportPayment table (day, type, currency and amounts only)
+when the report is saved, so the totals are aggregated by the database (GROUP BY) instead of decoding
+the saved reports, using the index covering all the stored fields (in every shard, see report_api.routers).
+"""
+from django.db.models import Count, Sum
+
+from .models import ReportPayment
+from .records import PaymentRecord
+from .routers import get_shards, shard_for
+
+GROUP_BY_FIELDS = ('day', 'type', 'currency')
+INDEX_BATCH_SIZE = 1000  # in rows
+
+
+def index_report(customer_id, report):
+    """
+    Store rows of the report saved for the customer (replacing the rows of the previous one).
+    :param report: rows of the report, payment records (e.g. just generated) or their dicts (e.g. parsed from json)
+    """
+    payments = ReportPayment.objects.using(shard_for(customer_id))
+    payments.filter(report_id=customer_id).delete()
+    payments.bulk_create((ReportPayment(report_id=customer_id, **get_indexed_fields(row)) for row in report),
+                         batch_size=INDEX_BATCH_SIZE)
+
+
+def get_indexed_fields(row):
+    # dates of the report rows are in UTC, so their date (or the first 10 characters of the string) is the UTC day
+    if isinstance(row, PaymentRecord):
+        return dict(day=row.date.date(), type=row.type, currency=row.currency, amount=row.amount,
+                    amount_in_pln=row.amount_in_pln)
+    return dict(day=row['date'][:10], type=row['type'], currency=row['currency'], amount=row['amount'],
+                amount_in_pln=row['amount_in_pln'])
+
+
+def aggregate_payments(group_by, date_from=None, date_to=None):
+    """
+    Aggregate payments of all the saved reports.
+    :param group_by: sequence of GROUP_BY_FIELDS the payments are grouped by
+    :param date_from: first day (UTC) of the aggregated payments, or None
+    :param date_to: last day (UTC) of the aggregated payments, or None
+    :return: list of dicts with the group_by fields, number of payments ('payments') and their total amount
+             in PLN ('total_amount_in_pln'), ordered by the group_by fields
+    """
+    totals = {}
+
+    # payments are grouped in every shard, and the groups of the shards are merged
+    for shard in get_shards():
+        payments = ReportPayment.objects.using(shard)
+        if date_from is not None:
+            payments = payments.filter(day__gte=date_from)
+        if date_to is not None:
+            payments = payments.filter(day__lte=date_to)
+
+        groups = (payments.values(*group_by).annotate(payments=Count('*'), total_amount_in_pln=Sum('amount_in_pln'))
+                  if group_by else
+                  [payments.aggregate(payments=Count('*'), total_amount_in_pln=Sum('amount_in_pln'))])
+
+        for group in groups:
+            key = tuple(group[field] for field in group_by)
+            total = totals.setdefault(key, {**{field: group[field] for field in group_by},
+                                            'payments': 0, 'total_amount_in_pln': 0})
+            total['payments'] += group['payments']
+            total['total_amount_in_pln'] += group['total_amount_in_pln'] or 0
+
+    return [totals[key] for key in sorted(totals)]
@@ -0,0 +1,246 @@
+"""
+Content-addressed cache of rendered reports.
+
+Reports are keyed by a hash of the canonical json of the request data (and of the order of its payment types,
+which orders the rows of the same date), and of the rates of the currencies used in it, so identical submissions
+(retries, reconciliations) get the report rendered earlier instead of generating it again. The cache is
+an in-process LRU bounded by the total size of the cached reports (settings.REPORT_CACHE_MAX_SIZE bytes),
+and it is cleared whenever the rates in the rate store are refreshed.
+
+Saved reports are cached (read-through) by customer in the Django cache settings.SAVED_REPORT_CACHE
+(bounded by the MAX_ENTRIES of its backend, reports larger than settings.SAVED_REPORT_CACHE_MAX_ITEM_SIZE
+are not cached). Saving a report replaces it in the cache, and the cached reports are versioned, so a report
+read from the database is never served instead of a newer one (see SavedReportCache). The cache has to be
+shared by all the worker processes (e.g. the file based backend), otherwise a report saved by one worker is read
+from the cache of the other workers until it expires.
+Hit and miss counts of the worker are logged every settings.SAVED_REPORT_CACHE_STATS_INTERVAL lookups.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import receiver
+
+from .conversion import PLN
+from .models import Report
+from .rates import FOREIGN_CURRENCIES, get_stored_rates, rates_refreshed
+from .renderers import orjson
+from .routers import shard_for
+
+DEFAULT_MAX_SIZE = 64 * 2 ** 20  # in bytes
+DEFAULT_SAVED_REPORT_CACHE = 'default'
+DEFAULT_SAVED_REPORT_MAX_ITEM_SIZE = 2 ** 20  # in bytes
+DEFAULT_SAVED_REPORT_STATS_INTERVAL = 1000  # in lookups
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_json(data):
+    """Render data as json with sorted keys and without whitespace, so equal data always gives equal bytes."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def report_cache_key(data, rates, target_currency=PLN):
+    """
+    Get cache key of the report for the request data (converted also to the 'target_currency').
+    The key includes the rates of the foreign currencies used in the data, so it changes whenever
+    any of those rates changes. The rates are taken from the rate store without refreshing it
+    (and memoized in 'rates'), so computing the key never contacts the api.nbp.pl.
+    :return: cache key, or None if the report cannot be cached (e.g. the data is malformed,
+             or some of the rates are missing or outdated in the rate store)
+    """
+    try:
+        currencies = {payment.get('currency') for payments in data.values() for payment in payments}
+        digest = hashlib.sha256(canonical_json(data))
+    except (AttributeError, TypeError):
+        return None
+
+    #   rows of the same date are in the order of their payment types in the data, which the sorted keys lose
+    digest.update(f'|types={",".join(data)}'.encode())
+
+    currencies.add(target_currency)
+    currencies = sorted(currencies.intersection(FOREIGN_CURRENCIES))
+    missing = [currency for currency in currencies if currency not in rates]
+    if missing:
+        rates.update(get_stored_rates(missing))
+
+    for currency in currencies:
+        if currency not in rates:
+            return None
+        digest.update(f'|{currency}={rates[currency]!r}'.encode())
+
+    if target_currency != PLN:
+        digest.update(f'|target={target_currency}'.encode())
+
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """
+    Thread-safe LRU cache of rendered reports, bounded by the total size of the cached content.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'REPORT_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+
+    def set(self, key, content):
+        max_size = self.max_size
+        if len(content) > max_size:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+
+            self._entries[key] = content
+            self._size += len(content)
+
+            # evict the least recently used reports
+            while self._size > max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+report_cache = ReportCache()
+
+
+@receiver(rates_refreshed)
+def clear_report_cache(**kwargs):
+    """Cached reports were converted with the previous rates."""
+    report_cache.clear()
+
+
+class SavedReportCache:
+    """
+    Read-through cache of the saved reports (content and last access time) by customer,
+    counting its hits and misses (in this worker process).
+
+    Cached reports are versioned by their save time (Report.saved_at), and the version of the last saved report
+    of the customer is cached next to it. A cached report is only served if it is of that version, so a report
+    read from the database by a request racing with a save (the cache has no atomic operations shared by all
+    the workers) is never served instead of the saved one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'SAVED_REPORT_CACHE', DEFAULT_SAVED_REPORT_CACHE)]
+
+    @property
+    def max_item_size(self):
+        return getattr(settings, 'SAVED_REPORT_CACHE_MAX_ITEM_SIZE', DEFAULT_SAVED_REPORT_MAX_ITEM_SIZE)
+
+    @staticmethod
+    def make_key(customer_id):
+        return f'saved-report:{customer_id}'
+
+    @staticmethod
+    def make_version_key(customer_id):
+        return f'saved-report-version:{customer_id}'
+
+    def get(self, customer_id):
+        """:return: tuple (content, saved_at, last_accessed) or None"""
+        entry = self.cache.get(self.make_key(customer_id))
+        # the version is read after the report, so a report replaced in the meantime is not served
+        if entry is not None and self.cache.get(self.make_version_key(customer_id)) != entry[1]:
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            log_stats = (self.hits + self.misses) % getattr(settings, 'SAVED_REPORT_CACHE_STATS_INTERVAL',
+                                                            DEFAULT_SAVED_REPORT_STATS_INTERVAL) == 0
+        if log_stats:
+            self.log_stats()
+        return entry
+
+    def add(self, customer_id, content, saved_at, last_accessed):
+        """
+        Cache report read from the database, unless a newer report was saved (and cached) in the meantime.
+        The report can also be saved between checking and caching its version here, so the version saved
+        in the database is checked again afterwards, and the report is removed from the cache if it was replaced.
+        """
+        if len(content) > self.max_item_size:
+            return
+
+        version = self.cache.get(self.make_version_key(customer_id))
+        if version is not None and version > saved_at:
+            return
+
+        self.cache.set_many({self.make_version_key(customer_id): saved_at,
+                             self.make_key(customer_id): (content, saved_at, last_accessed)})
+
+        reports = Report.objects.using(shard_for(customer_id))
+        if not reports.filter(customer_id=customer_id, saved_at=saved_at).exists():
+            self.delete_many([customer_id])
+
+    def set(self, customer_id, content, saved_at, last_accessed):
+        """Cache just saved (and committed) report, replacing the cached one."""
+        self.cache.set(self.make_version_key(customer_id), saved_at)
+        if len(content) <= self.max_item_size:
+            self.cache.set(self.make_key(customer_id), (content, saved_at, last_accessed))
+        else:
+            self.cache.delete(self.make_key(customer_id))
+
+    def touch(self, customer_id, content, saved_at, last_accessed):
+        """Update last access time of the cached report (of the cached version, a newer one is not replaced)."""
+        self.cache.set(self.make_key(customer_id), (content, saved_at, last_accessed))
+
+    def delete_many(self, customer_ids):
+        self.cache.delete_many([key for customer_id in customer_ids
+                                for key in (self.make_key(customer_id), self.make_version_key(customer_id))])
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': self.hits / requests if requests else None}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info("Saved report cache of worker %d: %d hits, %d misses, hit ratio %.3f",
+                    os.getpid(), stats['hits'], stats['misses'], stats['hit_ratio'])
+
+    def clear(self):
+        self.cache.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+saved_report_cache = SavedReportCache()
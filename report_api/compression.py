@@ -0,0 +1,177 @@
+"""
+Compression of the report responses negotiated with the Accept-Encoding header (brotli if it is installed
+and accepted by the client, otherwise gzip).
+
+Responses smaller than settings.REPORT_COMPRESSION_MIN_SIZE bytes are sent as they are. Streamed reports
+are compressed incrementally, chunk by chunk as the rows are rendered (each compressed chunk is flushed,
+so the client receives the rows as soon as they are rendered); whether a streamed report reaches the threshold
+is decided by rendering its first chunks before the response is sent. The compression level (CPU for bytes)
+is configured with settings.REPORT_GZIP_LEVEL and settings.REPORT_BROTLI_QUALITY.
+"""
+import itertools
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # only gzip is offered
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+DEFAULT_MIN_SIZE = 16 * 1024  # in bytes
+DEFAULT_GZIP_LEVEL = 6  # 1 (fastest) - 9 (smallest)
+DEFAULT_BROTLI_QUALITY = 4  # 0 (fastest) - 11 (smallest)
+
+
+def get_min_size():
+    return getattr(settings, 'REPORT_COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)
+
+
+def supported_encodings():
+    """:return: supported content codings, in the order of preference"""
+    return (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Get the preferred supported content coding acceptable by the client.
+    :param accept_encoding: value of the Accept-Encoding request header
+    :return: 'br', 'gzip', or None if the response should not be compressed
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    wildcard = qualities.get('*', 0.0)
+    best_quality, best_encoding = 0.0, None
+    for encoding in supported_encodings():  # ties go to the preferred one
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best_quality, best_encoding = quality, encoding
+    return best_encoding
+
+
+class Compressor:
+    """
+    Incremental compressor of the given content coding.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == BROTLI:
+            self._compressor = brotli.Compressor(quality=getattr(settings, 'REPORT_BROTLI_QUALITY',
+                                                                 DEFAULT_BROTLI_QUALITY))
+        else:
+            # wbits 16 + 15 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(getattr(settings, 'REPORT_GZIP_LEVEL', DEFAULT_GZIP_LEVEL),
+                                                zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """Compress next chunk of the content, flushed so that it can be decompressed by the client at once."""
+        if self.encoding == BROTLI:
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == BROTLI:
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+    def compress_all(self, data):
+        """Compress the whole content at once."""
+        if self.encoding == BROTLI:
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def compress_chunks(chunks, encoding):
+    """Compress content chunks incrementally. :return: iterator of the compressed chunks"""
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        if chunk:
+            yield compressor.compress(chunk)
+    yield compressor.finish()
+
+
+def peek_chunks(chunks, min_size):
+    """
+    Take (render) chunks until they reach 'min_size' bytes.
+    :return: tuple (iterator of all the chunks, whether the content is at least 'min_size' bytes)
+    """
+    chunks = iter(chunks)
+    taken = []
+    size = 0
+
+    for chunk in chunks:
+        taken.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            return itertools.chain(taken, chunks), True
+
+    return iter(taken), False
+
+
+def set_content_encoding(response, encoding):
+    response['Content-Encoding'] = encoding
+    if response.has_header('Content-Length'):
+        del response['Content-Length']
+
+    # the strong ETag (if any) is of the uncompressed content
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+def compress_streaming_response(response, encoding):
+    """Compress the streamed content of the response if it reaches the threshold."""
+    chunks, large = peek_chunks(response.streaming_content, get_min_size())
+    if large:
+        set_content_encoding(response, encoding)
+        chunks = compress_chunks(chunks, encoding)
+    response.streaming_content = chunks
+    return response
+
+
+def compress_content(response, encoding):
+    """Compress the rendered content of the response if it reaches the threshold."""
+    if len(response.content) >= get_min_size():
+        response.content = Compressor(encoding).compress_all(response.content)
+        set_content_encoding(response, encoding)
+    return response
+
+
+def compress_response(request, response):
+    """
+    Compress the report response (rendered or streamed) with the content coding negotiated with the request.
+    Rendered responses that are not rendered yet (e.g. DRF responses) are compressed once they are rendered.
+    :return: the response
+    """
+    if response.has_header('Content-Encoding') or not 200 <= response.status_code < 300:
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding is None:
+        return response
+
+    if response.streaming:
+        return compress_streaming_response(response, encoding)
+
+    if getattr(response, 'is_rendered', True):
+        return compress_content(response, encoding)
+
+    response.add_post_render_callback(lambda rendered: compress_content(rendered, encoding))
+    return response
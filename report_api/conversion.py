@@ -0,0 +1,41 @@
+"""
+Integer-exact currency conversion.
+
+The api.nbp.pl table A gives mid PLN rates of all the foreign currencies, so the rate between any two of them
+is the cross rate of their PLN rates from the same table (no extra api.nbp.pl request per currency pair).
+Rates are used as the exact decimals published by the api.nbp.pl (e.g. 4.4455), and every conversion
+is computed in integers, with the result truncated towards zero (the same way as the PLN amounts were always
+rounded), so the converted amounts do not depend on the floating point errors.
+"""
+from fractions import Fraction
+
+PLN = 'PLN'
+
+
+def exact_rate(rate):
+    """Get PLN rate (float, as stored in the rate store) as the exact decimal published by the api.nbp.pl."""
+    return Fraction(repr(rate))
+
+
+def conversion_ratio(currency, target_currency, rates):
+    """
+    Get the exact ratio converting amounts in 'currency' to 'target_currency'.
+    :param rates: dict of the PLN rates (currency code -> PLN rate) of both currencies
+    :return: tuple (numerator, denominator)
+    """
+    if currency == target_currency:
+        return 1, 1
+
+    ratio = Fraction(1)
+    if currency != PLN:
+        ratio *= exact_rate(rates[currency])
+    if target_currency != PLN:
+        ratio /= exact_rate(rates[target_currency])
+    return ratio.numerator, ratio.denominator
+
+
+def convert_amount(amount, ratio):
+    """Convert integer amount with the ratio (see conversion_ratio), truncating the result towards zero."""
+    numerator, denominator = ratio
+    converted = abs(amount) * numerator // denominator
+    return converted if amount >= 0 else -converted
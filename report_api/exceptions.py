@@ -0,0 +1,23 @@
+from rest_framework.exceptions import APIException
+from rest_framework import status
+
+
+class UnsupportedPaymentType(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Unsupported type of payment"
+    default_code = 'unsupported_payment_type'
+
+
+class ServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Service temporarily unavailable, try again later."
+    default_code = 'service_unavailable'
+
+
+class Overloaded(ServiceUnavailable):
+    default_detail = "Server is overloaded, try again later."
+    default_code = 'overloaded'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        self.wait = wait  # sent to the client in the 'Retry-After' header
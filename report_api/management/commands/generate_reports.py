@@ -0,0 +1,204 @@
+import json
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from rest_framework.exceptions import APIException
+
+from report_api.analytics import index_report
+from report_api.cache import saved_report_cache
+from report_api.exceptions import ServiceUnavailable
+from report_api.models import Report
+from report_api.parsers import parse_json
+from report_api.rates import get_rates
+from report_api.renderers import render_json
+from report_api.routers import shard_for
+from report_api.storage import encode_report
+from report_api.views import generate_report
+
+# rates prefetched once by the parent process and inherited by every worker
+_worker_rates = None
+# whether the workers encode the reports of the records with 'customer_id' in the storage format
+_worker_encodes = False
+
+
+def init_worker(rates, encode=False):
+    global _worker_rates, _worker_encodes
+    _worker_rates = rates
+    _worker_encodes = encode
+
+
+def parse_record(line):
+    """
+    Parse single input line into (customer_id, payments) tuple.
+    A line is either a bare report payload, or an object with 'payments' and optional 'customer_id' keys.
+    :raise ValueError: for invalid json or customer_id
+    """
+    record = json.loads(line)
+    if 'payments' not in record:
+        return None, record
+
+    customer_id = record.get('customer_id')
+    if customer_id is not None and (type(customer_id) is not int or customer_id < 0):
+        raise ValueError(f"customer_id has to be a non-negative integer, not {customer_id!r}")
+    return customer_id, record['payments']
+
+
+def process_chunk(chunk):
+    """
+    Generate reports for a chunk of input lines.
+    :param chunk: list of (line_number, line) tuples
+    :return: list of (line_number, customer_id, row_count, rendered_report, stored_report, errors) tuples,
+             where exactly one of 'rendered_report' and 'errors' is set, and 'stored_report' is the report encoded
+             in the storage format (only of the records with 'customer_id', if the worker encodes the reports)
+    """
+    results = []
+
+    for line_number, line in chunk:
+        customer_id = None
+        row_count = 0
+        try:
+            customer_id, payments = parse_record(line)
+            row_count = sum(len(rows) for rows in payments.values())
+            report = generate_report(payments, rates=dict(_worker_rates or {}))
+            stored_report = encode_report(report) if _worker_encodes and customer_id is not None else None
+            results.append((line_number, customer_id, row_count, render_json(report), stored_report, None))
+        except APIException as e:
+            # errors are reported in the same shape as by the views
+            errors = e.detail if isinstance(e.detail, (list, dict)) else {'detail': e.detail}
+            results.append((line_number, customer_id, row_count, None, None, errors))
+        except (ValueError, AttributeError, TypeError) as e:
+            results.append((line_number, customer_id, row_count, None, None,
+                            {'detail': f"Malformed input record: {e}"}))
+
+    return results
+
+
+def read_chunks(input_file, chunk_size):
+    """Lazily read non-empty input lines in chunks of (line_number, line) tuples."""
+    lines = ((line_number, line) for line_number, line in enumerate(input_file, start=1) if line.strip())
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_chunks(chunks, workers, rates, encode=False):
+    """
+    Process chunks in a pool of 'workers' processes (or inline if 'workers' is 1), yielding results in input order.
+    At most 2 * workers chunks are in flight at once, so the input is streamed instead of being read upfront.
+    :param encode: whether the reports to be saved are encoded in the storage format (by the workers)
+    """
+    if workers == 1:
+        init_worker(rates, encode)
+        yield from map(process_chunk, chunks)
+        return
+
+    # forked workers must not share the database connections of the parent process
+    connections.close_all()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(rates, encode)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(process_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def render_output_line(line_number, customer_id, rendered_report, errors):
+    head = json.dumps({"line": line_number, "customer_id": customer_id})[:-1].encode()
+    if rendered_report is not None:
+        return head + b', "report": ' + rendered_report + b'}\n'
+    return head + b', "errors": ' + render_json(errors) + b'}\n'
+
+
+def save_reports(reports):
+    """
+    Save (overwrite) reports for many customers at once, in a transaction per report shard.
+    :param reports: dict customer_id -> (rendered report, report encoded in the storage format)
+    """
+    shard_reports = defaultdict(dict)
+    for customer_id, report in reports.items():
+        shard_reports[shard_for(customer_id)][customer_id] = report
+
+    for shard, reports_of_shard in shard_reports.items():
+        with transaction.atomic(using=shard):
+            Report.objects.using(shard).filter(customer_id__in=reports_of_shard.keys()).delete()
+            Report.objects.using(shard).bulk_create(Report(customer_id=customer_id, content=content, size=len(content))
+                                                    for customer_id, (_, content) in reports_of_shard.items())
+            # the records stay in the workers, and parsing the json is cheaper than decoding the stored report
+            for customer_id, (rendered_report, _) in reports_of_shard.items():
+                index_report(customer_id, parse_json(rendered_report))
+    saved_report_cache.delete_many(reports.keys())
+
+
+class Command(BaseCommand):
+    help = ("Generate payment reports for every record of a JSONL file, without going through HTTP. "
+            "Each line is either a report payload, or an object with 'payments' and optional 'customer_id' keys.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Path to the JSONL file with report payloads ('-' for stdin).")
+        parser.add_argument('--output', help="Path to the NDJSON file the generated reports are written to.")
+        parser.add_argument('--save', action='store_true',
+                            help="Save generated reports of records with 'customer_id' in the database.")
+        parser.add_argument('--workers', type=int, default=1, help="Number of worker processes.")
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help="Number of records sent to a worker at once.")
+
+    def handle(self, *args, **options):
+        if not options['output'] and not options['save']:
+            raise CommandError("Nothing to do, use --output and/or --save.")
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("--workers and --chunk-size have to be positive.")
+
+        # fetch the rates once, all the workers share this prefetch
+        try:
+            rates = get_rates()
+        except ServiceUnavailable as e:
+            raise CommandError(str(e.detail))
+
+        input_file = sys.stdin if options['input'] == '-' else open(options['input'])
+        output_file = open(options['output'], 'wb') if options['output'] else None
+
+        record_count = row_count = error_count = 0
+        start = time.monotonic()
+
+        try:
+            chunks = read_chunks(input_file, options['chunk_size'])
+            for results in map_chunks(chunks, options['workers'], rates, encode=options['save']):
+                reports_to_save = {}
+
+                for line_number, customer_id, rows, rendered_report, stored_report, errors in results:
+                    record_count += 1
+                    row_count += rows
+                    if errors is not None:
+                        error_count += 1
+                    elif stored_report is not None:
+                        reports_to_save[customer_id] = (rendered_report, stored_report)
+
+                    if output_file is not None:
+                        output_file.write(render_output_line(line_number, customer_id, rendered_report, errors))
+
+                if options['save'] and reports_to_save:
+                    save_reports(reports_to_save)
+
+                elapsed = time.monotonic() - start
+                self.stderr.write(f"Processed {record_count} records ({row_count} payments), "
+                                  f"{record_count / elapsed:.1f} records/s, {row_count / elapsed:.1f} payments/s")
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not None:
+                output_file.close()
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {record_count - error_count} reports ({error_count} failed) "
+            f"from {row_count} payments in {elapsed:.2f}s."))
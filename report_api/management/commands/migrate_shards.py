@@ -0,0 +1,14 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ("Apply migrations to every configured database: the default one, all the report shards "
+            "and the admission database.")
+
+    def handle(self, *args, **options):
+        for alias in connections:
+            self.stdout.write(f"Migrating '{alias}':")
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'],
+                         stdout=self.stdout, stderr=self.stderr)
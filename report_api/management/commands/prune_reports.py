@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from report_api.retention import DEFAULT_PRUNE_BATCH_SIZE, compact_storage, prune_by_age, prune_to_budget
+from report_api.routers import get_shards
+from report_api.uploads import prune_upload_sessions
+
+
+class Command(BaseCommand):
+    help = ("Delete saved reports that were not accessed for too long, and the least recently accessed ones "
+            "while the saved reports exceed the storage budget, and abandoned upload sessions, "
+            "then compact the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=float,
+                            default=getattr(settings, 'REPORT_RETENTION_MAX_AGE_DAYS', None),
+                            help="Delete reports not accessed for this many days.")
+        parser.add_argument('--max-size', type=int,
+                            default=getattr(settings, 'REPORT_STORAGE_BUDGET', None),
+                            help="Total size of the saved reports (in bytes) to prune down to.")
+        parser.add_argument('--session-max-age', type=float,
+                            default=getattr(settings, 'UPLOAD_SESSION_MAX_AGE_DAYS', None),
+                            help="Delete upload sessions opened this many days ago.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_PRUNE_BATCH_SIZE,
+                            help="Number of reports deleted in a single transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted.")
+        parser.add_argument('--no-vacuum', action='store_true', help="Do not compact the database.")
+
+    def handle(self, *args, **options):
+        max_age, max_size, batch_size = options['max_age'], options['max_size'], options['batch_size']
+        session_max_age = options['session_max_age']
+        if max_age is None and max_size is None and session_max_age is None:
+            raise CommandError("Nothing to do, use --max-age, --max-size and/or --session-max-age (or "
+                               "REPORT_RETENTION_MAX_AGE_DAYS/REPORT_STORAGE_BUDGET/UPLOAD_SESSION_MAX_AGE_DAYS "
+                               "settings).")
+        if batch_size < 1 or (max_age is not None and max_age < 0) or (max_size is not None and max_size < 0):
+            raise CommandError("--max-age, --max-size and --batch-size cannot be negative (or zero batch size).")
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+
+        if max_age is not None:
+            count, size = prune_by_age(timedelta(days=max_age), batch_size, options['dry_run'])
+            self.stdout.write(f"{verb} {count} reports ({size} bytes) not accessed for {max_age:g} days.")
+
+        if max_size is not None:
+            count, size = prune_to_budget(max_size, batch_size, options['dry_run'])
+            self.stdout.write(f"{verb} {count} reports ({size} bytes) over the storage budget of {max_size} bytes.")
+
+        if session_max_age is not None and not options['dry_run']:
+            count = prune_upload_sessions(timedelta(days=session_max_age))
+            self.stdout.write(f"Deleted {count} upload sessions opened {session_max_age:g} days ago.")
+
+        if not options['dry_run'] and not options['no_vacuum']:
+            for shard in get_shards():
+                freed_pages = compact_storage(shard)
+                if freed_pages is not None:
+                    self.stdout.write(f"Freed {freed_pages} database pages of '{shard}'.")
+
+        self.stdout.write(self.style.SUCCESS("Saved reports pruned."))
@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from report_api.models import Report, ReportPayment, UploadChunk, UploadSession
+from report_api.routers import shard_for
+
+
+def report_databases():
+    """Get aliases of the databases holding saved reports (the shards, and e.g. the retired shards)."""
+    return [alias for alias in connections
+            if Report._meta.db_table in connections[alias].introspection.table_names()]
+
+
+def copy_rows(queryset, target, keep_pk=True):
+    rows = list(queryset)
+    if not keep_pk:
+        for row in rows:
+            row.pk = None
+    queryset.model.objects.using(target).bulk_create(rows)
+    return rows
+
+
+def move_customers(source, target, customer_ids):
+    """
+    Move the reports (with their rows) and the upload sessions (with their chunks) of the customers
+    from the 'source' to the 'target' database. The target is committed first, so if the move is interrupted,
+    the customers are left in both databases and are moved again by the next run.
+    Customers which already have a report in the target (saved after the shards were changed) keep that newer one.
+    :return: number of moved reports
+    """
+    with transaction.atomic(using=source):
+        with transaction.atomic(using=target):
+            saved_in_target = set(Report.objects.using(target).filter(customer_id__in=customer_ids)
+                                  .values_list('customer_id', flat=True))
+            moved_ids = [customer_id for customer_id in customer_ids if customer_id not in saved_in_target]
+
+            reports = copy_rows(Report.objects.using(source).filter(customer_id__in=moved_ids), target)
+            copy_rows(ReportPayment.objects.using(source).filter(report_id__in=moved_ids), target, keep_pk=False)
+
+            sessions_in_target = set(UploadSession.objects.using(target).filter(customer_id__in=customer_ids)
+                                     .values_list('id', flat=True))
+            sessions = UploadSession.objects.using(source).filter(customer_id__in=customer_ids) \
+                .exclude(id__in=sessions_in_target)
+            copy_rows(sessions, target)
+            copy_rows(UploadChunk.objects.using(source).filter(session__in=sessions), target, keep_pk=False)
+
+        Report.objects.using(source).filter(customer_id__in=customer_ids).delete()
+        UploadSession.objects.using(source).filter(customer_id__in=customer_ids).delete()
+
+    return len(reports)
+
+
+class Command(BaseCommand):
+    help = ("Move saved reports (and upload sessions) to the shards of their customers, "
+            "after the report shards (REPORT_SHARD_COUNT) were changed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Number of customers moved in a single transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many customers would be moved.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size has to be positive.")
+
+        databases = report_databases()
+        moved_count = 0
+
+        for source in databases:
+            customer_ids = set(Report.objects.using(source).values_list('customer_id', flat=True))
+            customer_ids.update(UploadSession.objects.using(source).values_list('customer_id', flat=True))
+
+            moves = defaultdict(list)
+            for customer_id in sorted(customer_ids):
+                target = shard_for(customer_id)
+                if target != source:
+                    moves[target].append(customer_id)
+
+            for target, target_ids in moves.items():
+                if target not in databases:
+                    raise CommandError(f"Shard '{target}' is not migrated, run 'manage.py migrate_shards' first.")
+
+                if options['dry_run']:
+                    self.stdout.write(f"Would move {len(target_ids)} customers from '{source}' to '{target}'.")
+                    continue
+
+                reports_count = 0
+                for start in range(0, len(target_ids), batch_size):
+                    reports_count += move_customers(source, target, target_ids[start:start + batch_size])
+                moved_count += reports_count
+                self.stdout.write(f"Moved {reports_count} reports of {len(target_ids)} customers "
+                                  f"from '{source}' to '{target}'.")
+
+        self.stdout.write(self.style.SUCCESS(f"Resharding done, {moved_count} reports moved."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from report_api.exceptions import ServiceUnavailable
+from report_api.rates import warm_rates
+
+
+class Command(BaseCommand):
+    help = "Preload exchange rates from the api.nbp.pl into the shared rate store."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Fetch the rates even if the stored ones are still up to date.")
+
+    def handle(self, *args, **options):
+        try:
+            fetched_count = warm_rates(force=options['force'])
+        except ServiceUnavailable as e:
+            raise CommandError(str(e.detail))
+
+        if fetched_count:
+            self.stdout.write(self.style.SUCCESS(f"Stored {fetched_count} exchange rates."))
+        else:
+            self.stdout.write("Exchange rates are already up to date.")
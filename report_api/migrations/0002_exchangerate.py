@@ -0,0 +1,22 @@
+# Generated by Django 3.2.5 on 2026-10-19 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('currency', models.CharField(max_length=3, primary_key=True, serialize=False)),
+                ('mid', models.FloatField()),
+                ('effective_date', models.DateField(null=True)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.5 on 2026-10-19 01:55
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+import django.utils.timezone
+
+
+def set_report_sizes(apps, schema_editor):
+    Report = apps.get_model('report_api', 'Report')
+    Report.objects.using(schema_editor.connection.alias).update(size=Length('content'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report_api', '0002_exchangerate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='last_accessed',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='saved_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_report_sizes, migrations.RunPython.noop, hints={'model_name': 'report'}),
+    ]
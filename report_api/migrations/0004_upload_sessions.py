@@ -0,0 +1,40 @@
+# Generated by Django 3.2.5 on 2026-10-19 01:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report_api', '0003_report_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('customer_id', models.PositiveBigIntegerField()),
+                ('target_currency', models.CharField(default='PLN', max_length=3)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('digest', models.CharField(max_length=64)),
+                ('row_count', models.PositiveIntegerField()),
+                ('content', models.BinaryField()),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks',
+                                              to='report_api.uploadsession')),
+            ],
+            options={
+                'unique_together': {('session', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.5 on 2026-10-19 02:00
+
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_saved_reports(apps, schema_editor):
+    reports = apps.get_model('report_api', 'Report').objects.using(schema_editor.connection.alias)
+    ReportPayment = apps.get_model('report_api', 'ReportPayment')
+
+    for customer_id in list(reports.values_list('customer_id', flat=True)):
+        content = reports.filter(customer_id=customer_id).values_list('content', flat=True).get()
+        ReportPayment.objects.using(schema_editor.connection.alias).bulk_create(
+            (ReportPayment(report_id=customer_id, day=row['date'][:10], type=row['type'], currency=row['currency'],
+                           amount=row['amount'], amount_in_pln=row['amount_in_pln'])
+             for row in json.loads(bytes(content))),
+            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report_api', '0004_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('type', models.CharField(max_length=20)),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.BigIntegerField()),
+                ('amount_in_pln', models.BigIntegerField()),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments',
+                                             to='report_api.report')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='reportpayment',
+            index=models.Index(fields=['day', 'type', 'currency', 'amount', 'amount_in_pln'],
+                               name='report_payment_analytics'),
+        ),
+        migrations.RunPython(index_saved_reports, migrations.RunPython.noop, hints={'model_name': 'reportpayment'}),
+    ]
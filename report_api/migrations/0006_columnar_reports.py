@@ -0,0 +1,186 @@
+# Generated by Django 3.2.5 on 2026-10-19 03:00
+
+import json
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from django.db import migrations, transaction
+from django.utils.dateparse import parse_datetime
+
+BATCH_SIZE = 100  # in reports
+
+# Frozen copy of the version 1 of the storage format (report_api.storage at the time of this migration),
+# so this migration always writes and reads the same format, whatever the later versions of report_api.storage are.
+
+MAGIC = b'PRC\x01'
+
+FLAG_CONVERTED = 1
+FLAG_SORTED = 2
+
+FIELDS = ('date', 'type', 'payment_mean', 'description', 'amount', 'currency', 'amount_in_pln')
+CONVERTED_FIELDS = FIELDS + ('target_currency', 'amount_in_target_currency')
+
+STRING, TIMESTAMP, INTEGER = 'string', 'timestamp', 'integer'
+COLUMN_TYPES = {'date': TIMESTAMP, 'type': STRING, 'payment_mean': STRING, 'description': STRING,
+                'amount': INTEGER, 'currency': STRING, 'amount_in_pln': INTEGER,
+                'target_currency': STRING, 'amount_in_target_currency': INTEGER}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def is_columnar(content):
+    return bytes(content[:len(MAGIC)]) == MAGIC
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_varints(data, pos, stop, signed=False):
+    values = []
+    while pos < stop:
+        value, pos = read_varint(data, pos)
+        values.append((value >> 1) ^ -(value & 1) if signed else value)
+    return values
+
+
+def encode_column(column_type, values):
+    out = bytearray()
+    if column_type == STRING:
+        indexes = {}
+        row_indexes = [indexes.setdefault(value, len(indexes)) for value in values]
+        write_varint(out, len(indexes))
+        for value in indexes:
+            encoded = value.encode()
+            write_varint(out, len(encoded))
+            out += encoded
+        for index in row_indexes:
+            write_varint(out, index)
+    elif column_type == TIMESTAMP:
+        previous = 0
+        for timestamp in values:
+            write_varint(out, zigzag(timestamp - previous))
+            previous = timestamp
+    else:
+        for value in values:
+            write_varint(out, zigzag(value))
+    return out
+
+
+def decode_column(column_type, data, start, stop):
+    if column_type == STRING:
+        size, pos = read_varint(data, start)
+        dictionary = []
+        for _ in range(size):
+            length, pos = read_varint(data, pos)
+            dictionary.append(str(data[pos:pos + length], 'utf-8'))
+            pos += length
+        return [dictionary[index] for index in read_varints(data, pos, stop)]
+    if column_type == TIMESTAMP:
+        return [EPOCH + timestamp * MICROSECOND for timestamp in accumulate(read_varints(data, start, stop, True))]
+    return read_varints(data, start, stop, signed=True)
+
+
+def encode_rows(rows):
+    """Encode rows of the report json (dicts with the dates as strings)."""
+    converted = bool(rows) and 'target_currency' in rows[0]
+    fields = CONVERTED_FIELDS if converted else FIELDS
+
+    timestamps = [(parse_datetime(row['date']) - EPOCH) // MICROSECOND for row in rows]
+    is_sorted = all(previous <= timestamp for previous, timestamp in zip(timestamps, timestamps[1:]))
+
+    out = bytearray(MAGIC)
+    write_varint(out, (FLAG_CONVERTED if converted else 0) | (FLAG_SORTED if is_sorted else 0))
+    write_varint(out, len(rows))
+    for name in fields:
+        values = timestamps if name == 'date' else [row[name] for row in rows]
+        column = encode_column(COLUMN_TYPES[name], values)
+        write_varint(out, len(column))
+        out += column
+    return bytes(out)
+
+
+def decode_rows(content):
+    """Decode rows of the report, with the dates as datetime objects."""
+    data = memoryview(content)
+    flags, pos = read_varint(data, len(MAGIC))
+    _, pos = read_varint(data, pos)
+    fields = CONVERTED_FIELDS if flags & FLAG_CONVERTED else FIELDS
+
+    columns = []
+    for name in fields:
+        length, pos = read_varint(data, pos)
+        columns.append(decode_column(COLUMN_TYPES[name], data, pos, pos + length))
+        pos += length
+    return [dict(zip(fields, row)) for row in zip(*columns)]
+
+
+def format_datetime(value):
+    """Format datetime the same way as the JSONRenderer does."""
+    representation = value.isoformat()
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+def render_rows(rows):
+    """Render rows as the (compact) json of the report."""
+    for row in rows:
+        row['date'] = format_datetime(row['date'])
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def convert_reports(apps, schema_editor, convert):
+    """Convert content of the saved reports with 'convert', in batched transactions."""
+    alias = schema_editor.connection.alias
+    reports = apps.get_model('report_api', 'Report').objects.using(alias)
+
+    customer_ids = list(reports.order_by('customer_id').values_list('customer_id', flat=True))
+    for start in range(0, len(customer_ids), BATCH_SIZE):
+        with transaction.atomic(using=alias):
+            for report in reports.filter(customer_id__in=customer_ids[start:start + BATCH_SIZE]):
+                content = convert(bytes(report.content))
+                if content is not None:
+                    reports.filter(customer_id=report.customer_id).update(content=content, size=len(content))
+
+
+def json_to_columnar(apps, schema_editor):
+    convert_reports(apps, schema_editor,
+                    lambda content: None if is_columnar(content) else encode_rows(json.loads(content)))
+
+
+def columnar_to_json(apps, schema_editor):
+    convert_reports(apps, schema_editor,
+                    lambda content: render_rows(decode_rows(content)) if is_columnar(content) else None)
+
+
+class Migration(migrations.Migration):
+    # reports are converted in their own transactions (converting them again skips the converted ones)
+    atomic = False
+
+    dependencies = [
+        ('report_api', '0005_report_payments'),
+    ]
+
+    operations = [
+        migrations.RunPython(json_to_columnar, columnar_to_json, hints={'model_name': 'report'}),
+    ]
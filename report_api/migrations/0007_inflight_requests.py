@@ -0,0 +1,22 @@
+# Generated by Django 3.2.5 on 2026-10-19 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('report_api', '0006_columnar_reports'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InflightRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client', models.CharField(db_index=True, max_length=100)),
+                ('rows', models.PositiveBigIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
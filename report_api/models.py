@@ -1,10 +1,91 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 
 class Report(models.Model):
     """
-    Model for storing report jsons in the database.
+    Model for storing reports in the database (in the columnar storage format, see report_api.storage).
     Reports are identified by the customer_id.
+    Save and (approximate) last access times and the content size are tracked for the retention policy
+    (see report_api.retention).
     """
     customer_id = models.PositiveBigIntegerField(primary_key=True)
     content = models.BinaryField()
+    size = models.PositiveIntegerField(default=0)
+    saved_at = models.DateTimeField(default=timezone.now)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.size = len(self.content)
+        super().save(*args, **kwargs)
+
+
+class ExchangeRate(models.Model):
+    """
+    Model for storing PLN exchange rates fetched from the api.nbp.pl.
+    The table is shared by all worker processes, so a rate has to be fetched only once
+    per refresh period regardless of how many workers are running.
+    """
+    currency = models.CharField(max_length=3, primary_key=True)
+    mid = models.FloatField()
+    effective_date = models.DateField(null=True)
+    fetched_at = models.DateTimeField()
+
+
+class UploadSession(models.Model):
+    """
+    Model for the sessions of reports uploaded in many chunks (see report_api.uploads).
+    The report is saved for the customer once the session is committed.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    customer_id = models.PositiveBigIntegerField()
+    target_currency = models.CharField(max_length=3, default='PLN')
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class UploadChunk(models.Model):
+    """
+    Model for storing validated and converted chunks of the uploaded reports, as json of the chunk's rows
+    sorted by date.
+    Chunks are identified by their number within the session, and by the digest of their received content,
+    so a retried chunk is recognized.
+    """
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    number = models.PositiveIntegerField()
+    digest = models.CharField(max_length=64)
+    row_count = models.PositiveIntegerField()
+    content = models.BinaryField()
+
+    class Meta:
+        unique_together = ('session', 'number')
+
+
+class ReportPayment(models.Model):
+    """
+    Model for the rows of the saved reports, stored (at save time) for the analytics across the customers.
+    Only the aggregated fields are stored, and they are covered by a single index, so the aggregations over
+    a range of days are computed from the index alone.
+    """
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, related_name='payments')
+    day = models.DateField()
+    type = models.CharField(max_length=20)
+    currency = models.CharField(max_length=3)
+    amount = models.BigIntegerField()
+    amount_in_pln = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['day', 'type', 'currency', 'amount', 'amount_in_pln'],
+                                name='report_payment_analytics')]
+
+
+class InflightRequest(models.Model):
+    """
+    Model for the report requests in flight, admitted by the admission control (see report_api.admission).
+    The table is shared by all worker processes, so the limits apply to the requests of all of them.
+    Requests of the workers killed while processing them expire at 'expires_at'.
+    """
+    client = models.CharField(max_length=100, db_index=True)
+    rows = models.PositiveBigIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
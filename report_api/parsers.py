@@ -0,0 +1,58 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json based parsing of the JSONParser
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack requests are not accepted
+    msgpack = None
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser backed by the orjson (if it is installed).
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            content = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                content = content.decode(encoding)
+            return orjson.loads(content)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack request data (requires the msgpack).
+    Timestamps (the MessagePack timestamp extension type) are decoded directly into the UTC datetime objects,
+    which are validated as they are (without parsing the date strings).
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), timestamp=3)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+def parse_json(content):
+    """Parse json bytes (e.g. report saved in the database)."""
+    if orjson is None:
+        return json.loads(content)
+    return orjson.loads(content)
@@ -0,0 +1,236 @@
+"""
+Exchange rates provider.
+
+Rates are fetched from the api.nbp.pl (table A, at settings.NBP_API_URL) and persisted in the ExchangeRate
+table, which is shared by all worker processes. A rate is fetched again only after it gets older
+than settings.NBP_RATES_MAX_AGE seconds.
+
+Outdated rates are served stale (up to settings.NBP_RATES_MAX_STALENESS seconds old) while the rate store
+is refreshed in the background. Concurrent refreshes in a worker process are coalesced into a single
+api.nbp.pl request, whose result all the waiting callers share (the whole table A is fetched at once,
+so the refreshes of all the currencies are coalesced).
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+
+from .exceptions import ServiceUnavailable
+from .models import ExchangeRate
+from .serializers import CURRENCY_CHOICES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NBP_API_URL = "https://api.nbp.pl/api"
+DEFAULT_RATES_MAX_AGE = 60 * 60  # in seconds
+DEFAULT_RATES_MAX_STALENESS = 24 * 60 * 60  # in seconds
+DEFAULT_NBP_API_TIMEOUT = 5  # in seconds
+
+# sent after the rates in the rate store have been refreshed
+rates_refreshed = Signal()
+
+# currencies that have to be converted with the rates fetched from api.nbp.pl
+FOREIGN_CURRENCIES = tuple(code for code, _ in CURRENCY_CHOICES if code != 'PLN')
+
+
+def get_rates_max_age():
+    return timedelta(seconds=getattr(settings, 'NBP_RATES_MAX_AGE', DEFAULT_RATES_MAX_AGE))
+
+
+def get_rates_max_staleness():
+    return timedelta(seconds=getattr(settings, 'NBP_RATES_MAX_STALENESS', DEFAULT_RATES_MAX_STALENESS))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single call, whose result (or exception)
+    is shared by all the callers.
+    """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+rate_table_flight = SingleFlight()
+
+
+def get_nbp_api_url():
+    return getattr(settings, 'NBP_API_URL', DEFAULT_NBP_API_URL).rstrip('/')
+
+
+def get_nbp_api_timeout():
+    return getattr(settings, 'NBP_API_TIMEOUT', DEFAULT_NBP_API_TIMEOUT)
+
+
+def fetch_rate_table():
+    """
+    Fetch the current table A of average exchange rates from the api.nbp.pl.
+    :return: tuple (effective_date, rates) where rates is a dict mapping currency code to its PLN rate
+    """
+    # imported only when the rates are fetched, so that it does not slow the worker boot down
+    import requests
+
+    try:
+        response = requests.get(f"{get_nbp_api_url()}/exchangerates/tables/a", params={"format": "json"},
+                                timeout=get_nbp_api_timeout())
+    except requests.Timeout:
+        raise ServiceUnavailable('api.nbp.pl did not respond in time')
+    except requests.RequestException:
+        raise ServiceUnavailable('api.nbp.pl cannot be reached')
+
+    if response.status_code != status.HTTP_200_OK:
+        raise ServiceUnavailable('api.nbp.pl cannot be reached')
+
+    table = response.json()[0]
+    rates = {rate['code']: rate['mid'] for rate in table['rates']}
+    return parse_date(table['effectiveDate']), rates
+
+
+def store_rates(rates, effective_date=None):
+    """Save (or overwrite) given rates in the shared rate store."""
+    fetched_at = timezone.now()
+    with transaction.atomic():
+        for currency, mid in rates.items():
+            ExchangeRate.objects.update_or_create(currency=currency,
+                                                  defaults={'mid': mid,
+                                                            'effective_date': effective_date,
+                                                            'fetched_at': fetched_at})
+
+    rates_refreshed.send(sender=ExchangeRate, rates=rates)
+
+
+def get_stored_rates(currencies):
+    """
+    Get rates of 'currencies' from the shared rate store without refreshing it.
+    :return: dict mapping currency code to its PLN rate (missing and outdated rates are left out)
+    """
+    return dict(ExchangeRate.objects.filter(currency__in=currencies,
+                                            fetched_at__gt=timezone.now() - get_rates_max_age())
+                .values_list('currency', 'mid'))
+
+
+def fetch_and_store_rates():
+    effective_date, table = fetch_rate_table()
+    rates = {currency: table[currency] for currency in FOREIGN_CURRENCIES if currency in table}
+    store_rates(rates, effective_date)
+    return rates
+
+
+def refresh_rates():
+    """
+    Fetch rates of all supported foreign currencies in a single api.nbp.pl round trip
+    and save them in the shared rate store. Concurrent refreshes share a single round trip.
+    :return: dict mapping currency code to its PLN rate
+    """
+    return rate_table_flight.do('A', fetch_and_store_rates)
+
+
+def refresh_rates_in_background():
+    """Refresh the rate store in a background thread, unless a refresh is already in flight."""
+    if rate_table_flight.in_flight('A'):
+        return
+
+    def refresh():
+        try:
+            refresh_rates()
+        except (ServiceUnavailable, DatabaseError) as e:
+            logger.warning("Exchange rates could not be refreshed: %s", e)
+        finally:
+            connection.close()
+
+    threading.Thread(target=refresh, name="refresh-rates", daemon=True).start()
+
+
+def get_rate(currency):
+    """
+    Get PLN to 'currency' rate from the shared rate store.
+    Outdated rate (not older than NBP_RATES_MAX_STALENESS) is returned while the store is refreshed
+    in the background, missing (or too old) rate is fetched from the api.nbp.pl before it is returned.
+    """
+    stored = ExchangeRate.objects.filter(currency=currency).first()
+    if stored is not None:
+        age = timezone.now() - stored.fetched_at
+        if age < get_rates_max_age():
+            return stored.mid
+        if age < get_rates_max_staleness():
+            refresh_rates_in_background()
+            return stored.mid
+
+    rates = refresh_rates()
+    try:
+        return rates[currency]
+    except KeyError:
+        raise ServiceUnavailable(f'api.nbp.pl does not provide {currency} rate')
+
+
+def warm_rates(force=False):
+    """
+    Preload rates of all supported foreign currencies into the shared rate store.
+    Nothing is fetched if the store is already up to date (e.g. it was warmed up by another worker),
+    unless 'force' is set.
+    :return: number of rates fetched from the api.nbp.pl
+    """
+    if not force:
+        fresh_count = ExchangeRate.objects.filter(currency__in=FOREIGN_CURRENCIES,
+                                                  fetched_at__gt=timezone.now() - get_rates_max_age()).count()
+        if fresh_count == len(FOREIGN_CURRENCIES):
+            return 0
+
+    return len(refresh_rates())
+
+
+def warm_rates_on_startup():
+    """Warm up the rate store when a worker boots (see gunicorn.conf.py), without ever preventing it from starting."""
+    try:
+        warm_rates()
+    except (ServiceUnavailable, DatabaseError) as e:
+        logger.warning("Exchange rates could not be preloaded: %s", e)
+
+
+def get_rates():
+    """
+    Get rates of all supported foreign currencies from the shared rate store, refreshing it if needed.
+    :return: dict mapping currency code to its PLN rate
+    """
+    warm_rates()
+    return dict(ExchangeRate.objects.filter(currency__in=FOREIGN_CURRENCIES).values_list('currency', 'mid'))
@@ -0,0 +1,60 @@
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.utils.dateparse import parse_datetime
+
+
+@dataclass
+class PaymentRecord:
+    """
+    Compact representation of a single row of the payment report, used from the validation of the received
+    payment data through sorting to rendering (fields are in the order of the PaymentInfoSerializer fields).
+    Payment type and currency strings are interned, so all the records share a single copy of each.
+    """
+    __slots__ = ('date', 'type', 'payment_mean', 'description', 'amount', 'currency', 'amount_in_pln')
+    fields = __slots__  # names of all the fields, in order (also of the subclasses)
+
+    date: datetime
+    type: str
+    payment_mean: str
+    description: str
+    amount: int
+    currency: str
+    amount_in_pln: int
+
+    def __post_init__(self):
+        self.type = sys.intern(self.type)
+        self.currency = sys.intern(self.currency)
+
+    def __reduce__(self):
+        # pickle records (e.g. sent back by the validation workers) as plain tuples of values
+        return type(self), tuple(getattr(self, name) for name in self.fields)
+
+
+@dataclass
+class ConvertedPaymentRecord(PaymentRecord):
+    """
+    Row of the payment report with the amount converted also to the target currency of the report.
+    """
+    __slots__ = ('target_currency', 'amount_in_target_currency')
+    fields = PaymentRecord.fields + __slots__
+
+    target_currency: str
+    amount_in_target_currency: int
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.target_currency = sys.intern(self.target_currency)
+
+
+def record_to_dict(record):
+    return {name: getattr(record, name) for name in record.fields}
+
+
+def record_from_dict(row):
+    """Get payment record back from its dict (e.g. decoded from the json of a saved report)."""
+    record_class = ConvertedPaymentRecord if 'target_currency' in row else PaymentRecord
+    values = [row[name] for name in record_class.fields]
+    values[0] = parse_datetime(values[0])
+    return record_class(*values)
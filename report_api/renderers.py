@@ -0,0 +1,213 @@
+import csv
+import io
+from datetime import datetime
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+from .records import ConvertedPaymentRecord, PaymentRecord, record_to_dict
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json based rendering of the JSONRenderer
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are not rendered
+    msgpack = None
+
+
+class ReportJSONEncoder(encoders.JSONEncoder):
+    """
+    JSONEncoder that also handles the payment report records.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, PaymentRecord):
+            return record_to_dict(obj)
+        return super().default(obj)
+
+
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by the orjson (if it is installed).
+    Datetime objects and payment report records are serialized natively,
+    in the same format as by the JSONRenderer ('Z' suffix for UTC), and U+2028 and U+2029
+    (which orjson leaves unescaped) are escaped like by the JSONRenderer.
+    """
+    encoder_class = ReportJSONEncoder
+    orjson_options = orjson.OPT_UTC_Z if orjson is not None else None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # orjson can only indent by 2 spaces, so indented output is left to the JSONRenderer
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b''
+
+        content = orjson.dumps(data, default=ReportJSONEncoder().default, option=self.orjson_options)
+        # replace() returns the same bytes if there is nothing to escape
+        return content.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+
+
+def render_json(data):
+    """Render data as json bytes, the same way as it is rendered in the responses."""
+    return FastJSONRenderer().render(data)
+
+
+def format_datetime(value):
+    """Format datetime the same way as the JSONRenderer does."""
+    representation = value.isoformat()
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+class StreamingReportRenderer(BaseRenderer):
+    """
+    Base for the renderers of report rows (payment records or dicts, e.g. decoded from a saved report),
+    that can render the rows incrementally, in chunks of 'rows_per_chunk' rows (see render_rows).
+    """
+    rows_per_chunk = 1000
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # anything else than the list of report rows (e.g. errors) is rendered as a single row
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(self.render_rows(rows))
+
+    def render_rows(self, rows):
+        """Render report rows, yielding the rendered content in chunks."""
+        raise NotImplementedError('Renderer class requires .render_rows() to be implemented')
+
+
+class NDJSONRenderer(StreamingReportRenderer):
+    """
+    Renders report rows as newline delimited json (one json object per row).
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render_rows(self, rows):
+        json_renderer = FastJSONRenderer()
+        chunk = []
+
+        for row in rows:
+            chunk.append(json_renderer.render(row))
+            if len(chunk) == self.rows_per_chunk:
+                yield b'\n'.join(chunk) + b'\n'
+                chunk = []
+
+        if chunk:
+            yield b'\n'.join(chunk) + b'\n'
+
+
+class CSVRenderer(StreamingReportRenderer):
+    """
+    Renders report rows as csv, with a header row of the PaymentInfoSerializer field names
+    (including the target currency fields of the converted reports).
+    Anything else than report rows (e.g. errors, or rows with only some of the fields) is rendered
+    with its own keys in the header.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    fields = PaymentRecord.fields
+
+    @staticmethod
+    def get_values(row, fields):
+        if isinstance(row, PaymentRecord):
+            values = [getattr(row, field) for field in fields]
+        else:
+            values = [row.get(field) for field in fields]
+        return [format_datetime(value) if isinstance(value, datetime)
+                else '; '.join(map(str, value)) if isinstance(value, list)
+                else value
+                for value in values]
+
+    def render_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        rows = iter(rows)
+
+        first_row = next(rows, None)
+        fields = self.fields
+        if isinstance(first_row, PaymentRecord):
+            fields = first_row.fields
+        elif isinstance(first_row, dict):
+            if 'target_currency' in first_row:
+                fields = ConvertedPaymentRecord.fields
+            if set(first_row) != set(fields):  # e.g. only the requested fields of a saved report
+                fields = list(first_row)
+
+        writer.writerow(fields)
+        if first_row is not None:
+            writer.writerow(self.get_values(first_row, fields))
+
+        for i, row in enumerate(rows, start=2):
+            writer.writerow(self.get_values(row, fields))
+            if i % self.rows_per_chunk == 0:
+                yield buffer.getvalue().encode(self.charset)
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue().encode(self.charset)
+
+
+class MessagePackRenderer(StreamingReportRenderer):
+    """
+    Renders report rows as a MessagePack array of maps (requires the msgpack), with the dates as timestamps
+    (the MessagePack timestamp extension type). Anything else than report rows (e.g. errors) is rendered as it is.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, PaymentRecord):
+            return record_to_dict(obj)
+        # the rest (e.g. UUIDs, decimals, naive datetimes) the same way as in json
+        return ReportJSONEncoder().default(obj)
+
+    def get_packer(self):
+        return msgpack.Packer(datetime=True, default=self.default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if not isinstance(data, list):
+            return self.get_packer().pack(data)
+        return b''.join(self.render_rows(data))
+
+    def render_rows(self, rows):
+        packer = self.get_packer()
+        rows = rows if isinstance(rows, list) else list(rows)  # the array length goes first
+
+        chunk = [packer.pack_array_header(len(rows))]
+        for row in rows:
+            if isinstance(row, PaymentRecord):
+                row = record_to_dict(row)
+            elif isinstance(row.get('date'), str):
+                # rows decoded from the json of a saved report
+                row = {**row, 'date': parse_datetime(row['date'])}
+            chunk.append(packer.pack(row))
+
+            if len(chunk) > self.rows_per_chunk:
+                yield b''.join(chunk)
+                chunk = []
+
+        if chunk:
+            yield b''.join(chunk)
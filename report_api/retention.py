@@ -0,0 +1,144 @@
+"""
+Retention policy of the saved reports.
+
+Reports are evicted either when they were not accessed for a given time, or (least recently accessed first)
+when the total size of the saved reports exceeds the storage budget. Last access times are updated at most
+once per settings.REPORT_ACCESS_TRACKING_RESOLUTION seconds, so reading a report rarely writes to the database.
+Reports are deleted in batches, each in its own short transaction, so the pruning never locks the database
+for long (the storage budget is shared by all the report shards). The space freed in SQLite is given back
+to the filesystem with incremental vacuum.
+"""
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .cache import saved_report_cache
+from .models import Report
+from .routers import get_shards, shard_for
+
+DEFAULT_ACCESS_TRACKING_RESOLUTION = 60 * 60  # in seconds
+DEFAULT_PRUNE_BATCH_SIZE = 500  # in reports
+
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def touch_report(customer_id, last_accessed):
+    """
+    Record access to the report, if its last access time is older than the tracking resolution.
+    :return: the recorded last access time
+    """
+    now = timezone.now()
+    resolution = timedelta(seconds=getattr(settings, 'REPORT_ACCESS_TRACKING_RESOLUTION',
+                                           DEFAULT_ACCESS_TRACKING_RESOLUTION))
+
+    if now - last_accessed < resolution:
+        return last_accessed
+
+    Report.objects.using(shard_for(customer_id)).filter(pk=customer_id).update(last_accessed=now)
+    return now
+
+
+def delete_reports(customer_ids, using):
+    """
+    Delete reports of a batch (stored in the 'using' shard) in its own transaction.
+    :return: number of deleted reports
+    """
+    with transaction.atomic(using=using):
+        _, deleted = Report.objects.using(using).filter(customer_id__in=customer_ids).delete()
+    saved_report_cache.delete_many(customer_ids)
+    return deleted.get(Report._meta.label, 0)
+
+
+def prune_by_age(max_age, batch_size=DEFAULT_PRUNE_BATCH_SIZE, dry_run=False):
+    """
+    Delete reports that were not accessed for 'max_age' (timedelta).
+    :return: tuple (number of deleted reports, their total size in bytes)
+    """
+    cutoff = timezone.now() - max_age
+    deleted_count = deleted_size = 0
+
+    for shard in get_shards():
+        stale_reports = Report.objects.using(shard).filter(last_accessed__lt=cutoff).order_by('last_accessed')
+        if dry_run:
+            deleted_count += stale_reports.count()
+            deleted_size += stale_reports.aggregate(total=Sum('size'))['total'] or 0
+            continue
+
+        while True:
+            batch = list(stale_reports.values_list('customer_id', 'size')[:batch_size])
+            if not batch:
+                break
+
+            deleted_count += delete_reports([customer_id for customer_id, _ in batch], shard)
+            deleted_size += sum(size for _, size in batch)
+
+    return deleted_count, deleted_size
+
+
+def least_recently_accessed(shard):
+    """:return: iterator of (last_accessed, customer_id, size, shard) of the reports of the shard"""
+    reports = (Report.objects.using(shard).order_by('last_accessed', 'customer_id')
+               .values_list('last_accessed', 'customer_id', 'size'))
+    return ((last_accessed, customer_id, size, shard) for last_accessed, customer_id, size in reports.iterator())
+
+
+def prune_to_budget(max_size, batch_size=DEFAULT_PRUNE_BATCH_SIZE, dry_run=False):
+    """
+    Delete least recently accessed reports (of all the shards) until the total size of the saved reports
+    is within 'max_size' bytes.
+    :return: tuple (number of deleted reports, their total size in bytes)
+    """
+    shards = get_shards()
+    excess = sum(Report.objects.using(shard).aggregate(total=Sum('size'))['total'] or 0 for shard in shards) - max_size
+
+    # select the reports to delete first (merging the shards by the last access), then delete them shard by shard
+    selected = defaultdict(list)
+    selected_count = deleted_size = 0
+    if excess > 0:
+        for _, customer_id, size, shard in heapq.merge(*map(least_recently_accessed, shards)):
+            selected[shard].append(customer_id)
+            selected_count += 1
+            deleted_size += size
+            if deleted_size >= excess:
+                break
+
+    if dry_run:
+        return selected_count, deleted_size
+
+    deleted_count = 0
+    for shard, customer_ids in selected.items():
+        for start in range(0, len(customer_ids), batch_size):
+            deleted_count += delete_reports(customer_ids[start:start + batch_size], shard)
+
+    return deleted_count, deleted_size
+
+
+def compact_storage(using='default'):
+    """
+    Give the pages freed in the SQLite database back to the filesystem with incremental vacuum.
+    The database is switched to the incremental auto vacuum mode first if needed (which requires a full VACUUM once).
+    :return: number of freed database pages, or None if the database is not SQLite
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != SQLITE_AUTO_VACUUM_INCREMENTAL:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+
+        cursor.execute('PRAGMA incremental_vacuum')
+        cursor.fetchall()  # pages are freed one by one as the statement is stepped through
+
+        cursor.execute('PRAGMA page_count')
+        return page_count - cursor.fetchone()[0]
@@ -0,0 +1,106 @@
+"""
+Sharding of the per-customer tables (saved reports, their rows and the upload sessions) across
+the settings.REPORT_SHARDS databases by customer_id, so the saves of different customers do not wait
+for the single writer lock of one SQLite database.
+
+Customers are assigned to the shards with the jump consistent hash, so when a shard is added only
+the customers moving to the new shard have to be moved ('manage.py reshard_reports'). Queries of the sharded
+tables select the database of the customer explicitly (e.g. Report.objects.using(shard_for(customer_id))),
+the router routes the saves of the model instances and the queries related to them, and keeps the sharded tables
+on the shards (and the other tables on the default database). The table of the requests in flight is kept
+in a database of its own (settings.REPORT_ADMISSION_DATABASE), see report_api.admission.
+"""
+from django.conf import settings
+
+SHARDED_MODELS = {'report', 'reportpayment', 'uploadsession', 'uploadchunk'}
+# tables kept in the database of the admission control (see report_api.admission)
+ADMISSION_MODELS = {'inflightrequest'}
+
+
+def get_shards():
+    return getattr(settings, 'REPORT_SHARDS', None) or ['default']
+
+
+def get_admission_database():
+    return getattr(settings, 'REPORT_ADMISSION_DATABASE', None) or 'default'
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping, Veach) of the integer key to one of 'buckets' buckets."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(customer_id):
+    """Get the alias of the database the customer's reports are stored in."""
+    shards = get_shards()
+    return shards[jump_hash(int(customer_id), len(shards))]
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'report_api' and model._meta.model_name in SHARDED_MODELS
+
+
+def is_admission(model):
+    return model._meta.app_label == 'report_api' and model._meta.model_name in ADMISSION_MODELS
+
+
+def get_customer_id(instance):
+    """Get customer_id of the instance of a sharded model, or None if it is not known without a query."""
+    model_name = instance._meta.model_name
+    if model_name in ('report', 'uploadsession'):
+        return instance.customer_id
+    if model_name == 'reportpayment':
+        return instance.report_id
+    if model_name == 'uploadchunk' and instance.session_id is not None:
+        session = instance._state.fields_cache.get('session')
+        return session.customer_id if session is not None else None
+    return None
+
+
+class ReportShardRouter:
+    """
+    Database router of the sharded tables and of the admission table (see the module docstring).
+    """
+
+    def db_for_instance(self, model, **hints):
+        if is_admission(model):
+            return get_admission_database()
+
+        instance = hints.get('instance')
+        if not is_sharded(model) or instance is None:
+            return None
+
+        # queries related to an instance (e.g. session.chunks) go to the database of the instance
+        if instance._state.db is not None:
+            return instance._state.db
+
+        if is_sharded(type(instance)):
+            customer_id = get_customer_id(instance)
+            if customer_id is not None:
+                return shard_for(customer_id)
+        return None
+
+    db_for_read = db_for_instance
+    db_for_write = db_for_instance
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = get_shards()
+        if app_label == 'report_api' and model_name in SHARDED_MODELS:
+            return db in shards
+        if app_label == 'report_api' and model_name in ADMISSION_MODELS:
+            return db == get_admission_database()
+        if db != 'default':
+            # shards (and the other databases) only hold the sharded tables
+            return False
+        return None
@@ -69,3 +69,5 @@ class PaymentInfoSerializer(serializers.Serializer):
     amount = serializers.IntegerField()
     currency = serializers.ChoiceField(choices=CURRENCY_CHOICES)
     amount_in_pln = serializers.IntegerField()
+    target_currency = serializers.ChoiceField(choices=CURRENCY_CHOICES, required=False)
+    amount_in_target_currency = serializers.IntegerField(required=False)
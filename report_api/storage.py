@@ -0,0 +1,275 @@
+"""
+Storage format of the saved reports (Report.content).
+
+Reports are stored column by column instead of as the json of their rows, so the keys are not repeated on every row
+and every column is encoded by the type of its values:
+- strings (type, payment_mean, description, currencies) are dictionary encoded: every distinct string is stored once,
+  and the rows store its index in the dictionary,
+- dates are stored as the deltas of their UTC timestamps (in microseconds) from the date of the previous row
+  (rows are sorted by date, so the deltas are small),
+- integers (the amounts) and all of the above are stored as (zigzag) varints.
+
+Every column is prefixed with its length, so the columns that are not requested are skipped without decoding them,
+and the rows of a date range are found by bisecting the dates (of a report sorted by date) before the other columns
+are decoded. Reports saved earlier as json (not converted by the 0006 migration, e.g. restored from a backup)
+are still read.
+
+    content: MAGIC, varint flags, varint row count, then for every column (in the order of the record fields)
+             varint length and the column
+    string column: varint dictionary size, (varint length, utf-8) of every string, varint index of every row
+    date column: zigzag varint delta (in microseconds) of every row
+    integer column: zigzag varint of every row
+"""
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+from django.utils.dateparse import parse_datetime
+
+from .parsers import parse_json
+from .records import ConvertedPaymentRecord, PaymentRecord
+from .renderers import render_json
+
+MAGIC = b'PRC\x01'
+
+FLAG_CONVERTED = 1  # rows have the target currency fields (ConvertedPaymentRecord)
+FLAG_SORTED = 2  # rows are sorted by date
+
+STRING, TIMESTAMP, INTEGER = 'string', 'timestamp', 'integer'
+COLUMN_TYPES = {'date': TIMESTAMP, 'type': STRING, 'payment_mean': STRING, 'description': STRING,
+                'amount': INTEGER, 'currency': STRING, 'amount_in_pln': INTEGER,
+                'target_currency': STRING, 'amount_in_target_currency': INTEGER}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def is_columnar(content):
+    return bytes(content[:len(MAGIC)]) == MAGIC
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def read_varint(data, pos):
+    """:return: tuple (value, position after the varint)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_varints(data, count=None, signed=False):
+    """
+    Decode the varints of the column data.
+    :param count: number of the decoded values (from the first one), or None for all of them
+    :param signed: whether the values are zigzag encoded
+    :return: list of the values
+    """
+    data = bytes(data)
+    if count == 0:
+        return []
+
+    # small values (e.g. indexes of a short dictionary) are single bytes
+    if not signed and (not data or max(data) < 0x80):
+        return list(data[:count])
+
+    values = []
+    append = values.append
+    value = shift = 0
+    remaining = count if count is not None else -1
+    for byte in data:
+        if byte < 0x80:
+            value |= byte << shift
+            append((value >> 1) ^ -(value & 1) if signed else value)
+            value = shift = 0
+            remaining -= 1
+            if not remaining:
+                break
+        else:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def get_value(row, name):
+    return getattr(row, name) if isinstance(row, PaymentRecord) else row[name]
+
+
+def get_timestamp(date):
+    """Get UTC timestamp (in microseconds) of the date (datetime, or its string, e.g. from the report json)."""
+    if isinstance(date, str):
+        date = parse_datetime(date)
+    return (date - EPOCH) // MICROSECOND
+
+
+def encode_column(column_type, values):
+    out = bytearray()
+
+    if column_type == STRING:
+        indexes = {}
+        row_indexes = [indexes.setdefault(value, len(indexes)) for value in values]
+        write_varint(out, len(indexes))
+        for value in indexes:
+            encoded = value.encode()
+            write_varint(out, len(encoded))
+            out += encoded
+        for index in row_indexes:
+            write_varint(out, index)
+
+    elif column_type == TIMESTAMP:
+        previous = 0
+        for timestamp in values:
+            write_varint(out, zigzag(timestamp - previous))
+            previous = timestamp
+
+    else:
+        for value in values:
+            write_varint(out, zigzag(value))
+
+    return out
+
+
+def decode_column(column_type, data, start, stop):
+    """Decode values of the rows from 'start' to 'stop' of the column."""
+    if column_type == STRING:
+        size, pos = read_varint(data, 0)
+        dictionary = []
+        for _ in range(size):
+            length, pos = read_varint(data, pos)
+            dictionary.append(str(data[pos:pos + length], 'utf-8'))
+            pos += length
+        return [dictionary[index] for index in read_varints(data[pos:], stop)[start:]]
+
+    if column_type == TIMESTAMP:
+        return [EPOCH + timestamp * MICROSECOND for timestamp in decode_timestamps(data, stop)[start:]]
+
+    return read_varints(data, stop, signed=True)[start:]
+
+
+def decode_timestamps(data, count=None):
+    return list(accumulate(read_varints(data, count, signed=True)))
+
+
+def encode_report(rows):
+    """
+    Encode report rows (payment records, or their dicts, e.g. decoded from the report json) in the storage format.
+    :return: content of the saved report
+    """
+    rows = list(rows)
+    converted = bool(rows) and (isinstance(rows[0], ConvertedPaymentRecord) or
+                                not isinstance(rows[0], PaymentRecord) and 'target_currency' in rows[0])
+    fields = ConvertedPaymentRecord.fields if converted else PaymentRecord.fields
+
+    timestamps = [get_timestamp(get_value(row, 'date')) for row in rows]
+    is_sorted = all(previous <= timestamp for previous, timestamp in zip(timestamps, islice(timestamps, 1, None)))
+
+    out = bytearray(MAGIC)
+    write_varint(out, (FLAG_CONVERTED if converted else 0) | (FLAG_SORTED if is_sorted else 0))
+    write_varint(out, len(rows))
+    for name in fields:
+        values = timestamps if name == 'date' else [get_value(row, name) for row in rows]
+        column = encode_column(COLUMN_TYPES[name], values)
+        write_varint(out, len(column))
+        out += column
+
+    return bytes(out)
+
+
+def read_columns(content):
+    """:return: tuple (fields, flags, row count, dict of the column data by field)"""
+    data = memoryview(content)
+    flags, pos = read_varint(data, len(MAGIC))
+    row_count, pos = read_varint(data, pos)
+    fields = ConvertedPaymentRecord.fields if flags & FLAG_CONVERTED else PaymentRecord.fields
+
+    columns = {}
+    for name in fields:
+        length, pos = read_varint(data, pos)
+        columns[name] = data[pos:pos + length]
+        pos += length
+    return fields, flags, row_count, columns
+
+
+def select_rows(row_count, timestamps, start, end, offset, limit, is_sorted):
+    """:return: list of the indexes (or the range) of the rows with the dates from 'start' to 'end', paginated"""
+    if start is None and end is None:
+        selected = range(row_count)
+    elif is_sorted:
+        first = bisect_left(timestamps, get_timestamp(start)) if start is not None else 0
+        stop = bisect_left(timestamps, get_timestamp(end)) if end is not None else row_count
+        selected = range(first, max(first, stop))
+    else:
+        start_timestamp = get_timestamp(start) if start is not None else None
+        end_timestamp = get_timestamp(end) if end is not None else None
+        selected = [i for i, timestamp in enumerate(timestamps)
+                    if (start_timestamp is None or timestamp >= start_timestamp)
+                    and (end_timestamp is None or timestamp < end_timestamp)]
+
+    return selected[offset:offset + limit if limit is not None else None]
+
+
+def decode_report(content, fields=None, start=None, end=None, offset=0, limit=None):
+    """
+    Decode rows of the saved report, only the given fields of the rows with the dates in the given range.
+    :param fields: names of the decoded fields (of the record fields, in their order), or None for all of them
+                   (no fields give empty rows, like for the reports saved as json)
+    :param start: first date (datetime) of the decoded rows, or None
+    :param end: date (datetime) the decoded rows are before, or None
+    :param offset: number of the (selected) rows skipped
+    :param limit: max number of the decoded rows, or None
+    :return: list of dicts of the rows, with the dates as datetime objects
+    """
+    if not is_columnar(content):
+        return decode_json_report(content, fields, start, end, offset, limit)
+
+    report_fields, flags, row_count, columns = read_columns(content)
+    fields = [name for name in report_fields if fields is None or name in fields]
+
+    timestamps = decode_timestamps(columns['date']) if start is not None or end is not None else None
+    selected = select_rows(row_count, timestamps, start, end, offset, limit, flags & FLAG_SORTED)
+
+    if isinstance(selected, range):
+        values = [decode_column(COLUMN_TYPES[name], columns[name], selected.start, selected.stop) for name in fields]
+    else:
+        values = []
+        for name in fields:
+            column = decode_column(COLUMN_TYPES[name], columns[name], 0, row_count)
+            values.append([column[i] for i in selected])
+
+    if not fields:
+        return [{} for _ in selected]
+    return [dict(zip(fields, row)) for row in zip(*values)]
+
+
+def decode_json_report(content, fields, start, end, offset, limit):
+    """Decode rows of the report saved as json (see decode_report)."""
+    rows = parse_json(bytes(content))
+    for row in rows:
+        row['date'] = parse_datetime(row['date'])
+
+    rows = [row for row in rows
+            if (start is None or row['date'] >= start) and (end is None or row['date'] < end)]
+    rows = rows[offset:offset + limit if limit is not None else None]
+    if fields is not None:
+        rows = [{name: value for name, value in row.items() if name in fields} for row in rows]
+    return rows
+
+
+def render_report(content):
+    """Render saved report as json (the same json as it was rendered when the report was generated)."""
+    if not is_columnar(content):
+        return bytes(content)
+    return render_json(decode_report(content))
@@ -1,15 +1,103 @@
-from django.test import TestCase
-from django.utils import timezone
+import gzip
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
+from datetime import date, datetime, timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skip, skipUnless
+
+import pytz
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .serializers import *
-from .models import Report
-from .views import convert2PLN
-from datetime import timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework.renderers import JSONRenderer
-from rest_framework.exceptions import ValidationError
 from rest_framework.test import APITestCase
-from rest_framework import status
-from copy import deepcopy
+
+from benchmarks.memory_budget import MEMORY_BUDGETS, measure_paths, over_budget
+from benchmarks.nbp_stub import make_server
+from PaymentReportAPI import settings_lean
+
+from . import views
+from .admission import SharedAdmissionController, get_admission_controller
+from .cache import ReportCache, SavedReportCache, report_cache, report_cache_key, saved_report_cache
+from .compression import brotli, negotiate_encoding
+from .exceptions import Overloaded, ServiceUnavailable, UnsupportedPaymentType
+from .models import ExchangeRate, InflightRequest, Report, ReportPayment, UploadChunk, UploadSession
+from .parsers import FastJSONParser, msgpack
+from .rates import SingleFlight, refresh_rates, store_rates, warm_rates
+from .records import PaymentRecord, record_to_dict
+from .renderers import CSVRenderer, FastJSONRenderer, render_json
+from .routers import ReportShardRouter, get_shards, jump_hash, shard_for
+from .serializers import *
+from .storage import decode_report, encode_report, is_columnar, render_report
+from .validation import validate_report_data
+from .views import convert2PLN, generate_report
+
+def count_in_shards(model):
+    """Count rows of the sharded model in all the report shards."""
+    return sum(model.objects.using(shard).count() for shard in get_shards())
+
+
+@contextmanager
+def temporary_shards(aliases):
+    """
+    Use the report shards 'aliases' in temporary (migrated) SQLite databases as settings.REPORT_SHARDS,
+    whatever the shards of the test settings are.
+    """
+    with tempfile.TemporaryDirectory() as directory, override_settings(REPORT_SHARDS=aliases):
+        for alias in aliases:
+            connections.databases[alias] = {'ENGINE': 'django.db.backends.sqlite3',
+                                            'NAME': os.path.join(directory, f'{alias}.sqlite3')}
+            call_command('migrate', 'report_api', database=alias, verbosity=0)
+        try:
+            yield aliases
+        finally:
+            for alias in aliases:
+                connections[alias].close()
+                del connections[alias]
+                del connections.databases[alias]
+
+
+def saved_customer_ids():
+    return sorted(customer_id for shard in get_shards()
+                  for customer_id in Report.objects.using(shard).values_list('customer_id', flat=True))
+
+
+class TemporarySavedReportCacheMixin:
+    """
+    Mixin of the test cases using the saved report cache, which is kept in a temporary directory of every test
+    instead of the SAVED_REPORT_CACHE_DIR.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        caches_setting = deepcopy(settings.CACHES)
+        caches_setting[settings.SAVED_REPORT_CACHE]['LOCATION'] = directory.name
+        temporary_cache = override_settings(CACHES=caches_setting)
+        temporary_cache.enable()
+        self.addCleanup(temporary_cache.disable)
 
 
 class BasePaymentSerializerTests(TestCase):
@@ -105,10 +193,11 @@ class BasePaymentSerializerTests(TestCase):
         self.assertTrue(serializer.is_valid())
 
 
-class ReportViewTests(APITestCase):
+class ReportViewTests(TemporarySavedReportCacheMixin, APITestCase):
     """
     Class for testing the views ReportView and CustomerReportView.
     """
+    databases = '__all__'  # reports may be stored in several shards
     view_url = reverse('report_api:report')
     mixed_test_data = {
         "pay_by_link": [
@@ -649,7 +738,7 @@ class ReportViewTests(APITestCase):
                                                             url=customer1_url)
 
         # check if report has been saved in database
-        self.assertEqual(Report.objects.all().count(), 1)
+        self.assertEqual(count_in_shards(Report), 1)
 
         # get the last report that has been saved to the database
         get_response1 = self.client.get(customer1_url)
@@ -669,7 +758,7 @@ class ReportViewTests(APITestCase):
                                                             url=customer1_url)
 
         # check if report has been saved in database (overwriting the previously saved report)
-        self.assertEqual(Report.objects.all().count(), 1)  # report count should still be 1
+        self.assertEqual(count_in_shards(Report), 1)  # report count should still be 1
 
         # get the last report that has been saved to the database
         get_response2 = self.client.get(customer1_url)
@@ -681,3 +770,1672 @@ class ReportViewTests(APITestCase):
         # check if report received from the second get request is equal to the report
         # generated as a result of the second post request
         self.assertEqual(get_response2.data, post_response2.data)
+
+
+class ExchangeRateStoreTests(TestCase):
+    """
+    Class for testing the shared exchange rate store used by convert2PLN.
+    """
+    nbp_table = (date(2022, 5, 20), {"EUR": 4.6, "USD": 4.4, "GBP": 5.3, "CHF": 4.5})
+
+    def store_rate(self, currency, mid, age=timedelta()):
+        ExchangeRate.objects.create(currency=currency, mid=mid, fetched_at=timezone.now() - age)
+
+    def test_convert2pln_uses_fresh_stored_rate(self):
+        """
+        convert2PLN does not contact the api.nbp.pl if the stored rate is up to date.
+        """
+        self.store_rate("EUR", 4.5)
+
+        with mock.patch('report_api.rates.fetch_rate_table') as fetch_rate_table:
+            self.assertEqual(convert2PLN(1000, "EUR"), 4500)
+            fetch_rate_table.assert_not_called()
+
+    def test_convert2pln_refreshes_outdated_rate(self):
+        """
+        convert2PLN refreshes outdated rates of all supported currencies in the store
+        with a single api.nbp.pl request.
+        """
+        self.store_rate("EUR", 4.5, age=timedelta(days=2))
+
+        with mock.patch('report_api.rates.fetch_rate_table', return_value=self.nbp_table) as fetch_rate_table:
+            self.assertEqual(convert2PLN(1000, "EUR"), 4600)
+            fetch_rate_table.assert_called_once()
+
+        # unsupported currencies returned by the api.nbp.pl are not stored
+        self.assertEqual(set(ExchangeRate.objects.values_list('currency', flat=True)), {"EUR", "USD", "GBP"})
+        self.assertEqual(ExchangeRate.objects.get(currency="EUR").effective_date, date(2022, 5, 20))
+
+    def test_convert2pln_serves_stale_rate_while_refreshing(self):
+        """
+        convert2PLN returns outdated (but not too old) rate at once and refreshes the store in the background.
+        """
+        self.store_rate("EUR", 4.5, age=timedelta(hours=2))
+
+        with mock.patch('report_api.rates.refresh_rates_in_background') as refresh_rates_in_background, \
+                mock.patch('report_api.rates.fetch_rate_table') as fetch_rate_table:
+            self.assertEqual(convert2PLN(1000, "EUR"), 4500)
+            refresh_rates_in_background.assert_called_once()
+            fetch_rate_table.assert_not_called()
+
+    def test_concurrent_refreshes_share_single_request(self):
+        """
+        Concurrent refreshes of the rate store are coalesced into a single api.nbp.pl request.
+        """
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"EUR": 4.6}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('A', fetch)))
+        leader.start()
+        started.wait(5)
+
+        followers = [threading.Thread(target=lambda: results.append(flight.do('A', fetch))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        self.assertTrue(flight.in_flight('A'))
+
+        time.sleep(0.1)  # let the followers join the call in flight
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"EUR": 4.6}] * 5)
+        self.assertFalse(flight.in_flight('A'))
+
+    def test_single_flight_shares_errors(self):
+        """
+        Error of the coalesced call is raised in all its callers and the next call is made again.
+        """
+        flight = SingleFlight()
+
+        with self.assertRaises(ServiceUnavailable):
+            flight.do('A', mock.Mock(side_effect=ServiceUnavailable()))
+        self.assertEqual(flight.do('A', lambda: 1), 1)
+
+    def test_warm_rates_skips_up_to_date_store(self):
+        """
+        warm_rates does not fetch anything if all rates in the store are up to date, unless forced.
+        """
+        for currency in ("EUR", "USD", "GBP"):
+            self.store_rate(currency, 4.0)
+
+        with mock.patch('report_api.rates.fetch_rate_table', return_value=self.nbp_table) as fetch_rate_table:
+            self.assertEqual(warm_rates(), 0)
+            fetch_rate_table.assert_not_called()
+
+            self.assertEqual(warm_rates(force=True), 3)
+            fetch_rate_table.assert_called_once()
+
+    def test_warm_rates_command(self):
+        """
+        'manage.py warm_rates' preloads rates of all supported currencies.
+        """
+        out = StringIO()
+        with mock.patch('report_api.rates.fetch_rate_table', return_value=self.nbp_table):
+            call_command('warm_rates', stdout=out)
+
+        self.assertIn("Stored 3 exchange rates.", out.getvalue())
+        self.assertEqual(ExchangeRate.objects.count(), 3)
+
+
+class GenerateReportsCommandTests(TemporarySavedReportCacheMixin, TestCase):
+    """
+    Class for testing the 'generate_reports' management command.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        for currency, mid in (("EUR", 4.6), ("USD", 4.4), ("GBP", 5.3)):
+            ExchangeRate.objects.create(currency=currency, mid=mid, fetched_at=timezone.now())
+
+        records = [
+            {"customer_id": 7, "payments": ReportViewTests.mixed_test_data},
+            {"dp": ReportViewTests.mixed_test_data["dp"]},
+            {"customer_id": 8, "payments": {"blik": []}},
+        ]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp_dir.name, "input.jsonl")
+        self.output_path = os.path.join(self.tmp_dir.name, "output.ndjson")
+        with open(self.input_path, "w") as input_file:
+            input_file.writelines(json.dumps(record) + "\n" for record in records)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('generate_reports', self.input_path, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_generate_reports_to_ndjson_and_database(self):
+        """
+        Reports are written to the NDJSON output in input order, and reports of records
+        with 'customer_id' are saved in the database.
+        """
+        out = self.run_command("--output", self.output_path, "--save", "--workers", "2", "--chunk-size", "1")
+        self.assertIn("Generated 2 reports (1 failed) from 8 payments", out)
+
+        with open(self.output_path) as output_file:
+            results = [json.loads(line) for line in output_file]
+
+        self.assertEqual([result["line"] for result in results], [1, 2, 3])
+        self.assertEqual(len(results[0]["report"]), 6)
+        self.assertEqual(results[0]["report"][0]["amount_in_pln"], int(200 * 5.3))
+        self.assertEqual(results[1]["customer_id"], None)
+        self.assertEqual(len(results[1]["report"]), 2)
+        self.assertEqual(results[2]["errors"], {"detail": "Unsupported type of payment"})
+
+        saved_report = json.loads(render_report(Report.objects.using(shard_for(7)).get(customer_id=7).content))
+        self.assertEqual(saved_report, results[0]["report"])
+        self.assertFalse(Report.objects.using(shard_for(8)).filter(customer_id=8).exists())
+
+    def test_invalid_customer_ids_reported_as_errors(self):
+        """
+        Records with a customer_id that is not a non-negative integer are reported as errors,
+        without stopping the records that follow them from being saved.
+        """
+        records = [{"customer_id": customer_id, "payments": ReportViewTests.mixed_test_data}
+                   for customer_id in ("abc", -5, 1.5, True, 1)]
+        with open(self.input_path, "w") as input_file:
+            input_file.writelines(json.dumps(record) + "\n" for record in records)
+
+        out = self.run_command("--output", self.output_path, "--save")
+        self.assertIn("Generated 1 reports (4 failed)", out)
+
+        with open(self.output_path) as output_file:
+            results = [json.loads(line) for line in output_file]
+        for result in results[:4]:
+            self.assertIn("customer_id has to be a non-negative integer", result["errors"]["detail"])
+        self.assertTrue(Report.objects.using(shard_for(1)).filter(customer_id=1).exists())
+
+
+class FastJSONTests(TestCase):
+    """
+    Class for testing the FastJSONParser and FastJSONRenderer.
+    """
+    databases = '__all__'
+
+    def test_fast_json_renderer_output_equals_json_renderer_output(self):
+        """
+        FastJSONRenderer renders report data (including UTC datetimes) exactly like the JSONRenderer.
+        """
+        report = PaymentInfoSerializer(data=[
+            dict(date="2022-01-02T04:58:02.370518Z", type="dp", payment_mean="PLNOA123435467887653",
+                 description="Zażółć gęślą jaźń", amount=1000, currency="PLN", amount_in_pln=1000),
+            dict(date="2022-01-03T04:58:02Z", type="dp", payment_mean="PLNOA123435467887653",
+                 description="test", amount=1000, currency="PLN", amount_in_pln=1000),
+        ], many=True)
+        report.is_valid(raise_exception=True)
+
+        self.assertEqual(FastJSONRenderer().render(report.validated_data),
+                         JSONRenderer().render(report.validated_data))
+
+    def test_fast_json_renderer_escapes_line_separators(self):
+        """
+        FastJSONRenderer escapes U+2028 and U+2029 (left unescaped by the orjson) like the JSONRenderer.
+        """
+        data = [{"description": "Line\u2028separator, paragraph\u2029separator"}]
+
+        rendered = FastJSONRenderer().render(data)
+
+        self.assertEqual(rendered, JSONRenderer().render(data))
+        self.assertIn(b'Line\\u2028separator, paragraph\\u2029separator', rendered)
+
+    def test_indented_report(self):
+        """
+        Report is rendered as indented json if the 'indent' parameter of the 'Accept' header is given.
+        """
+        data = {"dp": [{"created_at": "2022-03-21T11:32:11.370518+03:00", "currency": "PLN", "amount": 31700,
+                        "description": "Restaurant\u2028", "iban": "PLNOA123435467887653"}]}
+
+        compact = self.client.post(reverse('report_api:report'), data=data, content_type="application/json")
+        indented = self.client.post(reverse('report_api:report'), data=data, content_type="application/json",
+                                    HTTP_ACCEPT="application/json; indent=4")
+
+        self.assertEqual(indented.status_code, status.HTTP_200_OK)
+        self.assertEqual(indented.content,
+                         JSONRenderer().render(json.loads(compact.content), renderer_context={'indent': 4}))
+        self.assertIn(b'\n    {\n        "date": "2022-03-21T08:32:11.370518Z"', indented.content)
+
+    def test_fast_json_parser_with_malformed_json(self):
+        """
+        FastJSONParser raises ParseError for malformed json, so the views respond with 400 bad request.
+        """
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"dp": ['))
+
+        response = self.client.post(reverse('report_api:report'), data='{"dp": [',
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(REPORT_ADMISSION_MAX_CLIENT_REQUESTS=1, REPORT_ADMISSION_MAX_INFLIGHT_ROWS=10,
+                   REPORT_ADMISSION_QUEUE_TIMEOUT=0, REPORT_ADMISSION_RETRY_AFTER=7)
+class AdmissionControlTests(APITestCase):
+    """
+    Class for testing the admission control of the report views (with the requests in flight of all the workers
+    tracked in the database).
+    """
+    databases = '__all__'
+    view_url = reverse('report_api:report')
+    pln_payment = {
+        "created_at": "2022-03-21T11:32:11.370518+03:00",
+        "currency": "PLN",
+        "amount": 31700,
+        "description": "Restaurant",
+        "iban": "PLNOA123435467887653"
+    }
+
+    def post_pln_payments(self, count):
+        return self.client.post(self.view_url, data={"dp": [self.pln_payment] * count}, format='json')
+
+    def test_admitted_request_is_released(self):
+        """
+        Admitted request is processed and its rows are released afterwards.
+        """
+        response = self.post_pln_payments(3)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_admission_controller().inflight_rows, 0)
+
+    def test_client_with_too_many_requests_in_flight(self):
+        """
+        Request of a client that already has the max number of requests in flight is rejected with 429.
+        """
+        ticket = get_admission_controller().admit("127.0.0.1", 1)
+        try:
+            response = self.post_pln_payments(1)
+        finally:
+            get_admission_controller().release(ticket)
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "7")
+
+    def test_rows_budget_exceeded(self):
+        """
+        Request that does not fit in the rows budget (together with the rows of other clients in flight)
+        is rejected with 503, while a smaller one is admitted.
+        """
+        ticket = get_admission_controller().admit("10.0.0.1", 5)
+        try:
+            rejected_response = self.post_pln_payments(6)
+            admitted_response = self.post_pln_payments(5)
+        finally:
+            get_admission_controller().release(ticket)
+
+        self.assertEqual(rejected_response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(rejected_response["Retry-After"], "7")
+        self.assertEqual(admitted_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_admission_controller().inflight_rows, 0)
+
+    def test_request_larger_than_budget_admitted_when_alone(self):
+        """
+        Request larger than the whole rows budget is admitted if nothing else is in flight.
+        """
+        response = self.post_pln_payments(11)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 11)
+
+    def test_requests_of_other_workers_are_counted(self):
+        """
+        Requests admitted by other worker processes count against the limits, until they expire.
+        """
+        other_worker = SharedAdmissionController()
+        ticket = other_worker.admit("127.0.0.1", 5)
+        try:
+            self.assertEqual(self.post_pln_payments(1).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+            InflightRequest.objects.filter(id=ticket.id).update(expires_at=timezone.now())
+            self.assertEqual(self.post_pln_payments(10).status_code, status.HTTP_200_OK)
+        finally:
+            other_worker.release(ticket)
+        self.assertFalse(InflightRequest.objects.exists())
+
+    def test_inflight_requests_tracked_in_admission_database(self):
+        """
+        Requests in flight are tracked in the admission database, and queued requests only read it while they wait.
+        """
+        ticket = get_admission_controller().admit("10.0.0.1", 10)
+        try:
+            with CaptureQueriesContext(connections[settings.REPORT_ADMISSION_DATABASE]) as queries, \
+                    override_settings(REPORT_ADMISSION_QUEUE_TIMEOUT=0.2), self.assertRaises(Overloaded):
+                get_admission_controller().admit("10.0.0.2", 1)
+        finally:
+            get_admission_controller().release(ticket)
+
+        self.assertGreater(len(queries), 1)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+        self.assertEqual(InflightRequest.objects.using(settings.REPORT_ADMISSION_DATABASE).count(), 0)
+
+    def test_locked_admission_database(self):
+        """
+        Request is rejected with 503 if the admission database stays locked.
+        """
+        with mock.patch('report_api.admission.InflightRequest.objects.using',
+                        side_effect=OperationalError("database is locked")):
+            response = self.post_pln_payments(1)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "7")
+
+
+@override_settings(REPORT_ADMISSION_SHARED=False)
+class LocalAdmissionControlTests(AdmissionControlTests):
+    """
+    Class for testing the admission control of the report views, with the requests in flight tracked
+    in the worker process.
+    """
+
+    @skip("requests of the other worker processes are not tracked")
+    def test_requests_of_other_workers_are_counted(self):
+        pass
+
+    @skip("requests in flight are tracked in memory")
+    def test_inflight_requests_tracked_in_admission_database(self):
+        pass
+
+    @skip("requests in flight are tracked in memory")
+    def test_locked_admission_database(self):
+        pass
+
+
+class ReportCacheTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the content-addressed cache of rendered reports.
+    """
+    databases = '__all__'
+    view_url = reverse('report_api:report')
+    data = {"pay_by_link": [
+        {
+            "created_at": "2022-05-13T19:12:02.370518+02:00",
+            "currency": "EUR",
+            "amount": 40000,
+            "description": "Car",
+            "bank": "idea_bank"
+        }
+    ]}
+
+    def setUp(self):
+        super().setUp()
+        report_cache.clear()
+        ExchangeRate.objects.create(currency="EUR", mid=4.5, fetched_at=timezone.now())
+
+    def post_counting_generations(self, url, data):
+        with mock.patch('report_api.views.generate_report', wraps=views.generate_report) as generate_report:
+            response = self.client.post(url, data=data, content_type="application/json")
+        return response, generate_report.call_count
+
+    def test_identical_submissions_served_from_cache(self):
+        """
+        Report for a resubmitted payload (even with different key order and whitespace) is not generated again,
+        for both the /report and /customer-report/<pk> endpoints.
+        """
+        customer_url = reverse('report_api:customer-report', kwargs={"pk": 1})
+        payment = self.data["pay_by_link"][0]
+
+        first_response, first_generations = self.post_counting_generations(self.view_url, json.dumps(self.data))
+        second_response, second_generations = self.post_counting_generations(
+            self.view_url, json.dumps({"pay_by_link": [dict(reversed(list(payment.items())))]}, indent=4))
+        customer_response, customer_generations = self.post_counting_generations(customer_url,
+                                                                                 json.dumps(self.data))
+
+        self.assertEqual((first_generations, second_generations, customer_generations), (1, 0, 0))
+        self.assertEqual(second_response.content, first_response.content)
+        self.assertEqual(customer_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(render_report(Report.objects.using(shard_for(1)).get(customer_id=1).content),
+                         first_response.content)
+        self.assertEqual(second_response.data, first_response.data)
+
+    def test_payment_types_order_kept(self):
+        """
+        Payloads differing in the order of the payment types (which orders the rows of the same date)
+        get their own reports, not the cached report of the other order.
+        """
+        card = {"created_at": "2022-05-13T19:12:02.370518+02:00", "currency": "PLN", "amount": 100,
+                "description": "Card", "cardholder_name": "John", "cardholder_surname": "Doe",
+                "card_number": "2222222222222"}
+        data = {**self.data, "card": [card]}
+
+        first_response, _ = self.post_counting_generations(self.view_url, json.dumps(data))
+        second_response, generations = self.post_counting_generations(self.view_url, json.dumps(
+            {"card": data["card"], "pay_by_link": data["pay_by_link"]}))
+
+        self.assertEqual(generations, 1)
+        self.assertEqual([row["type"] for row in first_response.json()], ["pay_by_link", "card"])
+        self.assertEqual([row["type"] for row in second_response.json()], ["card", "pay_by_link"])
+
+    def test_rates_refresh_invalidates_cache(self):
+        """
+        Reports cached before the rates are refreshed are generated again with the new rates.
+        """
+        first_response, _ = self.post_counting_generations(self.view_url, json.dumps(self.data))
+
+        store_rates({"EUR": 5.0})
+        self.assertEqual(report_cache.size, 0)
+
+        second_response, generations = self.post_counting_generations(self.view_url, json.dumps(self.data))
+        self.assertEqual(generations, 1)
+        self.assertEqual(first_response.data[0]["amount_in_pln"], 180000)
+        self.assertEqual(second_response.data[0]["amount_in_pln"], 200000)
+
+    def test_report_with_outdated_rate_not_cached(self):
+        """
+        Cache key is not computed if a rate used by the data is outdated in the rate store.
+        """
+        ExchangeRate.objects.filter(currency="EUR").update(fetched_at=timezone.now() - timedelta(days=2))
+
+        self.assertIsNone(report_cache_key(self.data, {}))
+
+    @override_settings(REPORT_CACHE_MAX_SIZE=10)
+    def test_least_recently_used_reports_evicted(self):
+        """
+        Least recently used reports are evicted once the total size of cached reports exceeds the limit.
+        """
+        cache = ReportCache()
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        cache.get("a")
+        cache.set("c", b"1234")
+        cache.set("d", b"12345678901")  # larger than the whole cache
+
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c"), cache.get("d")),
+                         (b"1234", None, b"1234", None))
+        self.assertEqual(cache.size, 8)
+
+
+@override_settings(REPORT_PARALLEL_VALIDATION_THRESHOLD=4, REPORT_PARALLEL_VALIDATION_CHUNK_SIZE=2,
+                   REPORT_PARALLEL_VALIDATION_WORKERS=2)
+class ParallelValidationTests(TestCase):
+    """
+    Class for testing the chunked parallel validation of huge reports.
+    """
+
+    def test_parallel_validation_equals_sequential_validation(self):
+        """
+        Payments validated in parallel are sorted exactly like the ones validated sequentially
+        (payments with equal dates keep the input order).
+        """
+        data = deepcopy(ReportViewTests.mixed_test_data)
+        data['dp'].append(dict(data['dp'][0], description="Same date as the first dp"))
+
+        with override_settings(REPORT_PARALLEL_VALIDATION_THRESHOLD=0):
+            sequential = validate_report_data(data)
+
+        self.assertEqual(validate_report_data(data), sequential)
+        self.assertEqual([record.description for record in sequential],
+                         ["Ice cream shop", "Clothing store", "Restaurant", "Same date as the first dp", "Toy Store",
+                          "Car", "Restaurant"])
+
+    def test_parallel_validation_reports_first_error_by_input_position(self):
+        """
+        The first invalid payment by input position is reported, regardless of which chunk fails first.
+        """
+        data = deepcopy(ReportViewTests.mixed_test_data)
+        data['card'][1]['currency'] = "CHF"
+        data['dp'][1]['created_at'] = "3000-05-13T19:12:02.370518+02:00"
+
+        with self.assertRaisesMessage(ValidationError, 'Date cannot be from the future!'):
+            validate_report_data(data)
+
+    def test_parallel_validation_with_unsupported_payment_type(self):
+        """
+        Unsupported payment type is reported only if all payments before it are valid.
+        """
+        data = deepcopy(ReportViewTests.mixed_test_data)
+        data['blik'] = data.pop('card')
+
+        with self.assertRaisesMessage(UnsupportedPaymentType, 'Unsupported type of payment'):
+            validate_report_data(data)
+
+        data['dp'][0]['currency'] = "CHF"
+        with self.assertRaisesMessage(ValidationError, 'is not a valid choice'):
+            validate_report_data(data)
+
+
+class PaymentRecordTests(TestCase):
+    """
+    Class for testing the compact PaymentRecord representation of report rows.
+    """
+    record = PaymentRecord(date=timezone.now(), type="".join(["d", "p"]), payment_mean="PLNOA123435467887653",
+                           description="Restaurant", amount=1000, currency="".join(["E", "UR"]), amount_in_pln=4600)
+
+    def test_payment_record_interns_type_and_currency(self):
+        """
+        Payment type and currency strings of all the records are shared.
+        """
+        self.assertIs(self.record.type, "dp")
+        self.assertIs(self.record.currency, "EUR")
+
+    def test_payment_record_has_no_instance_dict(self):
+        """
+        PaymentRecord uses slots instead of a per-instance dict.
+        """
+        self.assertFalse(hasattr(self.record, "__dict__"))
+
+    def test_payment_record_pickles_as_tuple(self):
+        """
+        PaymentRecord is pickled (e.g. by the validation workers) as a plain tuple of its values.
+        """
+        self.assertEqual(pickle.loads(pickle.dumps(self.record)), self.record)
+        self.assertEqual(self.record.__reduce__()[1][1:],
+                         ("dp", "PLNOA123435467887653", "Restaurant", 1000, "EUR", 4600))
+
+    def test_rendered_records_equal_rendered_payment_info(self):
+        """
+        Records are rendered exactly like the validated data of the PaymentInfoSerializer.
+        """
+        payment_info = PaymentInfoSerializer(data=[dict(date=self.record.date, type="dp",
+                                                        payment_mean="PLNOA123435467887653", description="Restaurant",
+                                                        amount=1000, currency="EUR", amount_in_pln=4600)], many=True)
+        payment_info.is_valid(raise_exception=True)
+
+        self.assertEqual(FastJSONRenderer().render([self.record]), JSONRenderer().render(payment_info.validated_data))
+
+
+class ExportFormatTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the csv and ndjson report formats negotiated with the 'Accept' header.
+    """
+    databases = '__all__'
+    data = {"dp": [
+        {
+            "created_at": "2022-04-21T21:34:11.370518+01:00",
+            "currency": "PLN",
+            "amount": 2200,
+            "description": "Toy Store, \"Smyk\"",
+            "iban": "GERSXOA86756435435465468"
+        },
+        {
+            "created_at": "2022-03-21T11:32:11.370518+03:00",
+            "currency": "PLN",
+            "amount": 31700,
+            "description": "Restaurant",
+            "iban": "PLNOA123435467887653"
+        }
+    ]}
+    expected_csv = (
+        'date,type,payment_mean,description,amount,currency,amount_in_pln\r\n'
+        '2022-03-21T08:32:11.370518Z,dp,PLNOA123435467887653,Restaurant,31700,PLN,31700\r\n'
+        '2022-04-21T20:34:11.370518Z,dp,GERSXOA86756435435465468,"Toy Store, ""Smyk""",2200,PLN,2200\r\n'
+    )
+
+    def post(self, url, accept):
+        return self.client.post(url, data=self.data, format='json', HTTP_ACCEPT=accept)
+
+    def test_report_as_csv(self):
+        """
+        Report is streamed as csv for 'Accept: text/csv'.
+        """
+        response = self.post(reverse('report_api:report'), "text/csv")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(b"".join(response.streaming_content).decode(), self.expected_csv)
+
+    def test_report_as_ndjson(self):
+        """
+        Report is streamed as ndjson for 'Accept: application/x-ndjson', one json object per row.
+        """
+        json_response = self.post(reverse('report_api:report'), "application/json")
+        response = self.post(reverse('report_api:report'), "application/x-ndjson")
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, json.loads(json_response.content))
+
+    def test_saved_report_as_csv(self):
+        """
+        Report saved from a json request can be retrieved as csv, and a report requested as csv is saved too
+        (and retrieved as json).
+        """
+        customer_url = reverse('report_api:customer-report', kwargs={"pk": 1})
+
+        post_response = self.post(customer_url, "text/csv")
+        get_response = self.client.get(customer_url, HTTP_ACCEPT="text/csv")
+
+        self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(b"".join(post_response.streaming_content).decode(), self.expected_csv)
+        self.assertEqual(b"".join(get_response.streaming_content).decode(), self.expected_csv)
+        self.assertEqual(len(self.client.get(customer_url).data), 2)
+
+    def test_errors_as_csv(self):
+        """
+        Errors are rendered as csv for 'Accept: text/csv'.
+        """
+        data = deepcopy(self.data)
+        data['dp'][0]['created_at'] = "3000-05-13T19:12:02.370518+02:00"
+
+        response = self.client.post(reverse('report_api:report'), data=data, format='json', HTTP_ACCEPT="text/csv")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.content.decode(), 'created_at\r\nDate cannot be from the future!\r\n')
+
+
+@skipUnless(msgpack is not None, "msgpack is not installed")
+class MessagePackTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the MessagePack requests and responses (with the dates as timestamps).
+    """
+    databases = '__all__'
+    data = {"dp": [
+        {
+            "created_at": datetime(2022, 4, 21, 20, 34, 11, 370518, tzinfo=pytz.utc),
+            "currency": "PLN",
+            "amount": 2200,
+            "description": "Toy Store",
+            "iban": "GERSXOA86756435435465468"
+        },
+        {
+            "created_at": datetime(2022, 3, 21, 8, 32, 11, 370518, tzinfo=pytz.utc),
+            "currency": "PLN",
+            "amount": 31700,
+            "description": "Restaurant",
+            "iban": "PLNOA123435467887653"
+        }
+    ]}
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+
+    def post(self, url, data):
+        return self.client.post(url, data=msgpack.packb(data, datetime=True), content_type="application/msgpack",
+                                HTTP_ACCEPT="application/msgpack")
+
+    def unpack(self, response):
+        return msgpack.unpackb(b"".join(response.streaming_content), timestamp=3)
+
+    def expected_rows(self):
+        json_data = {payment_type: [{**payment, "created_at": payment["created_at"].isoformat()}
+                                    for payment in payments]
+                     for payment_type, payments in self.data.items()}
+        response = self.client.post(reverse('report_api:report'), data=json_data, format='json')
+        return [{**row, "date": parse_datetime(row["date"])} for row in json.loads(response.content)]
+
+    def test_report_as_msgpack(self):
+        """
+        Report generated for the msgpack request is sent as msgpack, with the same rows as the json report.
+        """
+        response = self.post(reverse('report_api:report'), self.data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        rows = self.unpack(response)
+        self.assertEqual(rows, self.expected_rows())
+        self.assertEqual(rows[0]["date"], self.data["dp"][1]["created_at"])
+
+    def test_saved_report_as_msgpack(self):
+        """
+        Report saved from the msgpack request can be retrieved as msgpack (and as json).
+        """
+        customer_url = reverse('report_api:customer-report', kwargs={"pk": 1})
+
+        post_response = self.post(customer_url, self.data)
+        get_response = self.client.get(customer_url, HTTP_ACCEPT="application/msgpack")
+
+        self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
+        saved_rows = self.unpack(get_response)
+        self.assertEqual(saved_rows, self.unpack(post_response))
+        self.assertEqual(saved_rows, self.expected_rows())
+        self.assertEqual(len(self.client.get(customer_url).data), 2)
+
+    def test_errors_as_msgpack(self):
+        """
+        Invalid payments and malformed msgpack are rejected with 400 and the errors are rendered as msgpack maps.
+        """
+        data = deepcopy(self.data)
+        data['dp'][0]['created_at'] = datetime(3000, 5, 13, 17, 12, 2, tzinfo=pytz.utc)
+
+        response = self.post(reverse('report_api:report'), data)
+        malformed_response = self.client.post(reverse('report_api:report'), data=b"\xc1",
+                                               content_type="application/msgpack", HTTP_ACCEPT="application/msgpack")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(msgpack.unpackb(response.content), {"created_at": ["Date cannot be from the future!"]})
+        self.assertEqual(malformed_response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("MessagePack parse error", msgpack.unpackb(malformed_response.content)["detail"])
+
+
+@override_settings(REPORT_COMPRESSION_MIN_SIZE=100)
+class CompressionTests(APITestCase):
+    """
+    Class for testing the compression of the report responses negotiated with the 'Accept-Encoding' header.
+    """
+    databases = '__all__'
+    data = ExportFormatTests.data
+
+    def post(self, accept_encoding, accept="application/json"):
+        return self.client.post(reverse('report_api:report'), data=self.data, format='json', HTTP_ACCEPT=accept,
+                                HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_report_gzipped(self):
+        """
+        Report of at least REPORT_COMPRESSION_MIN_SIZE bytes is sent gzipped if the client accepts gzip.
+        """
+        response = self.post("gzip")
+        plain_response = self.post("")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertFalse(plain_response.has_header("Content-Encoding"))
+        self.assertEqual(gzip.decompress(response.content), plain_response.content)
+
+    def test_small_report_not_compressed(self):
+        """
+        Reports smaller than REPORT_COMPRESSION_MIN_SIZE bytes are sent as they are.
+        """
+        with override_settings(REPORT_COMPRESSION_MIN_SIZE=10000):
+            response = self.post("gzip")
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_streamed_report_compressed_incrementally(self):
+        """
+        Streamed report is compressed chunk by chunk, every compressed chunk can be decompressed as it arrives.
+        """
+        with mock.patch.object(CSVRenderer, 'rows_per_chunk', 1):
+            response = self.post("deflate, gzip;q=0.5", accept="text/csv")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decompressed_chunks = [decompressor.decompress(chunk) for chunk in response.streaming_content]
+        self.assertTrue(all(decompressed_chunks[:-1]))
+        self.assertEqual(b"".join(decompressed_chunks).decode(), ExportFormatTests.expected_csv)
+
+    def test_encoding_negotiated(self):
+        """
+        Brotli is preferred (if installed) unless the client prefers gzip, and codings with q=0 are not used.
+        """
+        preferred = "br" if brotli is not None else "gzip"
+
+        self.assertEqual(negotiate_encoding("gzip, deflate, br"), preferred)
+        self.assertEqual(negotiate_encoding("*"), preferred)
+        self.assertEqual(negotiate_encoding("br;q=0.5, gzip"), "gzip")
+        self.assertIsNone(negotiate_encoding("gzip;q=0, br;q=0"))
+        self.assertIsNone(negotiate_encoding("identity"))
+        self.assertIsNone(negotiate_encoding(""))
+
+    @skipUnless(brotli is not None, "Brotli is not installed")
+    def test_report_brotli_compressed(self):
+        """
+        Report is sent compressed with brotli if the client accepts it.
+        """
+        response = self.post("gzip, br")
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), self.post("").content)
+
+
+class TargetCurrencyTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the reports converted to the target currency with the cross rates of the PLN rates.
+    """
+    databases = '__all__'
+    data = {"dp": [
+        {
+            "created_at": "2022-03-21T11:32:11.370518+03:00",
+            "currency": "USD",
+            "amount": 1000,
+            "description": "Restaurant",
+            "iban": "PLNOA123435467887653"
+        },
+        {
+            "created_at": "2022-04-21T21:34:11.370518+01:00",
+            "currency": "PLN",
+            "amount": -1000,
+            "description": "Refund",
+            "iban": "GERSXOA86756435435465468"
+        }
+    ]}
+
+    def setUp(self):
+        super().setUp()
+        report_cache.clear()
+        store_rates({"EUR": 4.6642, "USD": 4.4455, "GBP": 5.37})
+
+    def test_report_in_target_currency(self):
+        """
+        Amounts are converted to the target currency with the cross rates (truncated towards zero),
+        without any api.nbp.pl request.
+        """
+        with mock.patch('report_api.rates.fetch_rate_table') as fetch_rate_table:
+            response = self.client.post(reverse('report_api:report') + "?target_currency=eur",
+                                        data=self.data, format='json')
+            fetch_rate_table.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = response.json()
+        self.assertEqual([row['amount_in_pln'] for row in rows], [4445, -1000])
+        self.assertEqual([row['target_currency'] for row in rows], ["EUR", "EUR"])
+        self.assertEqual([row['amount_in_target_currency'] for row in rows], [953, -214])
+
+    def test_pln_target_currency(self):
+        """
+        Reports in PLN (the default target currency) have no target currency fields.
+        """
+        url = reverse('report_api:customer-report', args=[1])
+        response = self.client.post(url + "?target_currency=PLN", data=self.data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(response.json()[0]), list(PaymentRecord.fields))
+
+    def test_saved_report_in_target_currency(self):
+        """
+        Saved converted report is returned with its target currency fields, also as csv.
+        """
+        url = reverse('report_api:customer-report', args=[1])
+        response = self.client.post(url + "?target_currency=GBP", data=self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.client.get(url).json(), response.json())
+        csv_response = self.client.get(url, HTTP_ACCEPT="text/csv")
+        self.assertEqual(b"".join(csv_response.streaming_content).decode().splitlines()[:2], [
+            'date,type,payment_mean,description,amount,currency,amount_in_pln,'
+            'target_currency,amount_in_target_currency',
+            '2022-03-21T08:32:11.370518Z,dp,PLNOA123435467887653,Restaurant,1000,USD,4445,GBP,827',
+        ])
+
+    def test_unsupported_target_currency(self):
+        """
+        Unsupported target currency is rejected with 400.
+        """
+        response = self.client.post(reverse('report_api:report') + "?target_currency=JPY",
+                                    data=self.data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('target_currency', response.json())
+
+    def test_conversion_is_exact(self):
+        """
+        Converted amounts do not depend on the floating point errors.
+        """
+        self.assertEqual(convert2PLN(100, "GBP", {"GBP": 0.29}), 29)
+
+
+class RetentionTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the retention policy of the saved reports.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+
+    def save_report(self, customer_id, size, accessed_days_ago):
+        report = Report(customer_id=customer_id, content=b'["' + b"x" * (size - 4) + b'"]',
+                        last_accessed=timezone.now() - timedelta(days=accessed_days_ago))
+        report.save()
+        return report
+
+    def test_report_access_is_tracked(self):
+        """
+        Reading a saved report updates its last access time, at most once per the tracking resolution.
+        """
+        self.save_report(1, 10, accessed_days_ago=2)
+        url = reverse('report_api:customer-report', args=[1])
+
+        self.client.get(url, HTTP_ACCEPT="application/x-ndjson")
+        last_accessed = Report.objects.using(shard_for(1)).get(pk=1).last_accessed
+        self.assertLess(timezone.now() - last_accessed, timedelta(minutes=1))
+
+        self.client.get(url, HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(Report.objects.using(shard_for(1)).get(pk=1).last_accessed, last_accessed)
+        self.assertEqual(Report.objects.using(shard_for(1)).get(pk=1).size, 10)
+
+    def test_prune_by_age(self):
+        """
+        'manage.py prune_reports --max-age' deletes the reports not accessed for the given number of days.
+        """
+        for customer_id, days in enumerate([1, 10, 20, 30], start=1):
+            self.save_report(customer_id, 100, accessed_days_ago=days)
+
+        out = StringIO()
+        call_command('prune_reports', max_age=15, batch_size=1, no_vacuum=True, stdout=out)
+
+        self.assertIn("Deleted 2 reports (200 bytes)", out.getvalue())
+        self.assertEqual(saved_customer_ids(), [1, 2])
+
+    def test_prune_to_budget(self):
+        """
+        'manage.py prune_reports --max-size' deletes the least recently accessed reports until the rest fits the budget.
+        """
+        for customer_id, days in enumerate([5, 1, 4, 2, 3], start=1):
+            self.save_report(customer_id, 100, accessed_days_ago=days)
+
+        out = StringIO()
+        call_command('prune_reports', max_size=250, batch_size=2, dry_run=True, stdout=out)
+        self.assertIn("Would delete 3 reports (300 bytes)", out.getvalue())
+        self.assertEqual(count_in_shards(Report), 5)
+
+        call_command('prune_reports', max_size=250, batch_size=2, no_vacuum=True, stdout=out)
+        self.assertEqual(saved_customer_ids(), [2, 4])
+
+    def test_nothing_to_prune(self):
+        """
+        'manage.py prune_reports' requires a limit.
+        """
+        with override_settings(UPLOAD_SESSION_MAX_AGE_DAYS=None), self.assertRaises(CommandError):
+            call_command('prune_reports', stdout=StringIO())
+
+
+class SavedReportCacheTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the read-through cache of the saved reports.
+    """
+    databases = '__all__'
+    data = ExportFormatTests.data
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+
+    def test_hot_reads_served_from_cache(self):
+        """
+        Saved report is read from the database once, then served from the cache without any query.
+        """
+        Report(customer_id=1, content=b'[]').save()
+        url = reverse('report_api:customer-report', args=[1])
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0, using=shard_for(1)):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.content, b'[]')
+        self.assertEqual(saved_report_cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_saving_replaces_cached_report(self):
+        """
+        Saving report replaces the cached one, and the saved report is cached once it is committed.
+        """
+        url = reverse('report_api:customer-report', args=[1])
+        Report(customer_id=1, content=b'[]').save()
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(using=shard_for(1), execute=True):
+            post_response = self.client.post(url, data=self.data, format='json')
+
+        with self.assertNumQueries(0, using=shard_for(1)):
+            get_response = self.client.get(url)
+        self.assertEqual(get_response['X-Cache'], 'HIT')
+        self.assertEqual(get_response.content, post_response.content)
+
+    def test_saved_report_not_stale_in_other_workers(self):
+        """
+        Report saved by one worker process replaces the report cached by the other workers.
+        """
+        url = reverse('report_api:customer-report', args=[1])
+        Report(customer_id=1, content=b'[]').save()
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(using=shard_for(1), execute=True):
+            post_response = self.client.post(url, data=self.data, format='json')
+
+        other_worker_cache = caches.create_connection(settings.SAVED_REPORT_CACHE)
+        content, _, _ = other_worker_cache.get(SavedReportCache.make_key(1))
+        self.assertEqual(content, post_response.content)
+
+    def save_report(self, customer_id):
+        """Save report of the data (and cache it once it is committed), like a POST racing with a GET."""
+        with self.captureOnCommitCallbacks(using=shard_for(customer_id), execute=True):
+            views.save_report(customer_id, render_json(generate_report(self.data)))
+
+    def test_report_saved_during_cache_miss_not_replaced(self):
+        """
+        Report read from the database by a GET does not replace the report saved and cached in the meantime.
+        """
+        url = reverse('report_api:customer-report', args=[1])
+        Report(customer_id=1, content=b'[]').save()
+
+        with mock.patch('report_api.views.render_report', side_effect=lambda content: (
+                self.save_report(1), render_report(content))[1]):
+            self.assertEqual(self.client.get(url).content, b'[]')
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.content, render_json(generate_report(self.data)))
+
+    def test_report_saved_while_caching_miss_not_served(self):
+        """
+        Report read from the database by a GET is not served from the cache, even if it replaced the report saved
+        and cached while the GET was caching it (between checking and writing its version).
+        """
+        url = reverse('report_api:customer-report', args=[1])
+        Report(customer_id=1, content=b'[]').save()
+        cache = saved_report_cache.cache
+        set_many = cache.set_many
+
+        with mock.patch.object(cache, 'set_many', side_effect=lambda *args: (self.save_report(1), set_many(*args))):
+            self.assertEqual(self.client.get(url).content, b'[]')
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.content, render_json(generate_report(self.data)))
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    @override_settings(SAVED_REPORT_CACHE_STATS_INTERVAL=2)
+    def test_stats_logged(self):
+        """
+        Hit and miss counts are logged every SAVED_REPORT_CACHE_STATS_INTERVAL lookups.
+        """
+        Report(customer_id=1, content=b'[]').save()
+        url = reverse('report_api:customer-report', args=[1])
+
+        with self.assertLogs('report_api.cache', 'INFO') as logs:
+            self.client.get(url)
+            self.client.get(url)
+            self.client.get(url)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("1 hits, 1 misses, hit ratio 0.500", logs.output[0])
+
+    def test_large_reports_not_cached(self):
+        """
+        Reports larger than SAVED_REPORT_CACHE_MAX_ITEM_SIZE are always read from the database.
+        """
+        Report(customer_id=1, content=b'[]').save()
+        url = reverse('report_api:customer-report', args=[1])
+
+        with override_settings(SAVED_REPORT_CACHE_MAX_ITEM_SIZE=1):
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_pruned_reports_removed_from_cache(self):
+        """
+        Reports deleted by the retention policy are not served from the cache.
+        """
+        Report(customer_id=1, content=b'[]', last_accessed=timezone.now() - timedelta(days=10)).save()
+        url = reverse('report_api:customer-report', args=[1])
+        self.client.get(url)
+
+        call_command('prune_reports', max_size=0, no_vacuum=True, stdout=StringIO())
+
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class UploadSessionTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the reports uploaded in many chunks.
+    """
+    databases = '__all__'
+    chunks = [
+        {"dp": [
+            {"created_at": "2022-04-21T21:34:11.370518+01:00", "currency": "PLN", "amount": 2200,
+             "description": "Toy Store", "iban": "GERSXOA86756435435465468"},
+            {"created_at": "2022-03-21T11:32:11.370518+03:00", "currency": "PLN", "amount": 31700,
+             "description": "Restaurant", "iban": "PLNOA123435467887653"},
+        ]},
+        {"pay_by_link": [
+            {"created_at": "2022-04-01T12:00:00+00:00", "currency": "PLN", "amount": 1000,
+             "description": "Gym", "bank": "mbank"},
+        ], "dp": [
+            {"created_at": "2022-01-01T12:00:00+00:00", "currency": "PLN", "amount": 500,
+             "description": "Books", "iban": "PLNOA123435467887653"},
+        ]},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+
+    def open_session(self, customer_id=1):
+        response = self.client.post(reverse('report_api:upload-sessions', args=[customer_id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['session']
+
+    def put_chunk(self, session, number, data, customer_id=1):
+        return self.client.put(reverse('report_api:upload-chunk', args=[customer_id, session, number]),
+                               data=data, format='json')
+
+    def test_upload_in_chunks(self):
+        """
+        Committed session merges the sorted chunks into the report saved for the customer.
+        """
+        session = self.open_session()
+        for number, chunk in enumerate(self.chunks, start=1):
+            self.assertEqual(self.put_chunk(session, number, chunk).status_code, status.HTTP_201_CREATED)
+
+        commit_response = self.client.post(reverse('report_api:upload-commit', args=[1, session]))
+        self.assertEqual(commit_response.status_code, status.HTTP_201_CREATED)
+
+        all_payments = {"dp": self.chunks[0]["dp"] + self.chunks[1]["dp"], "pay_by_link": self.chunks[1]["pay_by_link"]}
+        report_response = self.client.post(reverse('report_api:report'), data=all_payments, format='json')
+        self.assertEqual(commit_response.json(), report_response.json())
+
+        self.assertEqual(self.client.get(reverse('report_api:customer-report', args=[1])).json(),
+                         commit_response.json())
+        self.assertEqual(self.client.get(reverse('report_api:upload-session', args=[1, session])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_commit_admitted_with_rows_of_chunks(self):
+        """
+        Commit (with an empty body) is admitted with the number of rows of all the uploaded chunks.
+        """
+        session = self.open_session()
+        for number, chunk in enumerate(self.chunks, start=1):
+            self.put_chunk(session, number, chunk)
+        commit_url = reverse('report_api:upload-commit', args=[1, session])
+
+        ticket = get_admission_controller().admit("10.0.0.1", 2)
+        try:
+            with override_settings(REPORT_ADMISSION_MAX_INFLIGHT_ROWS=5, REPORT_ADMISSION_QUEUE_TIMEOUT=0):
+                rejected_response = self.client.post(commit_url)
+            with override_settings(REPORT_ADMISSION_MAX_INFLIGHT_ROWS=6, REPORT_ADMISSION_QUEUE_TIMEOUT=0):
+                admitted_response = self.client.post(commit_url)
+        finally:
+            get_admission_controller().release(ticket)
+
+        self.assertEqual(rejected_response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(admitted_response.status_code, status.HTTP_201_CREATED)
+
+    def test_retried_chunk_is_idempotent(self):
+        """
+        Chunk sent again with the same content is not processed again.
+        """
+        session = self.open_session()
+        self.assertEqual(self.put_chunk(session, 1, self.chunks[0]).status_code, status.HTTP_201_CREATED)
+
+        with mock.patch('report_api.views.generate_report') as generate_report:
+            response = self.put_chunk(session, 1, self.chunks[0])
+            generate_report.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'chunk': 1, 'rows': 2})
+
+    def test_invalid_chunk_is_not_stored(self):
+        """
+        Invalid chunk is rejected with 400, and only the valid chunks are listed in the session.
+        """
+        session = self.open_session()
+        self.put_chunk(session, 1, self.chunks[0])
+
+        invalid_chunk = deepcopy(self.chunks[1])
+        invalid_chunk["dp"][0]["created_at"] = "3000-05-13T19:12:02.370518+02:00"
+        self.assertEqual(self.put_chunk(session, 2, invalid_chunk).status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('report_api:upload-session', args=[1, session]))
+        self.assertEqual(response.data['chunks'], [{'chunk': 1, 'rows': 2}])
+
+    def test_session_of_other_customer(self):
+        """
+        Session can only be used for the customer it was opened for.
+        """
+        session = self.open_session(customer_id=1)
+
+        self.assertEqual(self.put_chunk(session, 1, self.chunks[0], customer_id=2).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_abandoned_sessions_pruned(self):
+        """
+        'manage.py prune_reports' deletes sessions opened too long ago.
+        """
+        session = self.open_session()
+        self.put_chunk(session, 1, self.chunks[0])
+        UploadSession.objects.using(shard_for(1)).update(created_at=timezone.now() - timedelta(days=10))
+
+        call_command('prune_reports', session_max_age=7, no_vacuum=True, stdout=StringIO())
+
+        self.assertEqual(count_in_shards(UploadSession), 0)
+        self.assertEqual(count_in_shards(UploadChunk), 0)
+
+    def test_commit_without_all_chunks_rejected(self):
+        """
+        Commit of a session without chunks, or with some of them missing, is rejected with 400
+        and does not replace the saved report.
+        """
+        self.client.post(reverse('report_api:customer-report', args=[1]), data=self.chunks[0], format='json')
+        saved_report = self.client.get(reverse('report_api:customer-report', args=[1])).content
+
+        session = self.open_session()
+        response = self.client.post(reverse('report_api:upload-commit', args=[1, session]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'chunks': ["No chunks were uploaded."]})
+
+        self.put_chunk(session, 1, self.chunks[0])
+        self.put_chunk(session, 3, self.chunks[1])
+        response = self.client.post(reverse('report_api:upload-commit', args=[1, session]))
+        self.assertEqual(response.json(), {'chunks': ["Missing chunks: 2."]})
+
+        self.assertEqual(self.put_chunk(session, 0, self.chunks[1]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('report_api:customer-report', args=[1])).content, saved_report)
+
+
+class AnalyticsTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the payment totals across the saved reports of all the customers.
+    """
+    databases = '__all__'
+    url = reverse('report_api:analytics')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        for customer_id, chunk in enumerate(UploadSessionTests.chunks, start=1):
+            self.client.post(reverse('report_api:customer-report', args=[customer_id]), data=chunk, format='json')
+
+    def test_totals_per_day(self):
+        """
+        Totals are grouped by day by default, in a single query per shard.
+        """
+        with ExitStack() as stack:
+            for shard in get_shards():
+                stack.enter_context(self.assertNumQueries(1, using=shard))
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {"day": "2022-01-01", "payments": 1, "total_amount_in_pln": 500},
+            {"day": "2022-03-21", "payments": 1, "total_amount_in_pln": 31700},
+            {"day": "2022-04-01", "payments": 1, "total_amount_in_pln": 1000},
+            {"day": "2022-04-21", "payments": 1, "total_amount_in_pln": 2200},
+        ])
+
+    def test_totals_per_type_in_date_range(self):
+        """
+        Totals can be grouped by several fields, for a range of days.
+        """
+        response = self.client.get(self.url, {'group_by': 'type,currency',
+                                              'date_from': '2022-02-01', 'date_to': '2022-04-01'})
+
+        self.assertEqual(response.json(), [
+            {"type": "dp", "currency": "PLN", "payments": 1, "total_amount_in_pln": 31700},
+            {"type": "pay_by_link", "currency": "PLN", "payments": 1, "total_amount_in_pln": 1000},
+        ])
+
+    def test_saving_replaces_customer_rows(self):
+        """
+        Rows of the replaced report are not counted.
+        """
+        self.client.post(reverse('report_api:customer-report', args=[1]), data={"dp": []}, format='json')
+
+        response = self.client.get(self.url, {'group_by': ''})
+        self.assertEqual(response.json(), [{"payments": 2, "total_amount_in_pln": 1500}])
+
+    def test_rows_indexed_from_generated_records(self):
+        """
+        Rows of a generated report are indexed (and stored) from its records, without parsing the rendered json,
+        with the same UTC days as the rows of a report taken from the report cache.
+        """
+        data = {"dp": [{"created_at": "2022-05-01T01:00:00+02:00", "currency": "PLN", "amount": 700,
+                        "description": "Night", "iban": "PLNOA123435467887653"}]}
+
+        report_cache.clear()
+        with mock.patch('report_api.views.parse_json', wraps=views.parse_json) as parse_json:
+            self.client.post(reverse('report_api:customer-report', args=[10]), data=data, format='json')
+            self.assertEqual(parse_json.call_count, 0)
+
+            self.client.post(reverse('report_api:customer-report', args=[11]), data=data, format='json')
+            self.assertEqual(parse_json.call_count, 1)
+
+        response = self.client.get(self.url, {'date_from': '2022-04-30', 'date_to': '2022-05-01'})
+        self.assertEqual(response.json(), [{"day": "2022-04-30", "payments": 2, "total_amount_in_pln": 1400}])
+
+    def test_invalid_parameters(self):
+        """
+        Unknown group_by fields and malformed dates are rejected with 400.
+        """
+        response = self.client.get(self.url, {'group_by': 'day,customer', 'date_from': '2022-13-01'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()), {'group_by', 'date_from'})
+
+    def test_admin_only(self):
+        """
+        Analytics are available to the admin users only.
+        """
+        self.client.force_authenticate(User.objects.create_user('customer', 'customer@example.com', 'password'))
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ShardingTests(TemporarySavedReportCacheMixin, TestCase):
+    """
+    Class for testing the sharding of the per-customer tables.
+    """
+    databases = '__all__'
+
+    def test_customers_spread_over_shards(self):
+        """
+        Customers are spread evenly over the shards, and adding a shard only moves customers to the new shard.
+        """
+        customer_ids = range(1, 10001)
+        buckets = {customer_id: jump_hash(customer_id, 4) for customer_id in customer_ids}
+
+        counts = Counter(buckets.values())
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertTrue(all(2000 < count < 3000 for count in counts.values()))
+
+        for customer_id in customer_ids:
+            bucket = jump_hash(customer_id, 5)
+            self.assertIn(bucket, (buckets[customer_id], 4))
+
+    def test_tables_migrated_to_shards(self):
+        """
+        Sharded tables are only migrated to the shards, the other tables only to the default database.
+        """
+        router = ReportShardRouter()
+
+        with override_settings(REPORT_SHARDS=['reports_0', 'reports_1']):
+            self.assertTrue(router.allow_migrate('reports_1', 'report_api', 'report'))
+            self.assertFalse(router.allow_migrate('default', 'report_api', 'uploadchunk'))
+            self.assertFalse(router.allow_migrate('reports_0', 'report_api', 'exchangerate'))
+            self.assertIsNone(router.allow_migrate('default', 'auth', 'user'))
+
+    def test_instances_routed_to_customer_shard(self):
+        """
+        Saved reports are written to the shard of their customer.
+        """
+        report = Report(customer_id=12345, content=b'[]')
+        report.save()
+
+        self.assertEqual(report._state.db, shard_for(12345))
+
+    def test_reshard_reports(self):
+        """
+        'manage.py reshard_reports' moves the reports (with their rows) to the shards of their customers,
+        after a third shard is added.
+        """
+        with temporary_shards(['reshard_0', 'reshard_1', 'reshard_2']) as shards:
+            with override_settings(REPORT_SHARDS=shards[:-1]):
+                for customer_id in range(1, 31):
+                    views.save_report(customer_id, render_json(generate_report(UploadSessionTests.chunks[0])))
+            self.assertEqual(Report.objects.using(shards[-1]).count(), 0)
+
+            call_command('reshard_reports', batch_size=4, stdout=StringIO())
+
+            for shard in shards:
+                stored_ids = Report.objects.using(shard).values_list('customer_id', flat=True)
+                self.assertTrue(stored_ids)
+                self.assertTrue(all(shard_for(customer_id) == shard for customer_id in stored_ids))
+                self.assertEqual(ReportPayment.objects.using(shard).count(), 2 * len(stored_ids))
+            self.assertEqual(saved_customer_ids(), list(range(1, 31)))
+
+
+class MemoryBudgetTests(TemporarySavedReportCacheMixin, TestCase):
+    """
+    Class for testing the peak memory allocated per report row on the report paths (see benchmarks.memory_budget),
+    for the report sizes of settings.REPORT_MEMORY_BUDGET_ROWS.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+
+    def test_report_paths_within_memory_budget(self):
+        """
+        Generating, serializing, saving and retrieving a report allocate at most the budget of the path per row.
+        """
+        for rows in settings.REPORT_MEMORY_BUDGET_ROWS:
+            with self.subTest(rows=rows):
+                measured = measure_paths(rows, self.client)
+
+                self.assertEqual(set(measured), set(MEMORY_BUDGETS))
+                self.assertEqual(over_budget(measured), {}, f"peak memory per row over budget for {rows} rows")
+
+    def test_memory_budgets_configurable(self):
+        """
+        Budgets of the paths can be overridden with the REPORT_MEMORY_BUDGETS setting.
+        """
+        measured = {'generate_report': 500, 'report_view': 500}
+
+        with override_settings(REPORT_MEMORY_BUDGETS={'generate_report': 400}):
+            self.assertEqual(over_budget(measured), {'generate_report': (500, 400)})
+
+
+class StorageCompactionTests(TemporarySavedReportCacheMixin, TransactionTestCase):
+    """
+    Class for testing the compaction of the database after pruning (VACUUM cannot run in a transaction).
+    """
+    databases = '__all__'
+
+    def test_prune_compacts_database(self):
+        """
+        Pages freed by the deleted reports are given back with incremental vacuum.
+        """
+        for customer_id in range(1, 51):
+            Report(customer_id=customer_id, content=os.urandom(10000)).save()
+
+        out = StringIO()
+        call_command('prune_reports', max_size=0, stdout=out)
+
+        self.assertEqual(count_in_shards(Report), 0)
+        freed_pages = sum(int(line.split()[1]) for line in out.getvalue().splitlines() if line.startswith("Freed "))
+        self.assertGreater(freed_pages, 0)
+
+
+@override_settings(MIDDLEWARE=settings_lean.MIDDLEWARE, ROOT_URLCONF=settings_lean.ROOT_URLCONF,
+                   REST_FRAMEWORK=settings_lean.REST_FRAMEWORK)
+class LeanProfileTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the report endpoints served with the middleware, URL configuration and (unauthenticated)
+    api settings of the lean deployment profile (PaymentReportAPI.settings_lean).
+    """
+    databases = '__all__'
+    data = ExportFormatTests.data
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+
+    def test_reports_served(self):
+        """
+        Reports are generated, saved and retrieved the same way as with the default profile.
+        """
+        customer_url = reverse('report_api:customer-report', kwargs={"pk": 1})
+
+        report_response = self.client.post(reverse('report_api:report'), data=self.data, format='json')
+        save_response = self.client.post(customer_url, data=self.data, format='json')
+        get_response = self.client.get(customer_url)
+
+        self.assertEqual(report_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(save_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_response.content, report_response.content)
+
+    def test_only_report_api_served(self):
+        """
+        There is no admin, and the admin-only analytics are not accessible without the users.
+        """
+        self.assertEqual(self.client.get('/admin/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('report_api:analytics')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class NBPStubTests(TestCase):
+    """
+    Class for testing the rates fetched from a local stand-in of the api.nbp.pl (configured with NBP_API_URL).
+    """
+
+    def start_stub(self, **kwargs):
+        server = make_server(port=0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_port}/api"
+
+    def test_rates_fetched_from_configured_api_url(self):
+        """
+        Rates are fetched from the api at NBP_API_URL.
+        """
+        with override_settings(NBP_API_URL=self.start_stub(rates={"EUR": 4.0, "USD": 3.0, "GBP": 5.0})):
+            self.assertEqual(refresh_rates(), {"EUR": 4.0, "USD": 3.0, "GBP": 5.0})
+            self.assertEqual(convert2PLN(1000, "USD"), 3000)
+
+    def test_rates_api_errors(self):
+        """
+        Errors of the api at NBP_API_URL are reported as ServiceUnavailable.
+        """
+        with override_settings(NBP_API_URL=self.start_stub(error_rate=1.0)):
+            with self.assertRaises(ServiceUnavailable):
+                refresh_rates()
+
+    def test_rates_api_timeout(self):
+        """
+        Api at NBP_API_URL not responding within NBP_API_TIMEOUT seconds is reported as ServiceUnavailable.
+        """
+        with override_settings(NBP_API_URL=self.start_stub(latency=1.0), NBP_API_TIMEOUT=0.1):
+            started = time.monotonic()
+            with self.assertRaises(ServiceUnavailable):
+                refresh_rates()
+            self.assertLess(time.monotonic() - started, 1.0)
+
+
+class ReportStorageTests(TemporarySavedReportCacheMixin, APITestCase):
+    """
+    Class for testing the columnar storage format of the saved reports, and the rows and fields of the saved reports
+    requested with the query parameters.
+    """
+    databases = '__all__'
+    data = ExportFormatTests.data
+
+    def setUp(self):
+        super().setUp()
+        saved_report_cache.clear()
+        ExchangeRate.objects.create(currency="EUR", mid=4.5, fetched_at=timezone.now())
+        self.url = reverse('report_api:customer-report', args=[1])
+        with self.captureOnCommitCallbacks(using=shard_for(1), execute=True):
+            self.rendered_report = self.client.post(self.url, data=self.data, format='json').content
+        saved_report_cache.clear()
+
+    def test_round_trip(self):
+        """
+        Report rows (records or their dicts) are decoded as they were encoded, and rendered as the same json.
+        """
+        report = generate_report(self.data)
+        content = encode_report(report)
+
+        self.assertTrue(is_columnar(content))
+        self.assertEqual(decode_report(content), [record_to_dict(record) for record in report])
+        self.assertEqual(encode_report(json.loads(render_json(report))), content)
+        self.assertEqual(render_report(content), render_json(report))
+        self.assertEqual(render_report(encode_report([])), b'[]')
+        self.assertEqual(decode_report(content, fields=[]), decode_report(render_report(content), fields=[]))
+
+    def test_round_trip_of_converted_report(self):
+        """
+        Target currency fields of the converted reports are stored.
+        """
+        report = generate_report(self.data, target_currency='EUR')
+        self.assertEqual(render_report(encode_report(report)), render_json(report))
+
+    def test_saved_report_is_columnar_and_smaller(self):
+        """
+        Saved report is stored in the columnar format, smaller than its json.
+        """
+        data = {"dp": self.data["dp"] * 500}
+        with self.captureOnCommitCallbacks(using=shard_for(1), execute=True):
+            rendered_report = self.client.post(self.url, data=data, format='json').content
+        saved_report_cache.clear()
+
+        report = Report.objects.using(shard_for(1)).get(customer_id=1)
+        self.assertTrue(is_columnar(report.content))
+        self.assertEqual(report.size, len(report.content))
+        self.assertLess(report.size, len(rendered_report) / 4)
+        self.assertEqual(self.client.get(self.url).content, rendered_report)
+
+    def test_json_report_still_served(self):
+        """
+        Report saved as json (before the columnar format) is served as it is, and filtered.
+        """
+        Report.objects.using(shard_for(1)).filter(customer_id=1).update(content=self.rendered_report)
+
+        self.assertEqual(self.client.get(self.url).content, self.rendered_report)
+        response = self.client.get(self.url, {'date_from': '2022-04-01', 'fields': 'date,amount'})
+        self.assertEqual(response.json(), [{'date': '2022-04-21T20:34:11.370518Z', 'amount': 2200}])
+
+    def test_migration_converts_json_reports(self):
+        """
+        The 0006 migration converts the reports saved as json to the storage format, and back when it is reverted.
+        """
+        migration = import_module('report_api.migrations.0006_columnar_reports')
+        schema_editor = SimpleNamespace(connection=connections[shard_for(1)])
+        reports = Report.objects.using(shard_for(1))
+        reports.filter(customer_id=1).update(content=self.rendered_report)
+
+        migration.json_to_columnar(django_apps, schema_editor)
+        content = bytes(reports.get(customer_id=1).content)
+        self.assertTrue(is_columnar(content))
+        self.assertEqual(render_report(content), self.rendered_report)
+
+        migration.columnar_to_json(django_apps, schema_editor)
+        self.assertEqual(bytes(reports.get(customer_id=1).content), self.rendered_report)
+
+    def test_rows_in_date_range(self):
+        """
+        Only the rows with the dates from 'date_from' to 'date_to' (inclusive) are returned.
+        """
+        response = self.client.get(self.url, {'date_from': '2022-03-21', 'date_to': '2022-03-21'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), json.loads(self.rendered_report)[:1])
+
+        response = self.client.get(self.url, {'date_from': '2022-03-22'})
+        self.assertEqual(response.json(), json.loads(self.rendered_report)[1:])
+
+        response = self.client.get(self.url, {'date_to': '2022-03-20'})
+        self.assertEqual(response.json(), [])
+
+    def test_fields_and_pagination(self):
+        """
+        Only the requested fields of the rows from 'offset' (at most 'limit' of them) are returned.
+        """
+        response = self.client.get(self.url, {'fields': 'amount,date', 'offset': 1, 'limit': 5})
+        self.assertEqual(response.json(), [{'date': '2022-04-21T20:34:11.370518Z', 'amount': 2200}])
+
+        response = self.client.get(self.url, {'limit': 1})
+        self.assertEqual(response.json(), json.loads(self.rendered_report)[:1])
+
+    def test_fields_as_csv(self):
+        """
+        Csv of the requested fields has only their columns.
+        """
+        response = self.client.get(self.url, {'fields': 'date,amount'}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(b"".join(response.streaming_content).decode(),
+                         'date,amount\r\n2022-03-21T08:32:11.370518Z,31700\r\n2022-04-21T20:34:11.370518Z,2200\r\n')
+
+    def test_streamed_without_parsing_json(self):
+        """
+        Saved report streamed on a cache miss is decoded straight to its rows, and it is cached as json.
+        """
+        with mock.patch('report_api.views.parse_json') as parse_json:
+            response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+            parse_json.assert_not_called()
+
+        self.assertEqual(b"".join(response.streaming_content).decode(), ExportFormatTests.expected_csv)
+        self.assertEqual(saved_report_cache.get(1)[0], self.rendered_report)
+
+    def test_streamed_too_large_to_cache_not_rendered(self):
+        """
+        Saved report streamed on a cache miss is not rendered as json if it is too large to be cached.
+        """
+        with override_settings(SAVED_REPORT_CACHE_MAX_ITEM_SIZE=Report.objects.using(shard_for(1)).get().size - 1), \
+                mock.patch('report_api.views.render_json') as render_json:
+            response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+            render_json.assert_not_called()
+
+        self.assertEqual(b"".join(response.streaming_content).decode(), ExportFormatTests.expected_csv)
+        self.assertIsNone(saved_report_cache.get(1))
+
+    def test_invalid_parameters(self):
+        """
+        Invalid query parameters are rejected with 400.
+        """
+        for params in ({'date_from': '21.03.2022'}, {'fields': 'date,iban'}, {'fields': ''}, {'fields': ','},
+                       {'offset': -1}, {'limit': 'all'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn(next(iter(params)), response.json())
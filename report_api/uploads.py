@@ -0,0 +1,122 @@
+"""
+Reports uploaded in many chunks (upload sessions).
+
+A session is opened for a customer, then the payments are sent in any number of chunks (in the same format
+as the report request data). Every chunk is validated and converted on arrival and stored as a sorted run
+(json of the chunk's report rows sorted by date), so a failed chunk is the only one that has to be sent again,
+and a retried chunk with the same content is not processed again. Committing the session merges the sorted runs
+(in the chunk number order, so rows with equal dates keep the order of the chunks) into the customer's report.
+Chunks are numbered from 1, and a session is committed only if none of the chunks up to the last one is missing,
+so a stray or replayed commit never replaces the customer's report with an empty or partial one.
+"""
+import hashlib
+import heapq
+from operator import attrgetter
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import canonical_json
+from .models import UploadChunk, UploadSession
+from .parsers import parse_json
+from .records import record_from_dict
+from .renderers import render_json
+from .routers import get_shards, shard_for
+
+
+def chunk_digest(data):
+    """Get digest of the received chunk data (equal for equal data, regardless of key order and whitespace)."""
+    try:
+        return hashlib.sha256(canonical_json(data)).hexdigest()
+    except TypeError:
+        return ''
+
+
+def find_chunk(session, number, digest):
+    """Get already stored chunk with the same content (e.g. sent again after a failure), or None."""
+    if not digest:
+        return None
+    return (UploadChunk.objects.using(session._state.db).filter(session=session, number=number, digest=digest)
+            .defer('content').first())
+
+
+def store_chunk(session, number, digest, report):
+    """
+    Store generated report of the chunk as a sorted run, replacing the chunk stored earlier with the same number.
+    :return: tuple (chunk, created)
+    """
+    return UploadChunk.objects.using(session._state.db).update_or_create(session=session, number=number,
+                                                                         defaults={'digest': digest,
+                                                                                   'row_count': len(report),
+                                                                                   'content': render_json(report)})
+
+
+def count_session_rows(customer_id, session_id):
+    """Count rows of all the chunks uploaded in the session of the customer (0 if there is no such session)."""
+    chunks = UploadChunk.objects.using(shard_for(customer_id)).filter(session_id=session_id,
+                                                                      session__customer_id=customer_id)
+    return chunks.aggregate(rows=Sum('row_count'))['rows'] or 0
+
+
+def check_chunks(session):
+    """
+    Check that the session has all the chunks numbered from 1 to the last one.
+    :raise ValidationError: if there are no chunks, or some of them are missing
+    """
+    numbers = set(session.chunks.values_list('number', flat=True))
+    if not numbers:
+        raise ValidationError({'chunks': ["No chunks were uploaded."]})
+
+    missing = sorted(set(range(1, max(numbers) + 1)) - numbers)
+    if missing:
+        raise ValidationError({'chunks': [f"Missing chunks: {', '.join(map(str, missing))}."]})
+
+
+def merge_chunks(session):
+    """
+    Merge sorted runs of all the chunks of the session.
+    :return: list of payment records sorted by date
+    """
+    runs = [map(record_from_dict, parse_json(bytes(content)))
+            for content in session.chunks.order_by('number').values_list('content', flat=True)]
+
+    # merge is stable, so rows with equal dates from the earlier chunks come first
+    return list(heapq.merge(*runs, key=attrgetter('date')))
+
+
+def commit_session(session, save_report):
+    """
+    Merge the chunks into the report, save it with 'save_report(customer_id, rendered_report, report)'
+    and close the session (in a single transaction).
+    :return: tuple (report, rendered_report)
+    :raise ValidationError: if there are no chunks, or some of them are missing (see check_chunks)
+    """
+    with transaction.atomic(using=session._state.db):
+        check_chunks(session)
+        report = merge_chunks(session)
+        rendered_report = render_json(report)
+        save_report(session.customer_id, rendered_report, report)
+        session.delete()
+
+    return report, rendered_report
+
+
+def prune_upload_sessions(max_age):
+    """
+    Delete sessions (with their chunks) opened longer than 'max_age' (timedelta) ago, each in its own transaction.
+    :return: number of deleted sessions
+    """
+    cutoff = timezone.now() - max_age
+    deleted_count = 0
+
+    for shard in get_shards():
+        sessions = UploadSession.objects.using(shard)
+        session_ids = list(sessions.filter(created_at__lt=cutoff).values_list('id', flat=True))
+        for session_id in session_ids:
+            with transaction.atomic(using=shard):
+                sessions.filter(id=session_id).delete()
+        deleted_count += len(session_ids)
+
+    return deleted_count
@@ -5,5 +5,13 @@ app_name = 'report_api'
 
 urlpatterns = [
     path("report", views.ReportView.as_view(), name="report"),
-    path("customer-report/<int:pk>", views.CustomerReportView.as_view(), name="customer-report")
+    path("customer-report/<int:pk>", views.CustomerReportView.as_view(), name="customer-report"),
+    path("customer-report/<int:pk>/uploads", views.UploadSessionListView.as_view(), name="upload-sessions"),
+    path("customer-report/<int:pk>/uploads/<uuid:session_id>", views.UploadSessionView.as_view(),
+         name="upload-session"),
+    path("customer-report/<int:pk>/uploads/<uuid:session_id>/chunks/<int:number>", views.UploadChunkView.as_view(),
+         name="upload-chunk"),
+    path("customer-report/<int:pk>/uploads/<uuid:session_id>/commit", views.UploadCommitView.as_view(),
+         name="upload-commit"),
+    path("analytics", views.AnalyticsView.as_view(), name="analytics"),
 ]
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""
+Validation of the received payment data.
+
+Payments are validated and normalized into compact PaymentRecord objects (with 'created_at' converted to UTC).
+Huge reports (at least settings.REPORT_PARALLEL_VALIDATION_THRESHOLD payments) are split into chunks
+validated in a pool of worker processes, which send back the records of their chunk sorted by date
+(pickled as plain tuples), and the sorted chunks are merged. Errors are reported exactly like in the sequential
+validation: the first invalid payment (by input position) is reported.
+"""
+import heapq
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from operator import attrgetter
+
+import pytz
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from .exceptions import UnsupportedPaymentType
+from .records import PaymentRecord
+from .serializers import PAY_BY_LINK, DIRECT_PAYMENT, CARD, SERIALIZERS_DICT
+
+DEFAULT_PARALLEL_THRESHOLD = 100000  # in payments
+DEFAULT_PARALLEL_CHUNK_SIZE = 20000  # in payments
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_payment_mean(payment_type, validated_data):
+    """Get 'payment mean' value based on the type of payment"""
+
+    if payment_type == PAY_BY_LINK:
+        return validated_data['bank']
+
+    elif payment_type == DIRECT_PAYMENT:
+        return validated_data['iban']
+
+    elif payment_type == CARD:
+        card_number = validated_data['card_number']
+
+        # mask card_number digits with '*' excluding first 4 and last 4 digits
+        masked_card_number = card_number[:4] + '*' * len(card_number[4:-4]) + card_number[-4:]
+        return "{cardholder_name} {cardholder_surname} {masked_card_number}".format(
+            masked_card_number=masked_card_number,
+            **validated_data)
+
+
+def validate_payments(payment_type, payments):
+    """
+    Validate payments of a single type and normalize them into payment records (without 'amount_in_pln').
+    :return: list of payment records in input order
+    :raise ValidationError: for the first invalid payment
+    """
+    obj_serializer = SERIALIZERS_DICT[payment_type]
+    validated_payments = []
+
+    for obj in payments:
+
+        #  serialize received payment data using serializer for the proper payment type
+        s = obj_serializer(data=obj)
+
+        #  validate serialized payment data or raise 400
+        if not s.is_valid():
+            raise ValidationError(s.errors)
+
+        validated_data = s.validated_data
+        validated_payments.append(PaymentRecord(date=validated_data['created_at'].astimezone(pytz.utc),  # to UTC
+                                                type=payment_type,
+                                                payment_mean=get_payment_mean(payment_type, validated_data),
+                                                description=validated_data['description'],
+                                                amount=validated_data['amount'],
+                                                currency=validated_data['currency'],
+                                                amount_in_pln=None))
+
+    return validated_payments
+
+
+def validate_chunk(payment_type, payments):
+    """
+    Validate chunk of payments in a worker process.
+    :return: tuple (validated_payments sorted by date, errors of the first invalid payment or None)
+    """
+    try:
+        validated_payments = validate_payments(payment_type, payments)
+    except ValidationError as e:
+        return None, e.detail
+
+    validated_payments.sort(key=attrgetter('date'))
+    return validated_payments, None
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def get_workers():
+    return getattr(settings, 'REPORT_PARALLEL_VALIDATION_WORKERS', None) or os.cpu_count() or 1
+
+
+def get_executor():
+    """Get the pool of validation worker processes, shared by all requests handled by this process."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            # spawned (not forked) workers, as forking a multithreaded server process is not safe
+            _executor = ProcessPoolExecutor(max_workers=get_workers(), mp_context=get_context('spawn'),
+                                            initializer=init_worker)
+        return _executor
+
+
+def reset_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def validate_sequential(data, payment_types):
+    validated_payments = []
+
+    for payment_type in payment_types:
+        validated_payments.extend(validate_payments(payment_type, data[payment_type]))
+
+    # sort validated payment data by 'created_at' value (stable, so equal dates keep the input order)
+    validated_payments.sort(key=attrgetter('date'))
+    return validated_payments
+
+
+def validate_parallel(data, payment_types):
+    chunk_size = getattr(settings, 'REPORT_PARALLEL_VALIDATION_CHUNK_SIZE', DEFAULT_PARALLEL_CHUNK_SIZE)
+    executor = get_executor()
+    futures = []
+
+    for payment_type in payment_types:
+        payments = data[payment_type]
+        for start in range(0, len(payments), chunk_size):
+            futures.append(executor.submit(validate_chunk, payment_type, payments[start:start + chunk_size]))
+
+    # chunks are checked in input order, so the first invalid payment by input position is reported
+    sorted_chunks = []
+    for future in futures:
+        validated_payments, errors = future.result()
+        if errors is not None:
+            for pending in futures:
+                pending.cancel()
+            raise ValidationError(errors)
+        sorted_chunks.append(validated_payments)
+
+    # merge is stable, so records with equal dates from earlier chunks (earlier input positions) come first
+    return list(heapq.merge(*sorted_chunks, key=attrgetter('date')))
+
+
+def validate_report_data(data):
+    """
+    Validate received payment data of all types.
+    :param data: Parsed received data (e.g from request.data)
+    :return: list of payment records sorted by date (payments with equal dates are kept in input order)
+    :raise ValidationError: for the first invalid payment
+    :raise UnsupportedPaymentType: for the first unsupported payment type, if all payments before it are valid
+    """
+    payment_types = []
+    unsupported = False
+
+    for payment_type in data:
+        if payment_type not in SERIALIZERS_DICT:
+            unsupported = True
+            break
+        payment_types.append(payment_type)
+
+    payment_count = sum(len(data[payment_type]) for payment_type in payment_types)
+    threshold = getattr(settings, 'REPORT_PARALLEL_VALIDATION_THRESHOLD', DEFAULT_PARALLEL_THRESHOLD)
+
+    if threshold and payment_count >= threshold and get_workers() > 1 \
+            and all(isinstance(data[payment_type], list) for payment_type in payment_types):
+        try:
+            validated_payments = validate_parallel(data, payment_types)
+        except BrokenProcessPool:
+            reset_executor()
+            validated_payments = validate_sequential(data, payment_types)
+    else:
+        validated_payments = validate_sequential(data, payment_types)
+
+    if unsupported:
+        raise UnsupportedPaymentType()
+
+    return validated_payments
@@ -1,168 +1,545 @@
+from datetime import datetime, time, timedelta
+
+import pytz
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.permissions import IsAdminUser
+from rest_framework.throttling import BaseThrottle
 from rest_framework import status
 from .serializers import *
-from rest_framework.exceptions import APIException, ValidationError
-from django.http import Http404
-from .models import Report
+from rest_framework.exceptions import ValidationError
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from .analytics import GROUP_BY_FIELDS, aggregate_payments, index_report
+from .admission import count_rows, estimate_rows, get_admission_controller
+from .cache import report_cache, report_cache_key, saved_report_cache
+from .compression import compress_response
+from .conversion import PLN, conversion_ratio, convert_amount
+from .models import Report, UploadSession
+from .parsers import FastJSONParser, MessagePackParser, msgpack, parse_json
+from .rates import FOREIGN_CURRENCIES, get_rate, get_stored_rates
+from .records import ConvertedPaymentRecord, PaymentRecord
+from .retention import touch_report
+from .routers import shard_for
+from .storage import decode_report, encode_report, is_columnar, render_report
+from .renderers import (CSVRenderer, FastJSONRenderer, MessagePackRenderer, NDJSONRenderer, StreamingReportRenderer,
+                        render_json)
+from .uploads import chunk_digest, commit_session, count_session_rows, find_chunk, store_chunk
+from .validation import validate_report_data
+
+
+def lookup_rate(currency, rates=None):
+    """
+    Get current PLN to 'currency' rate (from the shared rate store, refreshed from api.nbp.pl).
+    :param rates: optional dict used to memoize rates already looked up by the caller
+    """
+    if rates is None:
+        return get_rate(currency)
 
-import requests
-import pytz
-import json
+    try:
+        return rates[currency]
+    except KeyError:
+        rate = rates[currency] = get_rate(currency)
+        return rate
 
 
-class UnsupportedPaymentType(APIException):
-    status_code = status.HTTP_400_BAD_REQUEST
-    default_detail = "Unsupported type of payment"
-    default_code = 'unsupported_payment_type'
+def convert2PLN(amount, currency, rates=None):
+    """Get current PLN to 'currency' rate (from the shared rate store, refreshed from api.nbp.pl)
+    and convert 'amount' to that 'currency'.
+    :param rates: optional dict used to memoize rates already looked up by the caller
+    """
 
+    if currency == PLN:
+        return amount
 
-class ServiceUnavailable(APIException):
-    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
-    default_detail = "Service temporarily unavailable, try again later."
-    default_code = 'service_unavailable'
+    return convert_amount(amount, conversion_ratio(currency, PLN, {currency: lookup_rate(currency, rates)}))
 
 
-def get_payment_mean(payment_type, validated_data):
-    """Get 'payment mean' value based on the type of payment"""
+def get_conversion_ratios(currency, target_currency, rates):
+    """:return: tuple (ratio converting 'currency' to PLN, ratio converting 'currency' to 'target_currency')"""
+    for rate_currency in (currency, target_currency):
+        if rate_currency != PLN:
+            lookup_rate(rate_currency, rates)
 
-    if payment_type == PAY_BY_LINK:
-        return validated_data['bank']
+    return conversion_ratio(currency, PLN, rates), conversion_ratio(currency, target_currency, rates)
 
-    elif payment_type == DIRECT_PAYMENT:
-        return validated_data['iban']
 
-    elif payment_type == CARD:
-        card_number = validated_data['card_number']
+def generate_report(data, rates=None, target_currency=PLN):
+    """
+    Function for generating report as a list of uniform PaymentInfo records.
+    :param data: Parsed received data (e.g from request.data)
+    :param rates: optional dict of rates prefetched by the caller (currency code -> PLN rate)
+    :param target_currency: currency the amounts are converted to in addition to PLN
+                            (with the cross rates of the PLN rates)
+    :return: Report - list of PaymentRecord (or ConvertedPaymentRecord, for other target currency than PLN)
+             objects sorted by date.
+    """
 
-        # mask card_number digits with '*' excluding first 4 and last 4 digits
-        masked_card_number = card_number[:4] + '*' * len(card_number[4:-4]) + card_number[-4:]
-        return "{cardholder_name} {cardholder_surname} {masked_card_number}".format(
-            masked_card_number=masked_card_number,
-            **validated_data)
+    #   validate payment data of all types (or raise 400), sorted by 'created_at' converted to UTC
+    report = validate_report_data(data)
 
+    if rates is None:
+        rates = {}  # rates looked up while generating this report, so the rate store is queried once per currency
 
-def convert2PLN(amount, currency):
-    """Get current PLN to 'currency' rate from api.nbp.pl
-    and convert 'amount' to that 'currency'."""
+    converted = target_currency != PLN
+    if converted and target_currency not in rates:
+        #   take all the cross rates from the same rate table, read at once
+        rates.update(get_stored_rates(FOREIGN_CURRENCIES))
 
-    if currency == 'PLN':
-        return amount
+    #   fill in the converted amounts of the payment records (both amounts in the same pass)
+    ratios = {}
+    for i, record in enumerate(report):
+        try:
+            pln_ratio, target_ratio = ratios[record.currency]
+        except KeyError:
+            pln_ratio, target_ratio = ratios[record.currency] = get_conversion_ratios(record.currency,
+                                                                                      target_currency, rates)
+
+        record.amount_in_pln = convert_amount(record.amount, pln_ratio)
+        if converted:
+            report[i] = ConvertedPaymentRecord(*[getattr(record, name) for name in PaymentRecord.fields],
+                                               target_currency=target_currency,
+                                               amount_in_target_currency=convert_amount(record.amount, target_ratio))
 
-    response = requests.get(f"https://api.nbp.pl/api/exchangerates/rates/a/{currency.lower()}",
-                            params={"format": "json"})
-    if response.status_code == status.HTTP_200_OK:
-        rate = response.json()['rates'][0]['mid']  # get PLN to 'currency' rate fetched from api.nbp.pl
-        return int(amount * rate)
-    else:
-        raise ServiceUnavailable('api.nbp.pl cannot be reached')
+    return report
 
 
-def generate_report(data):
+def generate_rendered_report(data, target_currency=PLN):
     """
-    Function for generating report as a list of uniform PaymentInfo objects.
+    Generate report and render it as json, or get the report rendered earlier for identical data
+    (and identical rates) from the report cache.
     :param data: Parsed received data (e.g from request.data)
-    :return: Report - serializer (that has not undergone validation yet) with list of PaymentInfo objects.
+    :param target_currency: currency the amounts are converted to in addition to PLN
+    :return: tuple (report, rendered report), where report is the list of the payment records,
+             or None if the report was taken from the cache
     """
+    rates = {}
+    key = report_cache_key(data, rates, target_currency)
+    if key is not None:
+        rendered_report = report_cache.get(key)
+        if rendered_report is not None:
+            return None, rendered_report
 
-    validated_data_list = []
+    report = generate_report(data, rates, target_currency)
+    rendered_report = render_json(report)
 
-    for payment_type in data:
-        try:
-            # get serializer for proper payment type or raise 400
-            obj_serializer = SERIALIZERS_DICT[payment_type]
-        except KeyError:
-            raise UnsupportedPaymentType()
+    #   rates missing in the rate store before generating the report are there now
+    key = key or report_cache_key(data, rates, target_currency)
+    if key is not None:
+        report_cache.set(key, rendered_report)
 
-        for obj in data[payment_type]:
+    return report, rendered_report
 
-            #  serialize received payment data using serializer for the proper payment type
-            s = obj_serializer(data=obj)
 
-            #  validate serialized payment data or raise 400
-            if s.is_valid():
-                validated_data = s.validated_data
+def save_report(customer_id, rendered_report, report=None):
+    """
+    Save rendered report for the customer (identified by 'customer_id'), replacing the previous one,
+    together with its rows for the analytics.
+    :param report: rows of the report (payment records), if they are at hand (otherwise decoded from the json)
+    """
+    if report is None:
+        report = parse_json(rendered_report)
 
-                #   convert 'created_at' datetime value to UTC
-                validated_data['created_at'] = validated_data['created_at'].astimezone(pytz.utc)
-                validated_data_list.append((payment_type, validated_data))
-            else:
-                raise ValidationError(s.errors)
+    shard = shard_for(customer_id)
+    r = Report(customer_id=customer_id, content=encode_report(report))
+    with transaction.atomic(using=shard):
+        r.save(using=shard)
+        index_report(customer_id, report)
 
-    # sort validated payment data by 'created_at' value (all 'created_at' datetime objects should already be converted to UTC)
-    validated_data_list.sort(key=lambda x: x[1]['created_at'])
+    #   replace the cached report (at once, and with the saved report once it is committed)
+    saved_report_cache.delete_many([customer_id])
+    transaction.on_commit(lambda: saved_report_cache.set(customer_id, rendered_report, r.saved_at, r.last_accessed),
+                          using=shard)
 
-    payment_info_list = []
 
-    #   populate list of payment_info dicts
-    for payment_type, validated_data in validated_data_list:
-        payment_info_dict = {'date': validated_data['created_at'],
-                             'type': payment_type,
-                             'payment_mean': get_payment_mean(payment_type, validated_data),
-                             'description': validated_data['description'],
-                             'currency': validated_data['currency'],
-                             'amount': validated_data['amount'],
-                             'amount_in_pln': convert2PLN(validated_data['amount'], validated_data['currency'])
-                             }
+class RenderedReportResponse(Response):
+    """
+    Response with the report already rendered as json, which is sent as it is instead of being rendered again
+    (unless an indented json is requested).
+    The report data is decoded from the json only if it is accessed (e.g. by the browsable API).
+    """
 
-        payment_info_list.append(payment_info_dict)
+    def __init__(self, rendered_report, status=None, content_type="application/json"):
+        self.rendered_report = rendered_report
+        super().__init__(data=None, status=status, content_type=content_type)
 
-    #   serialize payment_info_list into report
-    report = PaymentInfoSerializer(data=payment_info_list, many=True)
-    return report
+    @property
+    def data(self):
+        if self._data is None:
+            report = PaymentInfoSerializer(data=parse_json(self.rendered_report), many=True)
+            report.is_valid()
+            self._data = report.validated_data
+        return self._data
 
+    @data.setter
+    def data(self, value):
+        self._data = value
 
-class ReportView(APIView):
+    @property
+    def rendered_content(self):
+        renderer = getattr(self, 'accepted_renderer', None)
+        if not isinstance(renderer, FastJSONRenderer):
+            return super().rendered_content
+
+        if renderer.get_indent(self.accepted_media_type or '', self.renderer_context or {}):
+            #   the compact json is rendered again, indented
+            self.data = parse_json(self.rendered_report)
+            return super().rendered_content
+
+        self['Content-Type'] = self.content_type or self.accepted_renderer.media_type
+        return self.rendered_report
+
+
+#   MessagePack requests and responses are only supported if the msgpack is installed
+MSGPACK_PARSERS = [MessagePackParser] if msgpack is not None else []
+MSGPACK_RENDERERS = [MessagePackRenderer] if msgpack is not None else []
+
+
+class ReportAPIView(APIView):
+    """
+    Base for the report views, parses requests and renders responses with the fast json parser and renderer.
+    Reports can also be rendered as csv or ndjson (negotiated with the 'Accept' header), streamed row by row,
+    and requests and responses can be MessagePack (application/msgpack) for the machine clients.
+    Large responses are compressed (see report_api.compression).
+    """
+    parser_classes = [FastJSONParser, FormParser, MultiPartParser, *MSGPACK_PARSERS]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer, CSVRenderer, NDJSONRenderer, *MSGPACK_RENDERERS]
+    admission_controller = None
+    admission_ticket = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        if request.method in ('POST', 'PUT'):
+            self.admit(request)
+
+    def admit(self, request):
+        """
+        Admit report request (or raise 429/503) based on its estimated number of payment rows,
+        then correct the estimate with the actual number of rows once the body is parsed.
+        """
+        client = BaseThrottle().get_ident(request)
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+
+        self.admission_controller = get_admission_controller()
+        self.admission_ticket = self.admission_controller.admit(client, estimate_rows(content_length))
+        self.admission_controller.resize(self.admission_ticket, self.count_request_rows(request))
+
+    def count_request_rows(self, request):
+        """Count payment rows processed by the request (those of the report request data by default)."""
+        return count_rows(request.data)
+
+    def get_target_currency(self):
+        """Get the currency (besides PLN) the report amounts are converted to, from the 'target_currency' parameter."""
+        target_currency = self.request.query_params.get('target_currency', PLN).upper()
+        if target_currency not in dict(CURRENCY_CHOICES):
+            raise ValidationError({'target_currency': [f'"{target_currency}" is not a valid choice.']})
+        return target_currency
+
+    def streams_report(self):
+        """Check whether the report is rendered with a streaming renderer (e.g. as csv)."""
+        return isinstance(self.request.accepted_renderer, StreamingReportRenderer)
+
+    def streaming_report_response(self, rows, status):
+        """Get response streaming report rows rendered with the accepted renderer."""
+        renderer = self.request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f"{content_type}; charset={renderer.charset}"
+
+        return StreamingHttpResponse(renderer.render_rows(rows), status=status, content_type=content_type)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        #   compress large reports with gzip or brotli (negotiated with the 'Accept-Encoding' header)
+        return compress_response(request, response)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.admission_ticket is not None:
+                self.admission_controller.release(self.admission_ticket)
+
+
+class ReportView(ReportAPIView):
     """
     View for generating uniform payment reports.
     """
 
     def post(self, request):
 
-        report = generate_report(request.data)
+        target_currency = self.get_target_currency()
 
-        #   validate report and send it to user as json or raise 400
-        if report.is_valid():
-            return Response(data=report.validated_data, status=status.HTTP_200_OK,
-                            content_type="application/json")
-        else:
-            return Response(data=report.errors, status=status.HTTP_400_BAD_REQUEST,
-                            content_type="application/json")
+        #   generate report (or raise 400) and stream its rows to user as csv, ndjson or msgpack
+        if self.streams_report():
+            return self.streaming_report_response(generate_report(request.data, target_currency=target_currency),
+                                                  status=status.HTTP_200_OK)
 
+        #   generate report (or raise 400) and send it to user as json
+        _, rendered_report = generate_rendered_report(request.data, target_currency)
 
-class CustomerReportView(APIView):
+        return RenderedReportResponse(rendered_report, status=status.HTTP_200_OK)
+
+
+class CustomerReportView(ReportAPIView):
 
     def get(self, request, pk):
         """
-        Get report that was saved earlier by the customer (identified by 'customer_id')
+        Get report that was saved earlier by the customer (identified by 'customer_id').
+        Only the rows of the (UTC) days between the optional 'date_from' and 'date_to' parameters
+        (YYYY-MM-DD, inclusive), only the 'fields' (comma separated) of the rows, and only a page of the rows
+        ('offset', 'limit') can be requested, which are decoded without decoding the whole report.
         """
+        filters = self.get_report_filters()
+        if filters:
+            return self.filtered_report_response(pk, filters)
+
+        #   Get the last report saved by the customer from the cache, or from the database (or raise 404)
+        rows = None
+        cached_report = saved_report_cache.get(pk)
+        if cached_report is None:
+            r = get_object_or_404(Report.objects.using(shard_for(pk)), customer_id=pk)
+            if self.streams_report() and is_columnar(r.content):
+                #   decoded rows are streamed as they are, and rendered as json for the cache, unless the report
+                #   is too large to be cached (its json is larger than the stored report)
+                rows = decode_report(r.content)
+                content = render_json(rows) if r.size <= saved_report_cache.max_item_size else None
+            else:
+                content = render_report(r.content)
+            accessed = touch_report(pk, r.last_accessed)
+            if content is not None:
+                saved_report_cache.add(pk, content, r.saved_at, accessed)
+        else:
+            content, saved_at, last_accessed = cached_report
+            accessed = touch_report(pk, last_accessed)
+            if accessed != last_accessed:
+                saved_report_cache.touch(pk, content, saved_at, accessed)
+
+        #   stream rows of the saved report as csv, ndjson or msgpack
+        if self.streams_report():
+            response = self.streaming_report_response(rows if rows is not None else parse_json(content),
+                                                      status=status.HTTP_200_OK)
+        else:
+            response = RenderedReportResponse(content, status=status.HTTP_200_OK)
 
-        #   Fetch from the database the last report saved by the customer or raise 404
-        r = get_object_or_404(Report, customer_id=pk)
-
-        report = PaymentInfoSerializer(data=json.loads(r.content), many=True)
-        report.is_valid()
+        response['X-Cache'] = 'MISS' if cached_report is None else 'HIT'
+        return response
 
-        return Response(data=report.validated_data, status=status.HTTP_200_OK)
+    def get_report_filters(self):
+        """
+        Get the rows and fields of the saved report requested with the query parameters.
+        :return: dict of the decode_report arguments (empty if the whole report is requested)
+        :raise ValidationError: for invalid parameters
+        """
+        query_params = self.request.query_params
+        filters = {}
+        errors = {}
+
+        dates = get_date_params(query_params, errors)
+        if dates['date_from'] is not None:
+            filters['start'] = day_start(dates['date_from'])
+        if dates['date_to'] is not None:
+            filters['end'] = day_start(dates['date_to'] + timedelta(days=1))
+
+        if 'fields' in query_params:
+            fields = [field for field in query_params['fields'].split(',') if field]
+            unknown_fields = [field for field in fields if field not in ConvertedPaymentRecord.fields]
+            if unknown_fields:
+                errors['fields'] = [f'"{field}" is not a valid choice.' for field in unknown_fields]
+            elif not fields:
+                errors['fields'] = ["At least one field is required."]
+            filters['fields'] = fields
+
+        for name in ('offset', 'limit'):
+            if name in query_params:
+                try:
+                    filters[name] = int(query_params[name])
+                except ValueError:
+                    filters[name] = -1
+                if filters[name] < 0:
+                    errors[name] = ["A valid non-negative integer is required."]
+
+        if errors:
+            raise ValidationError(errors)
+        return filters
+
+    def filtered_report_response(self, pk, filters):
+        """Get response with the requested rows and fields of the saved report, decoded from the database."""
+        r = get_object_or_404(Report.objects.using(shard_for(pk)), customer_id=pk)
+        touch_report(pk, r.last_accessed)
+        rows = decode_report(r.content, **filters)
+
+        #   stream the rows as csv, ndjson or msgpack
+        if self.streams_report():
+            return self.streaming_report_response(rows, status=status.HTTP_200_OK)
+        return Response(data=rows, status=status.HTTP_200_OK)
 
     def post(self, request, pk):
         """
         Generate payment report and save it for the particular customer (identified by 'customer_id').
         """
 
-        report = generate_report(request.data)
+        target_currency = self.get_target_currency()
 
-        #   validate report and save it for the user identified with 'customer_id' and send it to user as json or raise 400
-        if report.is_valid():
+        #   generate report (or raise 400)
+        if self.streams_report():
+            report = generate_report(request.data, target_currency=target_currency)
+            rendered_report = render_json(report)
+        else:
+            report, rendered_report = generate_rendered_report(request.data, target_currency)
 
-            #   saves json for the report as binary in the database
-            r = Report(customer_id=pk, content=JSONRenderer().render(data=report.validated_data))
-            r.save()
+        #   saves the report in the database for the user identified with 'customer_id'
+        save_report(pk, rendered_report, report)
 
-            return Response(data=report.validated_data, status=status.HTTP_201_CREATED,
-                            content_type="application/json")
-        else:
-            return Response(data=report.errors, status=status.HTTP_400_BAD_REQUEST,
-                            content_type="application/json")
+        #   stream report rows to user as csv, ndjson or msgpack
+        if self.streams_report():
+            return self.streaming_report_response(report, status=status.HTTP_201_CREATED)
+
+        return RenderedReportResponse(rendered_report, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionListView(ReportAPIView):
+    """
+    View for opening sessions of reports uploaded in many chunks.
+    """
+
+    def post(self, request, pk):
+        """
+        Open upload session of the report for the customer (identified by 'customer_id').
+        """
+        session = UploadSession.objects.using(shard_for(pk)).create(customer_id=pk,
+                                                                    target_currency=self.get_target_currency())
+
+        return Response(data=session_to_dict(session), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(ReportAPIView):
+    """
+    View for checking (e.g. which chunks have to be sent again after a failure) and aborting the upload sessions.
+    """
+
+    def get(self, request, pk, session_id):
+        session = get_object_or_404(UploadSession.objects.using(shard_for(pk)), id=session_id, customer_id=pk)
+
+        return Response(data=session_to_dict(session), status=status.HTTP_200_OK)
+
+    def delete(self, request, pk, session_id):
+        get_object_or_404(UploadSession.objects.using(shard_for(pk)), id=session_id, customer_id=pk).delete()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(ReportAPIView):
+    """
+    View for uploading chunks of the report.
+    """
+
+    def put(self, request, pk, session_id, number):
+        """
+        Validate and convert chunk of payments (in the report request format) and store it as a sorted run.
+        Sending the same chunk again is idempotent.
+        """
+        if number < 1:
+            raise ValidationError({'number': ["Chunks are numbered from 1."]})
+
+        session = get_object_or_404(UploadSession.objects.using(shard_for(pk)), id=session_id, customer_id=pk)
+        digest = chunk_digest(request.data)
+
+        chunk = find_chunk(session, number, digest)
+        created = False
+        if chunk is None:
+            #   generate report of the chunk (or raise 400)
+            report = generate_report(request.data, target_currency=session.target_currency)
+            chunk, created = store_chunk(session, number, digest, report)
+
+        return Response(data={'chunk': chunk.number, 'rows': chunk.row_count},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class UploadCommitView(ReportAPIView):
+    """
+    View for committing the upload sessions.
+    """
+
+    def count_request_rows(self, request):
+        """Committed report has the rows of all the uploaded chunks (the body of the request is empty)."""
+        return max(1, count_session_rows(self.kwargs['pk'], self.kwargs['session_id']))
+
+    def post(self, request, pk, session_id):
+        """
+        Merge the uploaded chunks into the report and save it for the customer (identified by 'customer_id').
+        Session without chunks, or with some of them missing, is rejected with 400.
+        """
+        session = get_object_or_404(UploadSession.objects.using(shard_for(pk)), id=session_id, customer_id=pk)
+        report, rendered_report = commit_session(session, save_report)
+
+        #   stream report rows to user as csv, ndjson or msgpack
+        if self.streams_report():
+            return self.streaming_report_response(report, status=status.HTTP_201_CREATED)
+
+        return RenderedReportResponse(rendered_report, status=status.HTTP_201_CREATED)
+
+
+def get_date_params(query_params, errors):
+    """
+    Get the optional 'date_from' and 'date_to' parameters (YYYY-MM-DD), adding their errors to 'errors'.
+    :return: dict with the 'date_from' and 'date_to' dates (None if not given)
+    """
+    dates = {}
+    for name in ('date_from', 'date_to'):
+        value = query_params.get(name)
+        try:
+            dates[name] = parse_date(value) if value else None
+        except ValueError:
+            dates[name] = None
+        if value and dates[name] is None:
+            errors[name] = ["Date has wrong format. Use YYYY-MM-DD."]
+    return dates
+
+
+def day_start(day):
+    """Get the start (datetime) of the UTC day."""
+    return datetime.combine(day, time.min, tzinfo=pytz.utc)
+
+
+def session_to_dict(session):
+    return {'session': session.id,
+            'customer_id': session.customer_id,
+            'target_currency': session.target_currency,
+            'created_at': session.created_at,
+            'chunks': [{'chunk': number, 'rows': row_count}
+                       for number, row_count in session.chunks.order_by('number').values_list('number', 'row_count')]}
+
+
+class AnalyticsView(APIView):
+    """
+    View for the payment totals across the saved reports of all the customers (for the admin users).
+    """
+    permission_classes = [IsAdminUser]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer, CSVRenderer]
+
+    def get(self, request):
+        """
+        Get number of payments and their total amount in PLN, grouped by the 'group_by' parameter
+        (comma separated 'day', 'type' and/or 'currency', 'day' by default), for the (UTC) days between
+        the optional 'date_from' and 'date_to' parameters (YYYY-MM-DD, inclusive).
+        """
+        group_by = [field for field in request.query_params.get('group_by', 'day').split(',') if field]
+        errors = {}
+
+        unknown_fields = [field for field in group_by if field not in GROUP_BY_FIELDS]
+        if unknown_fields:
+            errors['group_by'] = [f'"{field}" is not a valid choice.' for field in unknown_fields]
+
+        dates = get_date_params(request.query_params, errors)
+
+        if errors:
+            raise ValidationError(errors)
+
+        return Response(data=aggregate_payments(group_by, **dates), status=status.HTTP_200_OK)